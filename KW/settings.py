@@ -117,6 +117,17 @@ CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULTS_SERIALIZER = 'json'
 CELERY_TIMEZONE = MY_TIME_ZONE
+# How often the visits buffered by SetLastVisitMiddleware are saved to the profiles.
+LAST_VISIT_FLUSH_INTERVAL_SECONDS = env.int("LAST_VISIT_FLUSH_INTERVAL_SECONDS", default=5 * 60)
+# sync_all_users_to_wk spreads its users over this window rather than enqueueing them all at once. Keep it shorter
+# than the beat interval so that batches don't overlap.
+SYNC_ALL_USERS_SPREAD_SECONDS = env.int("SYNC_ALL_USERS_SPREAD_SECONDS", default=11 * 60 * 60)
+# How often release_sync_batch hands the users whose slots have come up to the workers. Keep it well below the
+# broker's visibility timeout, as that is the longest countdown a released sync can have.
+SYNC_BATCH_RELEASE_INTERVAL_SECONDS = env.int("SYNC_BATCH_RELEASE_INTERVAL_SECONDS", default=60)
+# How often the WaniKani rate limiter's cluster-wide metrics are logged.
+WANIKANI_RATE_LIMIT_METRICS_INTERVAL_SECONDS = env.int("WANIKANI_RATE_LIMIT_METRICS_INTERVAL_SECONDS", default=15 * 60)
+
 CELERY_BEAT_SCHEDULE = {
     'all_user_srs_every_hour': {
         'task': 'kw_webapp.tasks.all_srs',
@@ -126,6 +137,18 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'kw_webapp.tasks.sync_all_users_to_wk',
         'schedule': timedelta(hours=12),
         'options': {'queue': 'long_running_sync'}
+    },
+    'release_sync_batch': {
+        'task': 'kw_webapp.tasks.release_sync_batch',
+        'schedule': timedelta(seconds=SYNC_BATCH_RELEASE_INTERVAL_SECONDS)
+    },
+    'flush_last_visits': {
+        'task': 'kw_webapp.tasks.flush_last_visits',
+        'schedule': timedelta(seconds=LAST_VISIT_FLUSH_INTERVAL_SECONDS)
+    },
+    'log_wanikani_rate_limiter_metrics': {
+        'task': 'kw_webapp.tasks.log_wanikani_rate_limiter_metrics',
+        'schedule': timedelta(seconds=WANIKANI_RATE_LIMIT_METRICS_INTERVAL_SECONDS)
     }
 }
 
@@ -218,6 +241,58 @@ DATABASES = {
 
 DB_ENGINE = DATABASES['default']['ENGINE'].split(".")[-1]
 
+# WaniKani API client
+# Point this at `manage.py fake_wanikani` to load test syncing without touching the real WaniKani.
+WANIKANI_API_ROOT = env("WANIKANI_API_ROOT", default="https://www.wanikani.com/api")
+WANIKANI_CONNECT_TIMEOUT = env.float("WANIKANI_CONNECT_TIMEOUT", default=3.05)
+WANIKANI_READ_TIMEOUT = env.float("WANIKANI_READ_TIMEOUT", default=30)
+WANIKANI_MAX_RETRIES = env.int("WANIKANI_MAX_RETRIES", default=3)
+WANIKANI_RETRY_BACKOFF_SECONDS = env.float("WANIKANI_RETRY_BACKOFF_SECONDS", default=0.5)
+WANIKANI_CONNECTION_POOL_SIZE = env.int("WANIKANI_CONNECTION_POOL_SIZE", default=10)
+WANIKANI_MAX_CONCURRENT_PAGES_PER_USER = env.int("WANIKANI_MAX_CONCURRENT_PAGES_PER_USER", default=4)
+WANIKANI_API_KEY_VALIDATION_TTL_SECONDS = env.int("WANIKANI_API_KEY_VALIDATION_TTL_SECONDS", default=60 * 60)
+# Upper bound on a single user's sync. Overlapping sync requests for a user are coalesced while one holds the lease.
+WANIKANI_SYNC_LEASE_SECONDS = env.int("WANIKANI_SYNC_LEASE_SECONDS", default=15 * 60)
+# How long the status of background jobs (sync, unlock, reset) can be polled for.
+JOB_STATUS_TTL_SECONDS = env.int("JOB_STATUS_TTL_SECONDS", default=24 * 60 * 60)
+# Locking a level or resetting an account deletes the user's reviews this many at a time.
+REVIEW_DELETE_BATCH_SIZE = env.int("REVIEW_DELETE_BATCH_SIZE", default=500)
+# Logging in only triggers a sync if the user hasn't been synced for this long.
+LOGIN_SYNC_DEBOUNCE_SECONDS = env.int("LOGIN_SYNC_DEBOUNCE_SECONDS", default=15 * 60)
+
+# Redis connection used for cross-worker coordination, e.g. the WaniKani rate limiter.
+REDIS_CONNECTION_URL = env("REDIS_CONNECTION_URL", default=CELERY_BROKER_URL)
+REDIS_SOCKET_TIMEOUT = env.float("REDIS_SOCKET_TIMEOUT", default=0.5)
+
+# Each process records a user's visit in redis at most this often.
+LAST_VISIT_WRITE_INTERVAL_SECONDS = env.int("LAST_VISIT_WRITE_INTERVAL_SECONDS", default=5 * 60)
+
+# Token buckets shared by every worker talking to WaniKani: one global, and one per API key.
+WANIKANI_RATE_LIMIT_ENABLED = env.bool("WANIKANI_RATE_LIMIT_ENABLED", default=True)
+WANIKANI_GLOBAL_REQUESTS_PER_SECOND = env.float("WANIKANI_GLOBAL_REQUESTS_PER_SECOND", default=10)
+WANIKANI_GLOBAL_BURST = env.int("WANIKANI_GLOBAL_BURST", default=20)
+WANIKANI_PER_KEY_REQUESTS_PER_SECOND = env.float("WANIKANI_PER_KEY_REQUESTS_PER_SECOND", default=1)
+WANIKANI_PER_KEY_BURST = env.int("WANIKANI_PER_KEY_BURST", default=5)
+WANIKANI_RATE_LIMIT_MAX_WAIT_SECONDS = env.float("WANIKANI_RATE_LIMIT_MAX_WAIT_SECONDS", default=60)
+# The same, for WaniKani calls made while serving a web request, e.g. validating an API key.
+WANIKANI_INTERACTIVE_RATE_LIMIT_MAX_WAIT_SECONDS = env.float("WANIKANI_INTERACTIVE_RATE_LIMIT_MAX_WAIT_SECONDS",
+                                                             default=2)
+
+# Memory-mapped catalog snapshot shared by all web workers. Built with `manage.py build_catalog_snapshot`. It is rebuilt
+# by the celery workers when the catalog changes, so the path must be on storage they share with the web nodes; a node
+# which can't see the rebuilt file serves vocabulary from the database instead.
+CATALOG_SNAPSHOT_PATH = env("CATALOG_SNAPSHOT_PATH", default=root("catalog.snapshot"))
+# How often each web process checks whether the snapshot has been replaced or gone stale.
+CATALOG_SNAPSHOT_CHECK_INTERVAL_SECONDS = env.int("CATALOG_SNAPSHOT_CHECK_INTERVAL_SECONDS", default=10)
+# After the catalog changes, a deployed snapshot is rebuilt this long afterwards, coalescing the changes made meanwhile.
+CATALOG_SNAPSHOT_REBUILD_DELAY_SECONDS = env.int("CATALOG_SNAPSHOT_REBUILD_DELAY_SECONDS", default=60)
+
+# Backfills (`manage.py run_backfill`) work through tables in primary key batches of this size, pausing after each batch
+# for at least BACKFILL_SLEEP_SECONDS, and for BACKFILL_THROTTLE_RATIO times as long as the batch took.
+BACKFILL_BATCH_SIZE = env.int("BACKFILL_BATCH_SIZE", default=1000)
+BACKFILL_SLEEP_SECONDS = env.float("BACKFILL_SLEEP_SECONDS", default=0.1)
+BACKFILL_THROTTLE_RATIO = env.float("BACKFILL_THROTTLE_RATIO", default=1.0)
+
 LANGUAGE_CODE = 'en-us'
 USE_I18N = True
 USE_L10N = True
@@ -9,7 +9,8 @@ from django.db.models.functions import TruncHour, TruncDate
 from rest_framework import serializers
 
 from api import serializer_fields
-from api.validators import WanikaniApiKeyValidator
+from api.validators import WanikaniApiKeyValidator, is_current_valid_key
+from kw_webapp.catalog_snapshot import get_catalog_snapshot
 from kw_webapp.constants import KwSrsLevel, KANIWANI_SRS_LEVELS, STREAK_TO_SRS_LEVEL_MAP_KW
 from kw_webapp.models import Profile, Vocabulary, UserSpecific, Reading, Level, Tag, AnswerSynonym, \
     FrequentlyAskedQuestion, Announcement, Report, MeaningSynonym
@@ -112,8 +113,7 @@ class ProfileSerializer(serializers.ModelSerializer):
     # upcoming_reviews = DetailedUpcomingReviewCountSerializer(source='user', many=False, read_only=True)
     upcoming_reviews = SimpleUpcomingReviewSerializer(source='user', many=False, read_only=True)
     join_date = serializers.SerializerMethodField()
-    api_key = serializers.CharField(max_length=32, validators=[WanikaniApiKeyValidator(), ])
-
+    api_key = serializers.CharField(max_length=32)
 
     class Meta:
         model = Profile
@@ -131,6 +131,12 @@ class ProfileSerializer(serializers.ModelSerializer):
                             'reviews_within_hour_count', 'srs_counts',
                             'next_review_date', 'last_wanikani_sync_date', 'join_date')
 
+    def validate_api_key(self, value):
+        # An unchanged, already valid key doesn't need checking with WaniKani again.
+        if is_current_valid_key(self.instance, value):
+            return value
+        return WanikaniApiKeyValidator()(value)
+
     def get_join_date(self, obj):
         """
         So this is a hack. By default the modelserializer expects a datefield, but a fewww users have datetimefields as their join_date,
@@ -276,10 +282,28 @@ class VocabularySerializer(serializers.ModelSerializer):
     def __init__(self, *args, **kwargs):
         super(VocabularySerializer, self).__init__(*args, **kwargs)
         # If this is part of the review response, simply omit the review field, reducing DB calls.
-        if 'nested_in_review' in self.context:
+        self.nested_in_review = 'nested_in_review' in self.context
+        if self.nested_in_review:
             self.fields.pop('review')
             self.fields.pop('is_reviewable')
 
+    def get_attribute(self, instance):
+        # Nested in a review, only the catalog record is needed. If the snapshot is mapped, serve it from there rather
+        # than loading the vocabulary, its readings and their parts of speech from the database.
+        if self.nested_in_review and get_catalog_snapshot() is not None:
+            return instance.vocabulary_id
+        return super(VocabularySerializer, self).get_attribute(instance)
+
+    def to_representation(self, instance):
+        if self.nested_in_review and not isinstance(instance, Vocabulary):
+            snapshot = get_catalog_snapshot()
+            record = snapshot.get(instance) if snapshot is not None else None
+            if record is not None:
+                return record
+            # Vocabulary created since the snapshot was built.
+            instance = Vocabulary.objects.get(pk=instance)
+        return super(VocabularySerializer, self).to_representation(instance)
+
     readings = ReadingSerializer(many=True, read_only=True)
     review = serializers.SerializerMethodField()
     is_reviewable = serializers.SerializerMethodField()
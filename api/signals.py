@@ -18,7 +18,8 @@ def create_auth_token(sender, instance=None, created=False, **kwargs):
 def sync_unlocks_with_wk(sender, **kwargs):
     if kwargs['user']:
         user = kwargs['user']
-        sync_with_wk(user.id, full_sync=user.profile.follow_me)
+        # Don't keep the registration request waiting on WaniKani.
+        sync_with_wk.delay(user.id, full_sync=user.profile.follow_me)
 
 
 user_registered.connect(sync_unlocks_with_wk)
@@ -3,7 +3,7 @@ from rest_framework.routers import DefaultRouter
 from rest_framework_jwt import views as jwtviews
 from api.views import ReviewViewSet, VocabularyViewSet, ReadingViewSet, LevelViewSet, ReadingSynonymViewSet, \
     FrequentlyAskedQuestionViewSet, AnnouncementViewSet, UserViewSet, ContactViewSet, ProfileViewSet, ReportViewSet, \
-    MeaningSynonymViewSet
+    MeaningSynonymViewSet, JobViewSet
 
 router = DefaultRouter()
 router.register(r'review', ReviewViewSet, base_name="review")
@@ -18,6 +18,7 @@ router.register(r'faq', FrequentlyAskedQuestionViewSet, base_name='faq')
 router.register(r'announcement', AnnouncementViewSet, base_name='announcement')
 router.register(r'user', UserViewSet, base_name='user')
 router.register(r'contact', ContactViewSet, base_name='contact')
+router.register(r'job', JobViewSet, base_name='job')
 
 urlpatterns = router.urls + [
     url(r'^auth/login/', jwtviews.obtain_jwt_token),
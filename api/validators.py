@@ -1,21 +1,56 @@
-import requests
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
 from rest_framework import serializers
 
-from kw_webapp.tasks import build_user_information_api_string
+from kw_webapp.wanikani import get_client, exceptions
+
+API_KEY_VALIDATION_KEY = "wanikani_api_key_valid:{}"
+
+
+def is_current_valid_key(profile, value):
+    """
+    :return: True if the key is the one already saved, as valid, on the profile being updated.
+    """
+    return getattr(profile, 'api_key', None) == value and getattr(profile, 'api_valid', False)
 
 
 class WanikaniApiKeyValidator(object):
+    """
+    Checks an API key against WaniKani. Outcomes are cached for WANIKANI_API_KEY_VALIDATION_TTL_SECONDS by a hash of
+    the key.
+
+    Validators are shared by every request a serializer class handles, so this one holds no per-request state. To skip
+    the check for a key which is already saved on the object being updated, use is_current_valid_key in the serializer.
+    """
 
     def __init__(self):
         self.failure_message = "This API key appears to be invalid"
 
+    def _check_with_wanikani(self, value):
+        try:
+            # This runs while a web worker waits, so don't queue behind background syncs for long.
+            json_data = get_client().get_user_information(
+                value, max_rate_limit_wait=settings.WANIKANI_INTERACTIVE_RATE_LIMIT_MAX_WAIT_SECONDS)
+        except exceptions.InvalidWaniKaniKey:
+            return False
+        except exceptions.WanikaniAPIException:
+            # WaniKani is having trouble, so we don't know either way. Don't remember this.
+            return None
+
+        # WK Seems to often change what their failure state is, lets check instead for positive state.
+        return "user_information" in json_data.keys()
+
     def __call__(self, value):
-        api_string = build_user_information_api_string(value)
-        r = requests.get(api_string)
-        if r.status_code == 200:
-            json_data = r.json()
-            # WK Seems to often change what their failure state is, lets check instead for positive state.
-            if "user_information" in json_data.keys():
-                return value
+        cache_key = API_KEY_VALIDATION_KEY.format(hashlib.sha256(value.encode("utf-8")).hexdigest())
+        is_valid = cache.get(cache_key)
+        if is_valid is None:
+            is_valid = self._check_with_wanikani(value)
+            if is_valid is not None:
+                cache.set(cache_key, is_valid, settings.WANIKANI_API_KEY_VALIDATION_TTL_SECONDS)
+
+        if is_valid:
+            return value
 
         raise serializers.ValidationError(self.failure_message)
@@ -5,7 +5,7 @@ from rest_framework import mixins
 from rest_framework import status
 from rest_framework import viewsets
 from rest_framework.decorators import list_route, detail_route, permission_classes
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import PermissionDenied, NotFound
 from rest_framework.generics import get_object_or_404
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
@@ -22,9 +22,10 @@ from kw_webapp import constants
 from kw_webapp.forms import UserContactCustomForm
 from kw_webapp.models import Vocabulary, UserSpecific, Reading, Level, AnswerSynonym, FrequentlyAskedQuestion, \
     Announcement, Profile, Report, MeaningSynonym
-from kw_webapp.tasks import get_users_current_reviews, unlock_eligible_vocab_from_levels, lock_level_for_user, \
-    get_users_critical_reviews, sync_with_wk, all_srs, sync_user_profile_with_wk, user_returns_from_vacation, \
-    user_begins_vacation, follow_user, reset_user, get_users_lessons
+from kw_webapp.tasks import get_users_current_reviews, \
+    get_users_critical_reviews, all_srs, sync_user_profile_with_wk, user_returns_from_vacation, \
+    user_begins_vacation, get_users_lessons, start_job, get_job_owner, get_job_status, sync_with_wk_job, \
+    unlock_level_job, lock_level_job, reset_user_job, follow_user_job
 
 
 from KW.LoggingMiddleware import RequestLoggingMixin
@@ -32,6 +33,12 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+def _job_accepted(request, job_id):
+    return Response({"job_id": job_id,
+                     "job_url": reverse_lazy("api:job-detail", args=(job_id,), request=request)},
+                    status=status.HTTP_202_ACCEPTED)
+
+
 class ListRetrieveUpdateViewSet(mixins.ListModelMixin,
                                 mixins.UpdateModelMixin,
                                 mixins.RetrieveModelMixin,
@@ -70,10 +77,13 @@ class LevelViewSet(RequestLoggingMixin, viewsets.ReadOnlyModelViewSet):
     Return a list of all levels and related information.
 
     unlock:
-    Unlock the given level for a particular user. This will add all the vocabulary of that level to their review queue immediately
+    Unlock the given level for a particular user. This will add all the vocabulary of that level to their review queue.
+    Runs in the background, poll the returned `job_url` for the outcome.
 
     lock:
-    Lock the given level for a particular user. This will wipe away ALL related SRS information for these vocabulary as well.
+    Lock the given level for a particular user. Their reviews of its vocabulary are archived, and restored along with
+    their SRS information if the level is unlocked again. Runs in the background, poll the returned `job_url` for the
+    outcome.
     """
     queryset = Level.objects.all()
     serializer_class = LevelSerializer
@@ -117,12 +127,7 @@ class LevelViewSet(RequestLoggingMixin, viewsets.ReadOnlyModelViewSet):
         if int(requested_level) > user.profile.level:
             return Response(status=status.HTTP_403_FORBIDDEN)
 
-        unlocked_this_request, total_unlocked, locked = unlock_eligible_vocab_from_levels(user, requested_level)
-        user.profile.unlocked_levels.get_or_create(level=requested_level)
-
-        return Response(dict(unlocked_now=unlocked_this_request,
-                             total_unlocked=total_unlocked,
-                             locked=locked))
+        return _job_accepted(request, start_job(unlock_level_job, user, int(requested_level)))
 
     @detail_route(methods=['POST'])
     def lock(self, request, pk=None):
@@ -130,9 +135,7 @@ class LevelViewSet(RequestLoggingMixin, viewsets.ReadOnlyModelViewSet):
         if request.user.profile.level == int(requested_level):
             request.user.profile.follow_me = False
             request.user.profile.save()
-        removed_count = lock_level_for_user(requested_level, request.user)
-
-        return Response({"locked": removed_count})
+        return _job_accepted(request, start_job(lock_level_job, request.user, int(requested_level)))
 
 
 class VocabularyViewSet(RequestLoggingMixin, viewsets.ReadOnlyModelViewSet):
@@ -353,13 +356,14 @@ class UserViewSet(RequestLoggingMixin, viewsets.GenericViewSet, generics.ListCre
     we PUT changes to the nested profile.
 
     sync:
-    Force a sync to the Wanikani server.
+    Force a sync to the Wanikani server. Runs in the background, poll the returned `job_url` for the outcome.
 
     srs:
     Force an SRS run (typically runs every 15 minutes anyhow).
 
     reset:
     Reset a user's account. Removes all reviews, re-locks all levels. Immediately runs unlock on current level afterwards.
+    Runs in the background, poll the returned `job_url` for the outcome.
     """
     permission_classes = (IsAuthenticatedOrCreating,)
     serializer_class = UserSerializer
@@ -382,10 +386,7 @@ class UserViewSet(RequestLoggingMixin, viewsets.GenericViewSet, generics.ListCre
         if 'full_sync' in request.data:
             should_full_sync = request.data['full_sync'] == 'true'
 
-        profile_sync_succeeded, new_review_count, new_synonym_count = sync_with_wk(request.user.id, should_full_sync)
-        return Response({"profile_sync_succeeded": profile_sync_succeeded,
-                         "new_review_count": new_review_count,
-                         "new_synonym_count": new_synonym_count})
+        return _job_accepted(request, start_job(sync_with_wk_job, request.user, should_full_sync))
 
     @list_route(methods=['POST'])
     def srs(self, request):
@@ -399,8 +400,7 @@ class UserViewSet(RequestLoggingMixin, viewsets.GenericViewSet, generics.ListCre
         if reset_to_level is None:
             return HttpResponseBadRequest("You must pass a level to reset to.")
 
-        reset_user(request.user, reset_to_level)
-        return Response({"message": "Your account has been reset"})
+        return _job_accepted(request, start_job(reset_user_job, request.user, reset_to_level))
 
 
 class ProfileViewSet(RequestLoggingMixin, ListRetrieveUpdateViewSet, viewsets.GenericViewSet):
@@ -413,11 +413,22 @@ class ProfileViewSet(RequestLoggingMixin, ListRetrieveUpdateViewSet, viewsets.Ge
     def get_queryset(self):
         return Profile.objects.filter(user=self.request.user)
 
-    def perform_update(self, serializer):
+    def update(self, request, *args, **kwargs):
+        self.follow_job_id = None
+        response = super().update(request, *args, **kwargs)
+        if self.follow_job_id is not None:
+            # Turning on follow_me syncs the user in the background, poll the returned `job_url` for the outcome.
+            response.data.update(_job_accepted(request, self.follow_job_id).data)
+            response.status_code = status.HTTP_202_ACCEPTED
+        return response
 
+    def perform_update(self, serializer):
+        starts_following = not serializer.instance.follow_me and serializer.validated_data.get('follow_me')
         serializer = self._update_calculated_fields(serializer)
         instance = serializer.save()
-        return Response(instance)
+        if starts_following:
+            # The job has to see the saved profile, and must not overwrite it with a stale one.
+            self.follow_job_id = start_job(follow_user_job, instance.user, on_commit=True)
 
     def _update_calculated_fields(self, serializer):
         old_instance = serializer.instance
@@ -430,9 +441,6 @@ class ProfileViewSet(RequestLoggingMixin, ListRetrieveUpdateViewSet, viewsets.Ge
         if not old_instance.on_vacation and serializer.validated_data.get('on_vacation'):
             user_begins_vacation(user)
 
-        if not old_instance.follow_me and serializer.validated_data.get('follow_me'):
-            follow_user(user)
-
         # Since if we have gotten this far, we know that API key is valid, we set it here.
         api_validated = serializer.validated_data.get('api_key', None)
         if api_validated:
@@ -460,3 +468,17 @@ class ContactViewSet(RequestLoggingMixin, generics.CreateAPIView, viewsets.Gener
         # return Response({"detail": "Successfully sent contact email"}, status=status.HTTP_202_ACCEPTED)
 
 
+
+
+class JobViewSet(RequestLoggingMixin, viewsets.ViewSet):
+    """
+    Status of a background job, as started by syncing, unlocking a level or resetting an account. `status` is one of
+    PENDING, PROGRESS, SUCCESS or FAILURE. While running `progress` describes the current step, and once done `result`
+    holds what the job would have returned.
+    """
+    permission_classes = (IsAuthenticated,)
+
+    def retrieve(self, request, pk=None):
+        if get_job_owner(pk) != request.user.id:
+            raise NotFound()
+        return Response(get_job_status(pk))
@@ -0,0 +1,155 @@
+"""
+Online backfills: data fixes which are safe to run against the full tables while production traffic is being served.
+
+A backfill walks its queryset in primary key order, a bounded batch at a time. Each batch is written with set-based UPDATEs
+in its own short transaction, after which progress is checkpointed to the database and the backfill pauses, so that it
+never holds locks for long or starves live queries of the database. An interrupted run resumes from its checkpoint.
+
+To add one, subclass Backfill, give it a name and a model, and either return set-based update expressions from
+get_updates or override process_batch, then decorate it with @register.
+"""
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+import logging
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from kw_webapp import constants
+from kw_webapp.models import BackfillCheckpoint, UserSpecific
+from kw_webapp.tasks import bulk_update_field
+
+logger = logging.getLogger(__name__)
+
+BACKFILLS = OrderedDict()
+
+
+def register(backfill_class):
+    BACKFILLS[backfill_class.name] = backfill_class
+    return backfill_class
+
+
+class Backfill(object):
+    name = None
+    model = None
+
+    def get_queryset(self):
+        """
+        The rows this backfill applies to. Rows outside of it are skipped, but still count towards batch boundaries.
+        """
+        return self.model._base_manager.all()
+
+    def get_updates(self):
+        """
+        :return: dictionary of field name -> value or expression, applied to each batch with a single update().
+        """
+        raise NotImplementedError
+
+    def process_batch(self, batch):
+        """
+        Applies the fix to one batch of rows. Called inside a transaction.
+
+        :param batch: queryset restricted to the batch's primary key range.
+        :return: the number of rows updated.
+        """
+        return batch.update(**self.get_updates())
+
+
+def _batch_upper_bound(queryset, lower_bound, batch_size, max_pk):
+    # Batches are bounded by row count rather than a fixed width of ids, so gaps in the ids don't produce empty
+    # batches. Finding the bound is an index-only range scan on the primary key.
+    pks = queryset.filter(pk__gt=lower_bound).order_by('pk').values_list('pk', flat=True)
+    bound = list(pks[batch_size - 1:batch_size])
+    return bound[0] if bound else max_pk
+
+
+def run_backfill(backfill, batch_size=None, sleep_seconds=None, throttle_ratio=None, max_batches=None, restart=False):
+    """
+    Runs (or resumes) a backfill to completion, or for max_batches batches.
+
+    :param backfill: a Backfill instance.
+    :param batch_size: rows per batch. Defaults to settings.BACKFILL_BATCH_SIZE.
+    :param sleep_seconds: minimum pause after each batch. Defaults to settings.BACKFILL_SLEEP_SECONDS.
+    :param throttle_ratio: the pause is at least this many times as long as the batch took, so the backfill keeps the
+    database busy at most 1 / (1 + throttle_ratio) of the time. Defaults to settings.BACKFILL_THROTTLE_RATIO.
+    :param max_batches: stop after this many batches, leaving the checkpoint to resume from.
+    :param restart: if True, ignore any previous progress and start from the beginning of the table.
+    :return: the backfill's BackfillCheckpoint.
+    """
+    batch_size = settings.BACKFILL_BATCH_SIZE if batch_size is None else batch_size
+    sleep_seconds = settings.BACKFILL_SLEEP_SECONDS if sleep_seconds is None else sleep_seconds
+    throttle_ratio = settings.BACKFILL_THROTTLE_RATIO if throttle_ratio is None else throttle_ratio
+
+    checkpoint, _ = BackfillCheckpoint.objects.get_or_create(name=backfill.name)
+    if restart:
+        checkpoint.last_pk = checkpoint.rows_updated = 0
+        checkpoint.completed_at = None
+        checkpoint.save()
+
+    # Rows inserted after the backfill starts are the application's responsibility, not the backfill's.
+    table = backfill.model._base_manager.all()
+    max_pk = table.aggregate(max_pk=Max('pk'))['max_pk'] or 0
+    queryset = backfill.get_queryset()
+    batch_count = 0
+    while checkpoint.last_pk < max_pk and (max_batches is None or batch_count < max_batches):
+        started = time.time()
+        upper_bound = _batch_upper_bound(table, checkpoint.last_pk, batch_size, max_pk)
+        with transaction.atomic():
+            updated_count = backfill.process_batch(queryset.filter(pk__gt=checkpoint.last_pk, pk__lte=upper_bound))
+            checkpoint.last_pk = upper_bound
+            checkpoint.rows_updated += updated_count
+            checkpoint.save()
+        batch_count += 1
+        elapsed = time.time() - started
+        logger.info("Backfill {} updated {} rows up to id {} in {:.2f}s".format(backfill.name, updated_count,
+                                                                              upper_bound, elapsed))
+        if checkpoint.last_pk < max_pk and (max_batches is None or batch_count < max_batches):
+            time.sleep(max(sleep_seconds, elapsed * throttle_ratio))
+
+    if checkpoint.last_pk >= max_pk and checkpoint.completed_at is None:
+        checkpoint.completed_at = timezone.now()
+        checkpoint.save()
+        logger.info("Backfill {} complete, {} rows updated".format(backfill.name, checkpoint.rows_updated))
+    return checkpoint
+
+
+def round_up_to_review_time(date):
+    """
+    Rounds a date up to the next REVIEW_ROUNDING_TIME boundary, as UserSpecific's rounding does. Unlike it, a date
+    which is already on a boundary is left alone, so that rounding is idempotent and a backfill can safely be re-run.
+    """
+    round_to = constants.REVIEW_ROUNDING_TIME.total_seconds()
+    seconds = (date - date.min.replace(tzinfo=date.tzinfo)).seconds
+    if seconds % round_to == 0:
+        return date
+    rounding = (seconds + round_to) // round_to * round_to
+    return date + timedelta(0, rounding - seconds, 0)
+
+
+@register
+class CorrectNextReviewDates(Backfill):
+    """
+    Recomputes every review's next_review_date from its last_studied date and streak, rounding both up as
+    UserSpecific.set_next_review_time_based_on_last_studied does.
+    """
+    name = "correct_next_review_dates"
+    model = UserSpecific
+
+    def get_queryset(self):
+        return UserSpecific.all_objects.filter(last_studied__isnull=False, streak__in=constants.SRS_TIMES.keys())
+
+    def process_batch(self, batch):
+        # The rounding has no portable SQL equivalent, so it is done here, but each batch is still written back with one
+        # UPDATE ... CASE per column rather than a save() per row.
+        next_review_dates = {}
+        last_studied_dates = {}
+        for review_id, last_studied, streak in batch.values_list('id', 'last_studied', 'streak'):
+            next_review_date = last_studied + timedelta(hours=constants.SRS_TIMES[streak])
+            next_review_dates[review_id] = round_up_to_review_time(next_review_date)
+            last_studied_dates[review_id] = round_up_to_review_time(last_studied)
+        bulk_update_field(UserSpecific, 'next_review_date', next_review_dates)
+        bulk_update_field(UserSpecific, 'last_studied', last_studied_dates)
+        return len(next_review_dates)
@@ -0,0 +1,60 @@
+"""
+Atomic read-and-delete operations on the Django cache.
+
+The cache API can add, set and delete, but has nothing which checks or reads a key and removes it in one step, which is
+what releasing a lease or taking a pending request needs. On the redis cache these run as Lua scripts, so they are
+atomic across workers. Other backends, e.g. the local memory cache used in development and tests, fall back to a get
+followed by a delete.
+
+Values must be ints: the redis cache stores those as plain numbers rather than pickles, so the scripts can compare them.
+"""
+from django.core.cache import cache
+
+COMPARE_AND_DELETE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+TAKE_SCRIPT = """
+local value = redis.call('get', KEYS[1])
+redis.call('del', KEYS[1])
+return value
+"""
+
+
+def _run_script(script, key, *args):
+    if not hasattr(cache, 'get_client'):
+        return NotImplemented
+    client = cache.get_client(key, write=True)
+    return client.eval(script, 1, str(cache.make_key(key)), *args)
+
+
+def delete_if_equal(key, value):
+    """
+    Deletes key only if it still holds value, e.g. to release a lease without removing one somebody else has acquired
+    since ours expired.
+
+    :return: True if the key was deleted.
+    """
+    deleted = _run_script(COMPARE_AND_DELETE_SCRIPT, key, value)
+    if deleted is NotImplemented:
+        deleted = cache.get(key) == value
+        if deleted:
+            cache.delete(key)
+    return bool(deleted)
+
+
+def take(key):
+    """
+    Reads and deletes key.
+
+    :return: the value it held, or None if it wasn't set.
+    """
+    value = _run_script(TAKE_SCRIPT, key)
+    if value is NotImplemented:
+        value = cache.get(key)
+        cache.delete(key)
+        return value
+    return None if value is None else int(value)
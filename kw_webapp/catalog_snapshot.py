@@ -0,0 +1,240 @@
+"""
+Read-only, memory-mapped snapshot of the vocabulary catalog.
+
+The catalog (vocabulary, readings and parts of speech) is identical for every user, so rather than having each gunicorn
+worker warm up its own copy from the database we write it once to a binary file and let every worker mmap it. The
+pages are shared by the OS page cache, so memory per node stays flat no matter how many workers are running.
+
+The snapshot is rebuilt by a celery worker whenever the catalog changes, so CATALOG_SNAPSHOT_PATH has to be storage that
+the web nodes share with the workers (or the same host). To make sure a node never serves a file the rebuild couldn't
+reach, every rebuild publishes its version in the cache, and a mapped snapshot older than that is ignored in favour of
+the database until it is rebuilt where the node can see it.
+
+File layout (all integers little-endian):
+
+    header:  magic (4s) | format version (H) | reserved (H) | record count (I) | snapshot version (Q)
+    index:   record count * [vocabulary id (I) | payload offset (I) | payload length (I)], sorted by vocabulary id
+    payload: one UTF-8 JSON document per vocabulary
+"""
+import json
+import mmap
+import os
+import struct
+import tempfile
+import time
+from collections import defaultdict
+
+import logging
+from django.conf import settings
+from django.core.cache import cache
+
+from kw_webapp.models import Vocabulary, Reading
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b"KWCS"
+SNAPSHOT_FORMAT_VERSION = 1
+
+_HEADER = struct.Struct("<4sHHIQ")
+_INDEX_ENTRY = struct.Struct("<III")
+
+# The version stamped by the last rebuild after a catalog change. Older snapshots are stale.
+CATALOG_SNAPSHOT_VERSION_KEY = "catalog_snapshot:version"
+
+READING_FIELDS = ('id', 'vocabulary_id', 'character', 'kana', 'level', 'sentence_en', 'sentence_ja', 'common',
+                  'furigana', 'pitch')
+
+
+class CatalogSnapshotError(Exception):
+    pass
+
+
+def build_catalog_records():
+    """
+    Pulls the entire catalog out of the database in a constant number of queries.
+
+    :return: a list of (vocabulary_id, record dict) tuples, ordered by vocabulary id.
+    """
+    parts_of_speech = defaultdict(list)
+    through = Reading.parts_of_speech.through.objects.values_list('reading_id', 'partofspeech__part')
+    for reading_id, part in through.order_by('reading_id', 'partofspeech_id'):
+        parts_of_speech[reading_id].append(part)
+
+    readings = defaultdict(list)
+    for reading in Reading.objects.values(*READING_FIELDS).order_by('vocabulary_id', 'id'):
+        vocabulary_id = reading.pop('vocabulary_id')
+        reading['parts_of_speech'] = parts_of_speech[reading['id']]
+        readings[vocabulary_id].append(reading)
+
+    records = []
+    for vocabulary_id, meaning in Vocabulary.objects.values_list('id', 'meaning').order_by('id'):
+        records.append((vocabulary_id, {'id': vocabulary_id,
+                                        'meaning': meaning,
+                                        'readings': readings[vocabulary_id]}))
+    return records
+
+
+def write_catalog_snapshot(path, records, version=None):
+    """
+    Serializes the given records to a snapshot file. The file is written next to its destination and atomically moved
+    into place, so workers which already have the previous snapshot mapped keep reading a consistent file.
+
+    :param path: Destination of the snapshot.
+    :param records: iterable of (vocabulary_id, record dict) tuples, as built by build_catalog_records.
+    :param version: Snapshot version to stamp into the header. Defaults to the current unix timestamp.
+    :return: the version which was written.
+    """
+    version = int(time.time()) if version is None else version
+    records = sorted(records, key=lambda record: record[0])
+    payloads = [json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+                for _, record in records]
+
+    index_size = _INDEX_ENTRY.size * len(records)
+    offset = _HEADER.size + index_size
+    index = bytearray(index_size)
+    for position, ((vocabulary_id, _), payload) in enumerate(zip(records, payloads)):
+        _INDEX_ENTRY.pack_into(index, position * _INDEX_ENTRY.size, vocabulary_id, offset, len(payload))
+        offset += len(payload)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=directory, prefix=".catalog-snapshot-")
+    try:
+        with os.fdopen(file_descriptor, "wb") as snapshot_file:
+            snapshot_file.write(_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT_VERSION, 0, len(records), version))
+            snapshot_file.write(index)
+            for payload in payloads:
+                snapshot_file.write(payload)
+        os.replace(temporary_path, path)
+    except Exception:
+        os.unlink(temporary_path)
+        raise
+
+    logger.info("Wrote catalog snapshot version {} with {} vocabulary to {}".format(version, len(records), path))
+    return version
+
+
+class CatalogSnapshot(object):
+    """
+    A read-only view over a snapshot file. Lookups binary search the index in place, so nothing but the requested
+    record is ever copied out of the mapping.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as snapshot_file:
+            self.inode = os.fstat(snapshot_file.fileno()).st_ino
+            self._map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._map) < _HEADER.size:
+            self.close()
+            raise CatalogSnapshotError("Catalog snapshot {} is truncated".format(path))
+
+        magic, format_version, _, self.count, self.version = _HEADER.unpack_from(self._map, 0)
+        if magic != SNAPSHOT_MAGIC or format_version != SNAPSHOT_FORMAT_VERSION:
+            self.close()
+            raise CatalogSnapshotError("Unsupported catalog snapshot {} (format {})".format(path, format_version))
+
+    def _find(self, vocabulary_id):
+        low, high = 0, self.count - 1
+        while low <= high:
+            middle = (low + high) // 2
+            found_id, offset, length = _INDEX_ENTRY.unpack_from(self._map, _HEADER.size + middle * _INDEX_ENTRY.size)
+            if found_id == vocabulary_id:
+                return offset, length
+            elif found_id < vocabulary_id:
+                low = middle + 1
+            else:
+                high = middle - 1
+        return None
+
+    def raw(self, vocabulary_id):
+        """
+        :return: a memoryview over the serialized record, or None if the vocabulary is not in the snapshot.
+        """
+        location = self._find(int(vocabulary_id))
+        if location is None:
+            return None
+        offset, length = location
+        return memoryview(self._map)[offset:offset + length]
+
+    def get(self, vocabulary_id):
+        """
+        :return: the decoded vocabulary record, or None if the vocabulary is not in the snapshot.
+        """
+        record = self.raw(vocabulary_id)
+        if record is None:
+            return None
+        try:
+            return json.loads(record.tobytes().decode("utf-8"))
+        finally:
+            record.release()
+
+    def __contains__(self, vocabulary_id):
+        return self._find(int(vocabulary_id)) is not None
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self._map.close()
+
+
+def rebuild_catalog_snapshot():
+    """
+    Rewrites the configured snapshot from the database, if one has been deployed. Called whenever the catalog changes,
+    so that workers don't keep serving stale vocabulary. The new version is published even if there is no snapshot on
+    this host, so that web nodes holding an older one stop using it.
+
+    :return: the version which was written, or None if there is no snapshot to rebuild.
+    """
+    version = int(time.time())
+    cache.set(CATALOG_SNAPSHOT_VERSION_KEY, version, None)
+    path = settings.CATALOG_SNAPSHOT_PATH
+    if not os.path.exists(path):
+        return None
+    return write_catalog_snapshot(path, build_catalog_records(), version=version)
+
+
+_snapshot = None
+_checked_path = None
+_checked_at = None
+_current = None
+
+
+def _map_current_snapshot(path):
+    global _snapshot
+    try:
+        inode = os.stat(path).st_ino
+    except OSError:
+        return None
+
+    if _snapshot is None or _snapshot.path != path or _snapshot.inode != inode:
+        try:
+            _snapshot = CatalogSnapshot(path)
+        except CatalogSnapshotError as e:
+            logger.error(str(e))
+            return None
+        logger.info("Mapped catalog snapshot version {} from {}".format(_snapshot.version, path))
+
+    required_version = cache.get(CATALOG_SNAPSHOT_VERSION_KEY)
+    if required_version is not None and _snapshot.version < required_version:
+        logger.warning("Catalog snapshot {} is version {} but the catalog was rebuilt at version {}, serving vocabulary "
+                       "from the database. Is CATALOG_SNAPSHOT_PATH shared with the celery workers?"
+                       .format(path, _snapshot.version, required_version))
+        return None
+    return _snapshot
+
+
+def get_catalog_snapshot():
+    """
+    Returns this process' mapping of the configured snapshot, remapping it if the file has been replaced since it was
+    opened. Returns None if no snapshot has been built or it is stale, in which case callers should fall back to the
+    database. The file and the published version are checked at most once per CATALOG_SNAPSHOT_CHECK_INTERVAL_SECONDS.
+    """
+    global _checked_path, _checked_at, _current
+    path = settings.CATALOG_SNAPSHOT_PATH
+    now = time.monotonic()
+    if path != _checked_path or now - _checked_at >= settings.CATALOG_SNAPSHOT_CHECK_INTERVAL_SECONDS:
+        _current = _map_current_snapshot(path)
+        _checked_path, _checked_at = path, now
+    return _current
@@ -0,0 +1,103 @@
+"""
+Write-coalesced last visit tracking.
+
+Rather than updating a user's profile from the request path, SetLastVisitMiddleware hands each visit to the process'
+LastVisitTracker. The tracker remembers who it has recorded recently, so that a user is written at most once per
+LAST_VISIT_WRITE_INTERVAL_SECONDS per process, and records the visit in a redis hash of user id -> timestamp. The
+flush_last_visits task periodically takes the whole hash and writes it to the profiles with one UPDATE.
+"""
+import time
+from datetime import datetime
+
+import logging
+import redis
+from django.conf import settings
+from django.utils import timezone
+
+from kw_webapp.redis_connection import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+LAST_VISITS_KEY = "kw:last_visits"
+
+# After redis fails, how long to write visits straight to the database before trying it again.
+RETRY_REDIS_AFTER_SECONDS = 30
+
+
+class LastVisitTracker(object):
+
+    def __init__(self, connection=None, write_interval=None):
+        self.connection = connection or get_redis_connection()
+        self.write_interval = settings.LAST_VISIT_WRITE_INTERVAL_SECONDS if write_interval is None else write_interval
+        self._recorded_at = {}
+        self._pruned_at = time.monotonic()
+        self._redis_unavailable_until = 0
+
+    def is_due(self, user_id):
+        """
+        Checks whether a visit by this user should be recorded, and if so assumes that it will be. Only touches memory.
+        """
+        now = time.monotonic()
+        recorded_at = self._recorded_at.get(user_id)
+        if recorded_at is not None and now - recorded_at < self.write_interval:
+            return False
+
+        # Forget users we haven't seen for a full interval, so that a long lived process doesn't hold every user.
+        if now - self._pruned_at >= self.write_interval:
+            self._recorded_at = {user: seen for user, seen in self._recorded_at.items()
+                                 if now - seen < self.write_interval}
+            self._pruned_at = now
+        self._recorded_at[user_id] = now
+        return True
+
+    def record(self, user_id, visited_at):
+        """
+        Buffers a visit in redis until the next flush_last_visits.
+
+        :return: False if redis is unavailable, in which case the caller should save the visit itself.
+        """
+        if time.monotonic() < self._redis_unavailable_until:
+            return False
+        try:
+            self.connection.hset(LAST_VISITS_KEY, user_id, visited_at.timestamp())
+        except redis.RedisError as e:
+            logger.warning("Couldn't buffer last visits in redis, writing them directly: {}".format(e))
+            self._redis_unavailable_until = time.monotonic() + RETRY_REDIS_AFTER_SECONDS
+            return False
+        return True
+
+    def take_all(self):
+        """
+        Atomically reads and clears every buffered visit.
+
+        :return: dictionary of user id -> aware datetime of their last visit.
+        """
+        pipeline = self.connection.pipeline()
+        pipeline.hgetall(LAST_VISITS_KEY)
+        pipeline.delete(LAST_VISITS_KEY)
+        buffered, _ = pipeline.execute()
+        return {int(user_id): datetime.fromtimestamp(float(visited_at), timezone.utc)
+                for user_id, visited_at in buffered.items()}
+
+    def put_back(self, last_visits):
+        """
+        Returns visits taken by take_all to the buffer, e.g. when they couldn't be saved. Visits recorded since they
+        were taken are newer, so they are kept.
+        """
+        pipeline = self.connection.pipeline()
+        for user_id, visited_at in last_visits.items():
+            pipeline.hsetnx(LAST_VISITS_KEY, user_id, visited_at.timestamp())
+        pipeline.execute()
+
+
+_tracker = None
+
+
+def get_last_visit_tracker():
+    """
+    Returns this process' shared tracker.
+    """
+    global _tracker
+    if _tracker is None:
+        _tracker = LastVisitTracker()
+    return _tracker
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from kw_webapp.catalog_snapshot import build_catalog_records, write_catalog_snapshot
+
+
+class Command(BaseCommand):
+    help = "Writes the vocabulary catalog to a memory-mappable snapshot file shared by all web workers."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=None,
+                            help="Where to write the snapshot. Defaults to settings.CATALOG_SNAPSHOT_PATH")
+
+    def handle(self, *args, **options):
+        path = options['path'] or settings.CATALOG_SNAPSHOT_PATH
+        records = build_catalog_records()
+        version = write_catalog_snapshot(path, records)
+        self.stdout.write("Wrote catalog snapshot version {} ({} vocabulary) to {}".format(version, len(records), path))
@@ -0,0 +1,37 @@
+import csv
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from kw_webapp.reports import duplicate_kanji_report, duplicate_review_report, conglomerated_vocabulary_report
+
+REPORTS = {
+    "duplicate-kanji": duplicate_kanji_report,
+    "duplicate-reviews": duplicate_review_report,
+    "conglomerated-vocabulary": conglomerated_vocabulary_report,
+}
+
+
+class Command(BaseCommand):
+    help = "Streams a catalog or review consistency report as CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument('report', choices=sorted(REPORTS))
+        parser.add_argument('--user', default=None,
+                            help="Username to list duplicate reviews for. Defaults to a per-user summary of everybody.")
+
+    def handle(self, *args, **options):
+        report_args = []
+        if options['user'] is not None:
+            if options['report'] != "duplicate-reviews":
+                raise CommandError("--user only applies to the duplicate-reviews report.")
+            try:
+                report_args.append(User.objects.get(username=options['user']))
+            except User.DoesNotExist:
+                raise CommandError("No such user: {}".format(options['user']))
+
+        header, rows = REPORTS[options['report']](*report_args)
+        writer = csv.writer(self.stdout, lineterminator="\n")
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
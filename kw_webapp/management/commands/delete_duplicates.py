@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from kw_webapp.utils import delete_all_duplicates
+
+
+class Command(BaseCommand):
+    help = "Deletes duplicate reviews and synonyms, keeping the oldest row of each duplicate group."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="How many rows to delete per transaction.")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the duplicates.")
+
+    def handle(self, *args, **options):
+        counts = delete_all_duplicates(batch_size=options['batch_size'], dry_run=options['dry_run'])
+        for model, count in counts.items():
+            self.stdout.write("{} duplicate {}{}".format(count, model._meta.verbose_name_plural,
+                                                         " found" if options['dry_run'] else " deleted"))
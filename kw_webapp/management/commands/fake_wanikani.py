@@ -0,0 +1,66 @@
+import json
+import random
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse
+
+from django.core.management.base import BaseCommand
+
+from kw_webapp import constants
+from kw_webapp.wanikani.fake_api import FakeWanikani, FAKE_API_KEY_PREFIX
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class Command(BaseCommand):
+    help = "Serves a fake WaniKani v1 API with synthetic users, for load testing syncs. Point WANIKANI_API_ROOT at " \
+           "http://<host>:<port>/api and use API keys of the form {}<n>.".format(FAKE_API_KEY_PREFIX)
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default="127.0.0.1")
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--items-per-level', type=int, default=50)
+        parser.add_argument('--max-level', type=int, default=constants.LEVEL_MAX)
+        parser.add_argument('--latency-ms', type=float, default=0, help="Delay added to every response.")
+        parser.add_argument('--jitter-ms', type=float, default=0, help="Random extra delay, up to this much.")
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help="Fraction of requests which fail with --error-status.")
+        parser.add_argument('--error-status', type=int, default=503)
+        parser.add_argument('--seed', type=int, default=None, help="Seed for latency jitter and error injection.")
+
+    def handle(self, *args, **options):
+        random_source = random.Random(options['seed'])
+        fake_wanikani = FakeWanikani(items_per_level=options['items_per_level'],
+                                     max_level=options['max_level'],
+                                     error_rate=options['error_rate'],
+                                     error_status=options['error_status'],
+                                     random_source=random_source)
+        latency = options['latency_ms'] / 1000.0
+        jitter = options['jitter_ms'] / 1000.0
+
+        class FakeWanikaniHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                time.sleep(latency + random_source.uniform(0, jitter))
+                response_status, body = fake_wanikani.respond(urlparse(self.path).path)
+                payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(response_status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadedHTTPServer((options['host'], options['port']), FakeWanikaniHandler)
+        self.stdout.write("Fake WaniKani listening on http://{}:{}/api".format(options['host'], options['port']))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from kw_webapp.utils import import_jisho_data
+
+
+class Command(BaseCommand):
+    help = "Merges Jisho's sentences, furigana, pitch and parts of speech into the catalog's readings."
+
+    def add_arguments(self, parser):
+        parser.add_argument('json_file', nargs='?', default="wk_vocab_import.json",
+                            help="JSON array of entries in the Jisho export format.")
+        parser.add_argument('--batch-size', type=int, default=500, help="How many entries to write at a time.")
+
+    def handle(self, *args, **options):
+        summary, missing_characters = import_jisho_data(options['json_file'], batch_size=options['batch_size'])
+        self.stdout.write("Updated {} readings. Skipped {} ambiguous entries and {} with no local reading.".format(
+            summary["updated"], summary["ambiguous"], summary["missing"]))
+        if missing_characters and options['verbosity'] > 1:
+            self.stdout.write("No local reading for: {}".format(", ".join(missing_characters)))
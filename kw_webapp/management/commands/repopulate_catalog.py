@@ -0,0 +1,43 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from kw_webapp import constants
+from kw_webapp.utils import repopulate_catalog
+
+SUMMARY_FIELDS = ("new_vocabulary", "changed_meanings", "new_readings", "changed_levels", "unchanged", "ambiguous")
+
+
+def format_summary(summary):
+    return ", ".join("{} {}".format(summary[field], field.replace("_", " ")) for field in SUMMARY_FIELDS)
+
+
+class Command(BaseCommand):
+    help = "Re-syncs the vocabulary catalog with WaniKani, fetching levels in parallel and only writing what changed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--levels', type=int, nargs='+', default=None,
+                            help="Levels to repopulate. Defaults to all of them.")
+        parser.add_argument('--api-key', default=constants.API_KEY,
+                            help="WaniKani key to fetch with. It must be able to see every requested level.")
+        parser.add_argument('--concurrency', type=int, default=4, help="How many levels to fetch at once.")
+        parser.add_argument('--dry-run', action='store_true', help="Report the differences without writing them.")
+        parser.add_argument('--force', action='store_true',
+                            help="Diff every item, even those whose WaniKani content hash hasn't changed.")
+
+    def handle(self, *args, **options):
+        summaries, failures = repopulate_catalog(levels=options['levels'],
+                                                 api_key=options['api_key'],
+                                                 concurrency=options['concurrency'],
+                                                 dry_run=options['dry_run'],
+                                                 trust_hashes=not options['force'])
+
+        for level in sorted(summaries):
+            self.stdout.write("Level {}: {}".format(level, format_summary(summaries[level])))
+        for level in sorted(failures):
+            self.stderr.write("Level {}: failed ({})".format(level, failures[level]))
+
+        total = sum(summaries.values(), Counter())
+        self.stdout.write("{}Total: {}".format("[dry run] " if options['dry_run'] else "", format_summary(total)))
+        if failures:
+            raise CommandError("{} levels could not be fetched.".format(len(failures)))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from kw_webapp.backfills import BACKFILLS, run_backfill
+from kw_webapp.models import BackfillCheckpoint
+
+
+class Command(BaseCommand):
+    help = "Runs or resumes a chunked, throttled backfill. Lists the backfills and their progress if none is given."
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', nargs='?', default=None)
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--sleep', type=float, default=None, help="Minimum pause between batches, in seconds.")
+        parser.add_argument('--throttle-ratio', type=float, default=None,
+                            help="Pause for at least this many times as long as each batch took.")
+        parser.add_argument('--max-batches', type=int, default=None, help="Stop after this many batches.")
+        parser.add_argument('--restart', action='store_true', help="Ignore previous progress and start over.")
+
+    def handle(self, *args, **options):
+        if options['name'] is None:
+            checkpoints = dict((checkpoint.name, checkpoint) for checkpoint in BackfillCheckpoint.objects.all())
+            for name in BACKFILLS:
+                self.stdout.write(str(checkpoints.get(name, "{} - not started".format(name))))
+            return
+
+        if options['name'] not in BACKFILLS:
+            raise CommandError("Unknown backfill {}. Choose from: {}".format(options['name'], ", ".join(BACKFILLS)))
+
+        checkpoint = run_backfill(BACKFILLS[options['name']](),
+                                  batch_size=options['batch_size'],
+                                  sleep_seconds=options['sleep'],
+                                  throttle_ratio=options['throttle_ratio'],
+                                  max_batches=options['max_batches'],
+                                  restart=options['restart'])
+        self.stdout.write(str(checkpoint))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from kw_webapp.tasks import get_sync_batch_progress, cancel_sync_batch, resume_sync_batch
+
+
+class Command(BaseCommand):
+    help = "Reports on, cancels or resumes a sync_all_users_to_wk batch. Defaults to the most recent batch."
+
+    def add_arguments(self, parser):
+        parser.add_argument('batch_id', nargs='?', default=None)
+        action = parser.add_mutually_exclusive_group()
+        action.add_argument('--cancel', action='store_true', help="Stop syncing the remaining users of the batch.")
+        action.add_argument('--resume', action='store_true', help="Reschedule the users the batch hasn't synced yet, including failed ones.")
+
+    def handle(self, *args, **options):
+        if options['cancel']:
+            if cancel_sync_batch(options['batch_id']) is None:
+                raise CommandError("No such sync batch.")
+        elif options['resume']:
+            self.stdout.write("Rescheduled {} users.".format(resume_sync_batch(options['batch_id'])))
+
+        progress = get_sync_batch_progress(options['batch_id'])
+        if progress is None:
+            raise CommandError("No such sync batch.")
+        self.stdout.write("Batch {batch_id} started {started}: {completed}/{total} users synced, {failed} failed or "
+                          "skipped{cancelled}".format(cancelled=" (cancelled)" if progress["cancelled"] else "",
+                                                      **progress))
@@ -0,0 +1,132 @@
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from celery.signals import task_prerun, task_postrun
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from KW.celery import app as celery_app
+from kw_webapp import constants
+from kw_webapp.models import Profile
+from kw_webapp.tasks import sync_with_wk, sync_all_users_to_wk
+from kw_webapp.wanikani.constants import WANIKANI_ROOT_URL
+from kw_webapp.wanikani.fake_api import fake_api_key, fake_user_level
+
+LOAD_TEST_USERNAME = "loadtest-{}"
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[max(0, int(math.ceil(fraction * len(values))) - 1)]
+
+
+class Command(BaseCommand):
+    help = "Syncs synthetic users against `manage.py fake_wanikani` and reports throughput, per-user latency and " \
+           "queries per vocabulary item. Run it with WANIKANI_API_ROOT pointed at the fake server, against a " \
+           "throwaway database: --batch syncs every recently active user, not just the synthetic ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--items-per-level', type=int, default=50,
+                            help="Must match the fake server's --items-per-level.")
+        parser.add_argument('--max-level', type=int, default=constants.LEVEL_MAX,
+                            help="Must match the fake server's --max-level.")
+        parser.add_argument('--concurrency', type=int, default=1, help="Users synced in parallel.")
+        parser.add_argument('--recent', action='store_true', help="Sync recent levels only, rather than all levels.")
+        parser.add_argument('--batch', action='store_true',
+                            help="Drive sync_all_users_to_wk, with its tasks run inline, instead of sync_with_wk.")
+
+    def handle(self, *args, **options):
+        if "wanikani.com" in WANIKANI_ROOT_URL:
+            raise CommandError("Refusing to load test the real WaniKani, set WANIKANI_API_ROOT to the fake server.")
+
+        user_ids = self._set_up_users(options['users'], options['max_level'])
+        full_sync = not options['recent']
+        item_count = sum(self._items_synced(user_number, options, full_sync) for user_number in range(len(user_ids)))
+
+        started = time.monotonic()
+        if options['batch']:
+            latencies, query_count, failures = self._run_batch()
+        else:
+            latencies, query_count, failures = self._run_syncs(user_ids, full_sync, options['concurrency'])
+        elapsed = time.monotonic() - started
+
+        self.stdout.write("Synced {} users ({} failed) in {:.1f}s".format(len(latencies), failures, elapsed))
+        self.stdout.write("Throughput: {:.2f} users/s, {:.0f} items/s".format(len(latencies) / elapsed,
+                                                                          item_count / elapsed))
+        self.stdout.write("Latency per user: p50 {:.0f}ms, p95 {:.0f}ms, max {:.0f}ms".format(
+            percentile(latencies, 0.5) * 1000, percentile(latencies, 0.95) * 1000, percentile(latencies, 1) * 1000))
+        self.stdout.write("Queries: {} ({:.3f} per item)".format(query_count, query_count / max(item_count, 1)))
+
+    def _set_up_users(self, count, max_level):
+        user_ids = []
+        for user_number in range(count):
+            user, _ = User.objects.get_or_create(username=LOAD_TEST_USERNAME.format(user_number))
+            level = fake_user_level(user_number, max_level)
+            profile, _ = Profile.objects.get_or_create(user=user, defaults={"api_key": fake_api_key(user_number),
+                                                                           "level": level})
+            profile.last_visit = timezone.now()
+            profile.save()
+            for unlocked_level in range(1, level + 1):
+                profile.unlocked_levels.get_or_create(level=unlocked_level)
+            user_ids.append(user.id)
+        return user_ids
+
+    def _items_synced(self, user_number, options, full_sync):
+        level = fake_user_level(user_number, options['max_level'])
+        return (level if full_sync else min(level, 3)) * options['items_per_level']
+
+    def _sync_one(self, user_id, full_sync):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.monotonic()
+            try:
+                succeeded = sync_with_wk(user_id, full_sync)[0]
+            except Exception as e:
+                self.stderr.write("Sync failed for user {}: {}".format(user_id, e))
+                succeeded = False
+            elapsed = time.monotonic() - started
+        connection.close()
+        return elapsed, len(queries), succeeded
+
+    def _run_syncs(self, user_ids, full_sync, concurrency):
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(lambda user_id: self._sync_one(user_id, full_sync), user_ids))
+        return ([elapsed for elapsed, _, _ in results],
+                sum(query_count for _, query_count, _ in results),
+                len([succeeded for _, _, succeeded in results if not succeeded]))
+
+    def _run_batch(self):
+        started_at = {}
+        latencies = []
+        failures = []
+
+        def on_prerun(task_id=None, task=None, **kwargs):
+            if task.name == sync_with_wk.name:
+                started_at[task_id] = time.monotonic()
+
+        def on_postrun(task_id=None, task=None, retval=None, **kwargs):
+            if task_id in started_at:
+                latencies.append(time.monotonic() - started_at.pop(task_id))
+                if not isinstance(retval, (list, tuple)) or not retval[0]:
+                    failures.append(task_id)
+
+        task_prerun.connect(on_prerun, weak=False)
+        task_postrun.connect(on_postrun, weak=False)
+        celery_app.conf.task_always_eager = True
+        try:
+            # With no spread every slot is due at once, so the batch is released in full rather than a minute's worth.
+            with override_settings(SYNC_ALL_USERS_SPREAD_SECONDS=0), CaptureQueriesContext(connection) as queries:
+                scheduled = sync_all_users_to_wk()
+        finally:
+            celery_app.conf.task_always_eager = False
+            task_prerun.disconnect(on_prerun)
+            task_postrun.disconnect(on_postrun)
+        if len(latencies) != scheduled:
+            raise CommandError("The batch scheduled {} syncs but {} ran.".format(scheduled, len(latencies)))
+        return latencies, len(queries), len(failures)
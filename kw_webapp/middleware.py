@@ -1,19 +1,22 @@
 from django.utils.timezone import now
 from django.utils import deprecation
-from kw_webapp.models import Profile
-from kw_webapp.tasks import past_time
+from kw_webapp.last_visit import get_last_visit_tracker
+from kw_webapp.tasks import save_last_visits
 
 
 class SetLastVisitMiddleware(deprecation.MiddlewareMixin):
     """
-    A middleware class which will update a last_visit field in the profile once an hour.
+    A middleware class which records the last_visit of authenticated users. Visits are buffered by the LastVisitTracker
+    and saved to the profiles in bulk by the flush_last_visits task, so requests don't touch the profile table. If the
+    buffer is unavailable, the visit is saved directly.
     """
-    buffer_hours = 1
 
     def process_response(self, request, response):
-        if hasattr(request, 'user') and request.user.is_authenticated() and self.should_update(request.user):
-            Profile.objects.filter(pk=request.user.profile.pk).update(last_visit=now())
+        if hasattr(request, 'user') and request.user.is_authenticated():
+            tracker = get_last_visit_tracker()
+            user_id = request.user.pk
+            if tracker.is_due(user_id):
+                visited_at = now()
+                if not tracker.record(user_id, visited_at):
+                    save_last_visits({user_id: visited_at})
         return response
-
-    def should_update(self, user):
-        return user.profile.last_visit is None or user.profile.last_visit <= past_time(self.buffer_hours)
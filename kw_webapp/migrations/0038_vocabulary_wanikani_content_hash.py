@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kw_webapp', '0037_auto_20180321_1551'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vocabulary',
+            name='wanikani_content_hash',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+    ]
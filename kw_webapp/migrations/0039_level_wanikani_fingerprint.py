@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kw_webapp', '0038_vocabulary_wanikani_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='level',
+            name='wanikani_fingerprint',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.11 on 2026-10-18 22:28
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kw_webapp', '0040_backfillcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userspecific',
+            name='archived',
+            field=models.BooleanField(default=False),
+        ),
+    ]
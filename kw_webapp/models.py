@@ -36,6 +36,8 @@ class Level(models.Model):
         MinValueValidator(constants.LEVEL_MIN),
         MaxValueValidator(constants.LEVEL_MAX),
     ])
+    # Hash of this level's WaniKani vocabulary as of the owner's last full sync, so unchanged levels can be skipped.
+    wanikani_fingerprint = models.CharField(max_length=40, blank=True, default="")
 
     def __str__(self):
         return str(self.level)
@@ -132,6 +134,8 @@ class Profile(models.Model):
 
 class Vocabulary(models.Model):
     meaning = models.CharField(max_length=255)
+    # Hash of the WaniKani content this vocabulary was last synced from, so that unchanged items can be skipped.
+    wanikani_content_hash = models.CharField(max_length=40, blank=True, default="")
 
     def reading_count(self):
         return self.readings.all().count()
@@ -206,6 +210,15 @@ class Report(models.Model):
                                                                      self.created_by_id,
                                                                      self.created_at)
 
+class ActiveReviewManager(models.Manager):
+    """
+    Hides reviews archived by locking their level. Use UserSpecific.all_objects to see those too.
+    """
+
+    def get_queryset(self):
+        return super(ActiveReviewManager, self).get_queryset().filter(archived=False)
+
+
 class UserSpecific(models.Model):
     vocabulary = models.ForeignKey(Vocabulary)
     user = models.ForeignKey(User, related_name='reviews', on_delete=models.CASCADE)
@@ -223,6 +236,12 @@ class UserSpecific(models.Model):
     wanikani_burned = models.BooleanField(default=False)
     notes = models.CharField(max_length=500, editable=True, blank=True, null=True)
     critical = models.BooleanField(default=False)
+    # Set when the review's level is locked. Archived reviews keep their history and synonyms, so unlocking the level
+    # again just clears the flag.
+    archived = models.BooleanField(default=False)
+
+    objects = ActiveReviewManager()
+    all_objects = models.Manager()
 
     class Meta:
         unique_together = ('vocabulary', 'user')
@@ -421,4 +440,19 @@ class MeaningSynonym(models.Model):
         return self.text
 
     class Meta:
-        unique_together = ('text', 'review')
\ No newline at end of file
+        unique_together = ('text', 'review')
+
+
+class BackfillCheckpoint(models.Model):
+    """
+    Progress of a backfill (see kw_webapp.backfills), so that an interrupted run picks up where it left off.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    last_pk = models.BigIntegerField(default=0)
+    rows_updated = models.BigIntegerField(default=0)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return "{} - up to {} - {} rows updated{}".format(self.name, self.last_pk, self.rows_updated,
+                                                          " - complete" if self.completed_at else "")
@@ -0,0 +1,17 @@
+import redis
+from django.conf import settings
+
+_connection = None
+
+
+def get_redis_connection():
+    """
+    Returns this process' shared connection to the redis server used for cross-worker coordination (rate limiting,
+    last visit stamps, etc.). Socket timeouts are kept short so that a redis outage can't wedge a request or a task.
+    """
+    global _connection
+    if _connection is None:
+        _connection = redis.StrictRedis.from_url(settings.REDIS_CONNECTION_URL,
+                                                 socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                                                 socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT)
+    return _connection
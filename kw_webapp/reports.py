@@ -0,0 +1,63 @@
+"""
+Catalog and review consistency reports.
+
+Each report finds the offending keys with a single GROUP BY ... HAVING query and joins back to them in the database, so
+the rows can be streamed straight out of a (server-side, on Postgres) cursor instead of walking every vocabulary or
+review in Python. Every report function returns a (header, rows) tuple, where rows is a lazy iterable of tuples matching
+the header.
+"""
+from django.db.models import Count
+
+from kw_webapp.models import Reading, UserSpecific, Vocabulary
+
+
+def duplicate_kanji_report():
+    """
+    Kanji which appear in the readings of more than one vocabulary, one row per (kanji, vocabulary).
+    """
+    duplicated_characters = Reading.objects.values('character') \
+        .annotate(vocabulary_count=Count('vocabulary', distinct=True)) \
+        .filter(vocabulary_count__gt=1) \
+        .values_list('character', flat=True)
+    rows = Reading.objects.filter(character__in=duplicated_characters) \
+        .values_list('character', 'vocabulary_id', 'vocabulary__meaning') \
+        .order_by('character', 'vocabulary_id') \
+        .distinct()
+    return ("character", "vocabulary_id", "meaning"), rows.iterator()
+
+
+def duplicate_review_report(user=None):
+    """
+    Kanji which a user is reviewing under more than one review.
+
+    :param user: if given, every offending review of this user is listed. Otherwise there is one row per (user, kanji)
+    across every user, with the number of reviews involved.
+    """
+    duplicated = UserSpecific.objects.filter(vocabulary__readings__isnull=False) \
+        .values('user_id', 'vocabulary__readings__character') \
+        .annotate(review_count=Count('id', distinct=True)) \
+        .filter(review_count__gt=1)
+    if user is None:
+        rows = duplicated.values_list('user__username', 'vocabulary__readings__character', 'review_count') \
+            .order_by('user__username', 'vocabulary__readings__character')
+        return ("username", "character", "review_count"), rows.iterator()
+
+    duplicated_characters = duplicated.filter(user=user).values_list('vocabulary__readings__character', flat=True)
+    rows = UserSpecific.objects.filter(user=user, vocabulary__readings__character__in=duplicated_characters) \
+        .values_list('vocabulary__readings__character', 'id', 'vocabulary_id', 'vocabulary__meaning', 'streak') \
+        .order_by('vocabulary__readings__character', 'id') \
+        .distinct()
+    return ("character", "review_id", "vocabulary_id", "meaning", "streak"), rows.iterator()
+
+
+def conglomerated_vocabulary_report():
+    """
+    Vocabulary whose readings span more than one kanji, one row per reading.
+    """
+    conglomerated_ids = Vocabulary.objects.annotate(character_count=Count('readings__character', distinct=True)) \
+        .filter(character_count__gt=1) \
+        .values_list('id', flat=True)
+    rows = Reading.objects.filter(vocabulary_id__in=conglomerated_ids) \
+        .values_list('vocabulary_id', 'vocabulary__meaning', 'character', 'kana') \
+        .order_by('vocabulary_id', 'character', 'kana')
+    return ("vocabulary_id", "meaning", "character", "kana"), rows.iterator()
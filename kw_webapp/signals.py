@@ -1,11 +1,30 @@
+from datetime import timedelta
+
+from django.conf import settings
 from django.contrib.auth.signals import user_logged_in
+from django.core.cache import cache
+from django.utils import timezone
+
 from kw_webapp.tasks import sync_with_wk
 
+LOGIN_SYNC_DEBOUNCE_KEY = "login_sync:{}"
+
 
 def sync_unlocks_with_wk(sender, **kwargs):
+    """
+    Queues a sync of the user's recent levels when they log in, unless they were synced recently. The full sync of
+    every level is left to the twice daily batch.
+    """
     if kwargs['user']:
         user = kwargs['user']
-        sync_with_wk.delay(user.id, full_sync=user.profile.follow_me)
+        debounce_seconds = settings.LOGIN_SYNC_DEBOUNCE_SECONDS
+        last_sync = user.profile.last_wanikani_sync_date
+        if last_sync is not None and timezone.now() - last_sync < timedelta(seconds=debounce_seconds):
+            return
+
+        # Also covers a sync which has been queued by a previous login but hasn't run yet.
+        if cache.add(LOGIN_SYNC_DEBOUNCE_KEY.format(user.id), True, debounce_seconds):
+            sync_with_wk.delay(user.id, full_sync=False)
 
 
 user_logged_in.connect(sync_unlocks_with_wk)
@@ -1,18 +1,32 @@
 from __future__ import absolute_import
 
-from collections import OrderedDict
+import hashlib
+import json
+import uuid
+from collections import OrderedDict, defaultdict, Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 
 from celery import shared_task, task
+from celery.result import AsyncResult
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db.models import F, Count
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F, Count, Case, When, Value
 from django.db.models import Min
-from django.db.models.functions import TruncHour, TruncDate
+from django.db.models.functions import TruncHour, TruncDate, Length
 
 from kw_webapp.constants import WANIKANI_SRS_LEVELS, KANIWANI_SRS_LEVELS, KwSrsLevel
-from kw_webapp.wanikani import make_api_call
+from kw_webapp.wanikani import make_api_call, get_client, fetch_vocabulary, compact_vocabulary
 from kw_webapp.wanikani import exceptions
+from kw_webapp.wanikani.constants import USER_INFO_URL, VOCABULARY_URL
+from kw_webapp.wanikani.rate_limiter import get_rate_limiter
 from kw_webapp import constants
-from kw_webapp.models import UserSpecific, Vocabulary, Profile, Level, MeaningSynonym, AnswerSynonym
+from kw_webapp.models import UserSpecific, Vocabulary, Profile, Level, MeaningSynonym, AnswerSynonym, Reading
+from kw_webapp.last_visit import get_last_visit_tracker
+from kw_webapp import cache_ops
+from kw_webapp.catalog_snapshot import rebuild_catalog_snapshot
 from datetime import timedelta, datetime
 from django.utils import timezone
 
@@ -103,15 +117,19 @@ def associate_vocab_to_user(vocab, user):
     :return: the vocabulary object after association to the user
     '''
     try:
-        review, created = UserSpecific.objects.get_or_create(vocabulary=vocab, user=user)
+        # Goes through all_objects, as an archived review still holds the (user, vocabulary) pair.
+        review, created = UserSpecific.all_objects.get_or_create(vocabulary=vocab, user=user)
         if created:
             review.needs_review = True
             review.next_review_date = timezone.now()
             review.save()
+        elif review.archived:
+            review.archived = False
+            review.save(update_fields=['archived'])
         return review, created
 
     except UserSpecific.MultipleObjectsReturned:
-        us = UserSpecific.objects.filter(vocabulary=vocab, user=user)
+        us = UserSpecific.all_objects.filter(vocabulary=vocab, user=user)
         for u in us:
             logger.error(
                 "during {}'s WK sync, we received multiple UserSpecific objects. Details: {}".format(user.username,
@@ -131,12 +149,10 @@ def build_API_sync_string_for_user(user):
     :param user: The user to have their vocab updated
     :return: A fully formed and ready-to-request API string.
     '''
-    api_call = "https://www.wanikani.com/api/user/{}/vocabulary/".format(user.profile.api_key)
     # if the user has unlocked recent levels, check for new vocab on them as well.
     levels = user.profile.unlocked_levels_list()
     level_string = ",".join(str(level) for level in levels) if isinstance(levels, list) else levels
-    api_call += level_string
-    return api_call
+    return VOCABULARY_URL.format(user.profile.api_key, level_string)
 
 
 def build_API_sync_string_for_user_for_levels(user, levels):
@@ -147,22 +163,75 @@ def build_API_sync_string_for_user_for_levels(user, levels):
     :return: The fully formatted API string that will provide.
     '''
     level_string = ",".join(str(level) for level in levels) if isinstance(levels, list) else levels
-    api_call = "https://www.wanikani.com/api/user/{}/vocabulary/{}".format(user.profile.api_key, level_string)
+    api_call = VOCABULARY_URL.format(user.profile.api_key, level_string)
     api_call += ','
     return api_call
 
 
-def lock_level_for_user(requested_level, user):
+def _apply_to_reviews_in_batches(reviews, apply_to_batch, on_progress=None, batch_size=None):
+    # Walks the reviews in primary key ranges of at most batch_size, so only one batch's worth of ids is ever held.
+    batch_size = settings.REVIEW_DELETE_BATCH_SIZE if batch_size is None else batch_size
+    total = reviews.order_by().values('pk').distinct().count()
+    ordered_ids = reviews.order_by('pk').values_list('pk', flat=True).distinct()
+    applied_count = 0
+    last_pk = 0
+    while True:
+        batch_ids = list(ordered_ids.filter(pk__gt=last_pk)[:batch_size])
+        if not batch_ids:
+            break
+        with transaction.atomic():
+            # Re-applying the original filter means a review that has changed since we listed it is left alone.
+            applied_count += apply_to_batch(reviews.filter(pk__gt=last_pk, pk__lte=batch_ids[-1]))
+        last_pk = batch_ids[-1]
+        if on_progress:
+            on_progress(applied_count, total)
+    return applied_count
+
+
+def delete_reviews_in_batches(reviews, on_progress=None, batch_size=None):
+    '''
+    Deletes reviews (and, by cascade, their synonyms) in primary key ordered batches of at most batch_size, each in its
+    own transaction, so that no single statement holds locks over a whole account.
+
+    :param reviews: queryset of the reviews to delete.
+    :param on_progress: optional callable, called with (deleted so far, total) after each batch.
+    :param batch_size: reviews per batch. Defaults to settings.REVIEW_DELETE_BATCH_SIZE.
+    :return: the number of reviews deleted.
+    '''
+    def delete_batch(batch):
+        _, deleted_per_model = batch.delete()
+        return deleted_per_model.get(UserSpecific._meta.label, 0)
+
+    return _apply_to_reviews_in_batches(reviews, delete_batch, on_progress, batch_size)
+
+
+def archive_reviews_in_batches(reviews, on_progress=None, batch_size=None):
+    '''
+    Like delete_reviews_in_batches, but the reviews are only flagged as archived, keeping their history and synonyms.
+
+    :return: the number of reviews archived.
+    '''
+    return _apply_to_reviews_in_batches(reviews, lambda batch: batch.update(archived=True), on_progress, batch_size)
+
+
+def lock_level_for_user(requested_level, user, on_progress=None):
     requested_level = int(requested_level)
-    reviews = UserSpecific.objects.filter(user=user, vocabulary__readings__level=requested_level).distinct()
-    count = reviews.count()
-    reviews.delete()
-    level = Level.objects.get(profile=user.profile, level=requested_level)
-    user.profile.unlocked_levels.remove(level)
-    level.delete()
+    reviews = UserSpecific.objects.filter(user=user, vocabulary__readings__level=requested_level)
+    count = archive_reviews_in_batches(reviews, on_progress)
+    Level.objects.filter(profile=user.profile, level=requested_level).delete()
     return count
 
 
+def restore_archived_level_for_user(requested_level, user):
+    '''
+    Brings back the reviews archived when the user locked this level, with a single UPDATE and no call to WaniKani.
+
+    :return: the number of reviews restored.
+    '''
+    return UserSpecific.all_objects.filter(user=user, archived=True, vocabulary__readings__level=requested_level) \
+        .update(archived=False)
+
+
 def unlock_all_possible_levels_for_user(user):
     """
 
@@ -198,15 +267,14 @@ def unlock_eligible_vocab_from_levels(user, levels):
 
 
 def get_wanikani_level_by_api_key(api_key):
-    api_string = "https://www.wanikani.com/api/user/{}/user-information".format(api_key)
-    response = make_api_call(api_string)
+    response = get_client().get_user_information(api_key)
     user_info = response["user_information"]
     level = user_info["level"]
     return level
 
 
 def build_user_information_api_string(api_key):
-    return "https://www.wanikani.com/api/user/{}/user-information".format(api_key)
+    return USER_INFO_URL.format(api_key)
 
 
 @shared_task
@@ -248,15 +316,85 @@ def sync_user_profile_with_wk(user):
 
 
 @shared_task
-def sync_with_wk(user_id, full_sync=False):
+def sync_with_wk(user_id, full_sync=False, batch_id=None):
     '''
     Takes a user. Checks the vocab list from WK for all levels. If anything new has been unlocked on the WK side,
     it also unlocks it here on Kaniwani and creates a new review for the user.
 
     :param user_id: id of the user to sync
     :param full_sync:
+    :param batch_id: id of the sync_all_users_to_wk batch this sync belongs to, if any.
     :return: None
     '''
+    if batch_id is not None and sync_batch_is_cancelled(batch_id):
+        logger.info("Skipping sync for user {}, batch {} was cancelled.".format(user_id, batch_id))
+        _mark_not_synced_in_batch(batch_id, user_id, "cancelled")
+        return False, 0, 0
+
+    with user_sync_lease(user_id, full_sync) as acquired:
+        if not acquired:
+            if batch_id is not None:
+                _mark_not_synced_in_batch(batch_id, user_id, "already syncing")
+            return False, 0, 0
+        try:
+            result = _sync_with_wk(user_id, full_sync)
+        except Exception:
+            if batch_id is not None:
+                _mark_not_synced_in_batch(batch_id, user_id, "failed")
+            raise
+    if batch_id is not None:
+        _mark_synced_in_batch(batch_id, user_id)
+    return result
+
+
+SYNC_LEASE_KEY = "sync_with_wk:lease:{}"
+SYNC_REQUESTED_KEY = "sync_with_wk:requested:{}"
+
+
+def _request_follow_up_sync(user_id, full_sync):
+    # A full sync covers a recent one, so a request can only ever be upgraded: add never replaces a pending request, and
+    # a full sync is written over the top of whatever is there.
+    requested_key = SYNC_REQUESTED_KEY.format(user_id)
+    if not cache.add(requested_key, int(full_sync), settings.WANIKANI_SYNC_LEASE_SECONDS) and full_sync:
+        cache.set(requested_key, 1, settings.WANIKANI_SYNC_LEASE_SECONDS)
+
+
+@contextmanager
+def user_sync_lease(user_id, full_sync=False):
+    '''
+    Makes sure only one sync runs for a given user at a time. Yields True if this caller holds the lease and should go
+    ahead with its sync. Otherwise it yields False, and the request is folded into a single follow-up sync which the
+    current holder enqueues once it is done, however many requests came in meanwhile.
+
+    :param user_id: id of the user about to be synced.
+    :param full_sync: whether the caller wanted a full sync, in case it has to be deferred.
+    '''
+    lease_key = SYNC_LEASE_KEY.format(user_id)
+    requested_key = SYNC_REQUESTED_KEY.format(user_id)
+    # An int, so that the lease can be released with an atomic compare and delete.
+    token = uuid.uuid4().int >> 65
+
+    acquired = cache.add(lease_key, token, settings.WANIKANI_SYNC_LEASE_SECONDS)
+    if not acquired:
+        _request_follow_up_sync(user_id, full_sync)
+        # The holder may have finished between our attempt and our request, in which case nobody would pick it up. Our
+        # request is left in place even if we get the lease now, as somebody else may have added to it meanwhile.
+        acquired = cache.add(lease_key, token, settings.WANIKANI_SYNC_LEASE_SECONDS)
+        if not acquired:
+            logger.info("A sync is already running for user {}, a follow-up sync has been requested.".format(user_id))
+
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            # If our lease expired mid-sync somebody else may hold it by now, and theirs must be left alone.
+            cache_ops.delete_if_equal(lease_key, token)
+            follow_up_full_sync = cache_ops.take(requested_key)
+            if follow_up_full_sync is not None:
+                sync_with_wk.delay(user_id, full_sync=bool(follow_up_full_sync))
+
+
+def _sync_with_wk(user_id, full_sync):
     # We split this into two seperate API calls as we do not necessarily know the current level until
     # For the love of god don't delete this next line
     user = User.objects.get(pk=user_id)
@@ -293,6 +431,7 @@ def update_local_vocabulary_information(vocab, vocabulary_json):
     # Update the local meaning based on WK meaning
     meaning = vocabulary_json['meaning']
     vocab.meaning = meaning
+    vocab.wanikani_content_hash = wanikani_content_hash(vocabulary_json)
 
     character = vocabulary_json["character"]
     level = vocabulary_json["level"]
@@ -333,37 +472,41 @@ def has_multiple_kanji(vocab):
 
 
 def synchronize_synonyms(review, user_specific_json):
-    synonym_count = 0
-    incoming_synonyms = user_specific_json["user_synonyms"]
-    if incoming_synonyms is None or len(incoming_synonyms) == 0:
-        return review, synonym_count
-
-    # Add new synonyms
-    for synonym in incoming_synonyms:
-        _, created = review.meaning_synonyms.get_or_create(text=synonym)
-        if created:
-            synonym_count += 1
-
-    # Delete Stale Synonyms
-    for synonym in review.meaning_synonyms.all():
-        if synonym.text not in user_specific_json["user_synonyms"]:
-            synonym.delete()
-            synonym_count -= 1
-
+    synonym_count = reconcile_meaning_synonyms({review.pk: user_specific_json["user_synonyms"]})
     return review, synonym_count
 
 
-def associate_synonyms_to_vocab(user, vocab, user_specific_json):
-    review = None
-    synonym_count = 0
+def reconcile_meaning_synonyms(incoming_synonyms):
+    """
+    Makes each review's meaning synonyms match WaniKani's exactly, using set differences: one fetch of the existing
+    synonyms, one bulk insert and one bulk delete, however many reviews are involved. An empty (or null) list removes
+    all of the review's synonyms, so that removals made on WaniKani propagate.
 
-    try:
-        review = UserSpecific.objects.get(user=user, vocabulary=vocab)
-        _, synonym_count = synchronize_synonyms(review, user_specific_json)
-    except UserSpecific.DoesNotExist:
-        pass
+    :param incoming_synonyms: dictionary mapping review id -> list of synonyms WaniKani has for it.
+    :return: net count of synonyms added (negative if more were removed than added).
+    """
+    incoming_synonyms = dict((review_id, list(OrderedDict.fromkeys(synonyms or ())))
+                             for review_id, synonyms in incoming_synonyms.items())
+    if not incoming_synonyms:
+        return 0
 
-    return review, synonym_count
+    existing_synonyms = MeaningSynonym.objects.filter(review_id__in=incoming_synonyms.keys()) \
+        .values_list('id', 'review_id', 'text')
+    existing_pairs = set()
+    stale_synonym_ids = []
+    for synonym_id, review_id, text in existing_synonyms:
+        if text in incoming_synonyms[review_id]:
+            existing_pairs.add((review_id, text))
+        else:
+            stale_synonym_ids.append(synonym_id)
+
+    new_synonyms = [MeaningSynonym(review_id=review_id, text=text)
+                    for review_id, synonyms in incoming_synonyms.items()
+                    for text in synonyms if (review_id, text) not in existing_pairs]
+    MeaningSynonym.objects.bulk_create(new_synonyms)
+    if stale_synonym_ids:
+        MeaningSynonym.objects.filter(pk__in=stale_synonym_ids).delete()
+    return len(new_synonyms) - len(stale_synonym_ids)
 
 
 def get_users_reviews(user):
@@ -422,61 +565,326 @@ def process_vocabulary_response_for_unlock(user, json_data):
     original_length = len(vocab_list)
     vocab_list = [vocab_json for vocab_json in vocab_list if
                   vocab_json['user_specific'] is not None]  # filters out locked items.
-    total_unlocked_count = 0
-    unlocked_this_request = 0
-    for vocabulary_json in vocab_list:
-        total_unlocked_count += 1
-        _, created, _ = process_single_item_from_wanikani(vocabulary_json, user)
-        if created:
-            unlocked_this_request += 1
+    total_unlocked_count = len(vocab_list)
+    with transaction.atomic():
+        vocab_by_character = sync_catalog_items(vocab_list)
+        unlocked_this_request, _ = sync_reviews_for_items(user, vocab_list, vocab_by_character)
 
     logger.info("Unlocking level for {}".format(user.username))
     remaining_locked = original_length - total_unlocked_count
     return unlocked_this_request, total_unlocked_count, remaining_locked
 
 
-def process_single_item_from_wanikani(vocabulary, user):
-    user_specific = vocabulary['user_specific']
-    vocab, _ = import_vocabulary_from_json(vocabulary)
-    review, created = associate_vocab_to_user(vocab, user)
-    review, synonyms_added_count = synchronize_synonyms(review, user_specific)
-    review.wanikani_srs = user_specific["srs"]
-    review.wanikani_srs_numeric = user_specific["srs_numeric"]
-    review.wanikani_burned = user_specific["burned"]
-    review.save()
-    return review, created, synonyms_added_count
-
-
 def import_vocabulary_from_json(vocabulary):
     vocab, is_new = get_or_create_vocab_by_json(vocabulary)
     vocab = update_local_vocabulary_information(vocab, vocabulary)
     return vocab, is_new
 
 
-def process_vocabulary_response_for_user(user, json_data):
+def _chunks(items, size):
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def bulk_update_field(model, field_name, values_by_pk, batch_size=500, key_field='pk'):
+    """
+    Sets field_name to a (possibly different) value on each of the given rows using a single UPDATE ... CASE statement
+    per batch, instead of one save() per row.
+
+    :param model: The model class to update.
+    :param field_name: The field to set.
+    :param values_by_pk: dictionary mapping primary key (or key_field) -> new value.
+    :param key_field: A unique field to identify the rows by, e.g. 'user_id' on Profile.
+    :return: the number of rows updated.
+    """
+    field = model._meta.get_field(field_name)
+    updated_count = 0
+    for batch in _chunks(values_by_pk.items(), batch_size):
+        whens = [When(**{key_field: key, 'then': Value(value)}) for key, value in batch]
+        updated_count += model._base_manager.filter(**{key_field + '__in': [key for key, _ in batch]}) \
+            .update(**{field_name: Case(*whens, output_field=field)})
+    return updated_count
+
+
+def _create_vocabulary(vocabulary):
+    # We need the new primary keys back in order to attach readings and reviews. Only some backends hand those back
+    # from a bulk insert; everywhere else we fall back to one insert per new vocabulary, which is rare in practice.
+    if connection.features.can_return_ids_from_bulk_insert:
+        Vocabulary.objects.bulk_create(vocabulary)
+    else:
+        for vocab in vocabulary:
+            vocab.save()
+
+
+def wanikani_content_hash(vocabulary_json):
+    """
+    Fingerprints the catalog part of a WaniKani vocabulary item, i.e. everything except the user_specific information.
+    """
+    content = [vocabulary_json['character'], vocabulary_json['meaning'], vocabulary_json['kana'],
+               vocabulary_json['level']]
+    return hashlib.sha1(json.dumps(content, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def sync_catalog_items(vocab_list, update_existing=True, trust_hashes=True, dry_run=False, summary=None):
+    """
+    Brings the local catalog in line with a page of WaniKani vocabulary in a constant number of queries. The catalog is
+    the same for every user, so each vocabulary remembers a hash of the WaniKani content it was last synced from, and
+    only items whose hash changed have their readings loaded, diffed and written back in bulk. For the common case of
+    an unchanged page this is a single read.
+
+    :param vocab_list: list of vocabulary JSON objects, as provided by Wanikani.
+    :param update_existing: if False, vocabulary we already know about is left untouched and only missing vocabulary is
+    created.
+    :param trust_hashes: if False, every item is diffed against the catalog, whatever its content hash says.
+    :param dry_run: if True, the diff is worked out but nothing is written.
+    :param summary: optional Counter, incremented with the number of new_vocabulary, changed_meanings, new_readings,
+    changed_levels, unchanged and ambiguous items.
+    :return: dictionary mapping kanji -> Vocabulary, for every item which could be matched to exactly one vocabulary.
+    """
+    summary = Counter() if summary is None else summary
+    characters = set(vocabulary_json['character'] for vocabulary_json in vocab_list)
+    known_vocabulary = defaultdict(dict)
+    vocabulary_fields = ['id', 'meaning', 'wanikani_content_hash']
+    known_rows = Reading.objects.filter(character__in=characters) \
+        .values_list('character', 'vocabulary_id', 'vocabulary__meaning', 'vocabulary__wanikani_content_hash') \
+        .distinct()
+    for character, vocab_id, meaning, content_hash in known_rows:
+        known_vocabulary[character][vocab_id] = Vocabulary.from_db(connection.alias, vocabulary_fields,
+                                                                   (vocab_id, meaning, content_hash))
+
+    vocab_by_character = {}
+    changed_items = []
+    new_vocabulary = []
+    meaning_changes = {}
+    hash_changes = {}
+    for vocabulary_json in vocab_list:
+        character = vocabulary_json['character']
+        content_hash = wanikani_content_hash(vocabulary_json)
+        found_vocabulary = known_vocabulary.get(character, {})
+        if len(found_vocabulary) > 1:
+            logger.error("Found multiple Vocabulary with identical kanji with ids: [{}]".format(
+                ", ".join(str(vocab_id) for vocab_id in found_vocabulary)))
+            summary['ambiguous'] += 1
+            continue
+        elif found_vocabulary:
+            vocab = next(iter(found_vocabulary.values()))
+            if update_existing and (vocab.wanikani_content_hash != content_hash or not trust_hashes):
+                changed_items.append((vocab, vocabulary_json))
+                if vocab.wanikani_content_hash != content_hash:
+                    hash_changes[vocab.pk] = vocab.wanikani_content_hash = content_hash
+                if vocab.meaning != vocabulary_json['meaning']:
+                    vocab.meaning = vocabulary_json['meaning']
+                    meaning_changes[vocab.pk] = vocab.meaning
+            else:
+                summary['unchanged'] += 1
+        else:
+            vocab = Vocabulary(meaning=vocabulary_json['meaning'], wanikani_content_hash=content_hash)
+            new_vocabulary.append(vocab)
+            changed_items.append((vocab, vocabulary_json))
+        vocab_by_character[character] = vocab
+
+    summary['new_vocabulary'] += len(new_vocabulary)
+    summary['changed_meanings'] += len(meaning_changes)
+    if not changed_items:
+        return vocab_by_character
+
+    if not dry_run:
+        _create_vocabulary(new_vocabulary)
+        bulk_update_field(Vocabulary, 'meaning', meaning_changes)
+        bulk_update_field(Vocabulary, 'wanikani_content_hash', hash_changes)
+
+    changed_characters = set(vocabulary_json['character'] for _, vocabulary_json in changed_items)
+    readings_by_key = dict(((reading.character, reading.kana), reading)
+                           for reading in Reading.objects.filter(character__in=changed_characters))
+    new_readings = []
+    level_changes = {}
+    for vocab, vocabulary_json in changed_items:
+        character = vocabulary_json['character']
+        level = vocabulary_json['level']
+        for kana in [reading.strip() for reading in vocabulary_json["kana"].split(",")]:
+            reading = readings_by_key.get((character, kana))
+            if reading is None:
+                reading = Reading(vocabulary=vocab, character=character, kana=kana, level=level)
+                readings_by_key[(character, kana)] = reading
+                new_readings.append(reading)
+            elif reading.level != level:
+                reading.level = level
+                level_changes[reading.pk] = level
+
+    summary['new_readings'] += len(new_readings)
+    summary['changed_levels'] += len(level_changes)
+    if not dry_run:
+        Reading.objects.bulk_create(new_readings)
+        bulk_update_field(Reading, 'level', level_changes)
+        if new_vocabulary or meaning_changes or new_readings or level_changes:
+            schedule_catalog_snapshot_rebuild()
+        for reading in new_readings:
+            logger.info("Created new reading: {}, level {} associated to vocab {}".format(reading.kana, reading.level,
+                                                                                          reading.vocabulary.meaning))
+    return vocab_by_character
+
+
+CATALOG_SNAPSHOT_REBUILD_KEY = "catalog_snapshot:rebuild_pending"
+
+
+def schedule_catalog_snapshot_rebuild():
+    """
+    Rebuilds the catalog snapshot shortly after the current transaction commits. Changes made in quick succession, e.g.
+    one per level by repopulate_catalog, are coalesced into a single rebuild.
+    """
+    def enqueue_rebuild():
+        delay = settings.CATALOG_SNAPSHOT_REBUILD_DELAY_SECONDS
+        if cache.add(CATALOG_SNAPSHOT_REBUILD_KEY, True, delay * 2):
+            refresh_catalog_snapshot.apply_async(countdown=delay)
+
+    transaction.on_commit(enqueue_rebuild)
+
+
+@shared_task
+def refresh_catalog_snapshot():
+    '''
+    Task which rewrites the catalog snapshot, if one has been deployed, after the catalog has changed.
+
+    :return: the version of the new snapshot, or None if there is none.
+    '''
+    cache.delete(CATALOG_SNAPSHOT_REBUILD_KEY)
+    return rebuild_catalog_snapshot()
+
+
+def sync_reviews_for_items(user, vocab_list, vocab_by_character, follow=True):
+    """
+    Synchronizes a user's reviews and synonyms against a page of WaniKani vocabulary, in a constant number of queries.
+
+    :param user: The user being synced.
+    :param vocab_list: list of unlocked vocabulary JSON objects, as provided by Wanikani.
+    :param vocab_by_character: dictionary mapping kanji -> Vocabulary, as returned by sync_catalog_items.
+    :param follow: if True, missing reviews are created and WaniKani SRS information is copied over. Otherwise only the
+    synonyms of reviews the user already has are touched.
+    :return: count of new reviews, count of new synonyms.
+    """
+    user_specific_by_vocab = {}
+    for vocabulary_json in vocab_list:
+        vocab = vocab_by_character.get(vocabulary_json['character'])
+        if vocab is not None:
+            user_specific_by_vocab[vocab.pk] = vocabulary_json['user_specific']
+
+    # Archived reviews are included, both so that we never try to create a second review for the same vocabulary and so
+    # that following the user restores them instead.
+    reviews = UserSpecific.all_objects.filter(user=user, vocabulary_id__in=user_specific_by_vocab.keys())
+    reviews_by_vocab = dict((review.vocabulary_id, review) for review in reviews)
+
+    new_review_count = 0
+    if follow:
+        archived_review_ids = [review.pk for review in reviews_by_vocab.values() if review.archived]
+        if archived_review_ids:
+            new_review_count += UserSpecific.all_objects.filter(pk__in=archived_review_ids).update(archived=False)
+
+        now = timezone.now()
+        new_reviews = [UserSpecific(user=user, vocabulary_id=vocab_id, needs_review=True, next_review_date=now)
+                       for vocab_id in user_specific_by_vocab if vocab_id not in reviews_by_vocab]
+        if new_reviews:
+            UserSpecific.objects.bulk_create(new_reviews)
+            new_review_count += len(new_reviews)
+            reviews = UserSpecific.objects.filter(user=user, vocabulary_id__in=user_specific_by_vocab.keys())
+            reviews_by_vocab = dict((review.vocabulary_id, review) for review in reviews)
+
+        # Reviews sharing the same WK state are updated together, so this is bounded by the number of SRS stages.
+        srs_changes = defaultdict(list)
+        for vocab_id, review in reviews_by_vocab.items():
+            user_specific = user_specific_by_vocab[vocab_id]
+            srs_state = (user_specific["srs"], user_specific["srs_numeric"], user_specific["burned"])
+            if (review.wanikani_srs, review.wanikani_srs_numeric, review.wanikani_burned) != srs_state:
+                srs_changes[srs_state].append(review.pk)
+
+        for (srs, srs_numeric, burned), review_ids in srs_changes.items():
+            UserSpecific.objects.filter(pk__in=review_ids).update(wanikani_srs=srs,
+                                                                  wanikani_srs_numeric=srs_numeric,
+                                                                  wanikani_burned=burned)
+
+    incoming_synonyms = dict((review.pk, user_specific_by_vocab[vocab_id]["user_synonyms"])
+                             for vocab_id, review in reviews_by_vocab.items())
+    return new_review_count, reconcile_meaning_synonyms(incoming_synonyms)
+
+
+def wanikani_level_fingerprints(vocab_list, follow_me):
+    """
+    Fingerprints a WaniKani vocabulary response per level, covering both the catalog content and the user_specific
+    blocks (including items which are still locked). Only the fields syncing uses are hashed, so e.g. a changed streak
+    doesn't force a level to be processed again. Whether the user is followed changes how a page is processed, so
+    it is part of the fingerprint too.
+
+    :return: dictionary mapping level -> fingerprint.
+    """
+    items_by_level = defaultdict(list)
+    for vocabulary_json in vocab_list:
+        items_by_level[vocabulary_json['level']].append(compact_vocabulary(vocabulary_json))
+
+    fingerprints = {}
+    for level, items in items_by_level.items():
+        items.sort(key=lambda vocabulary_json: vocabulary_json['character'])
+        content = json.dumps([follow_me, items], sort_keys=True, ensure_ascii=False)
+        fingerprints[level] = hashlib.sha1(content.encode("utf-8")).hexdigest()
+    return fingerprints
+
+
+def _levels_missing_reviews(user, vocab_list):
+    # Compares, per level, how many items the user has unlocked on WaniKani with how many reviews they have locally.
+    unlocked_counts = Counter(vocabulary_json['level'] for vocabulary_json in vocab_list
+                              if vocabulary_json['user_specific'] is not None)
+    review_counts = dict(UserSpecific.all_objects.filter(user=user, vocabulary__readings__level__in=unlocked_counts)
+                         .values('vocabulary__readings__level')
+                         .annotate(review_count=Count('id', distinct=True))
+                         .values_list('vocabulary__readings__level', 'review_count'))
+    return set(level for level, unlocked_count in unlocked_counts.items()
+               if review_counts.get(level, 0) < unlocked_count)
+
+
+def process_vocabulary_response_for_user(user, json_data, skip_unchanged_levels=False):
     """
-    Given a response object from Requests.get(), iterate over the list of vocabulary, and synchronize the user.
+    Given a JSON response from WK, synchronize the user's catalog, reviews and synonyms against the list of vocabulary.
     :param json_data:
     :param user:
-    :return:
+    :return: count of new reviews, count of new synonyms.
     """
-    new_review_count = 0
-    new_synonym_count = 0
-    vocab_list = json_data['requested_information']
+    return process_vocabulary_items_for_user(user, json_data['requested_information'], skip_unchanged_levels)
+
+
+def process_vocabulary_items_for_user(user, vocab_list, skip_unchanged_levels=False):
+    """
+    Synchronizes the user's catalog, reviews and synonyms against a page of WK vocabulary, as returned by
+    fetch_vocabulary. The whole page is handled in a constant number of queries.
+    :param user:
+    :param vocab_list: list of vocabulary JSON objects, locked ones included.
+    :param skip_unchanged_levels: if True, levels whose WaniKani data hasn't changed since they were last processed
+    this way are skipped entirely, and the fingerprints of the levels which were processed are stored. A level which
+    is missing reviews locally is processed regardless, so that they are recreated.
+    :return: count of new reviews, count of new synonyms.
+    """
+    follow_me = user.profile.follow_me
+
+    changed_levels = {}
+    if skip_unchanged_levels:
+        fingerprints = wanikani_level_fingerprints(vocab_list, follow_me)
+        missing_reviews = _levels_missing_reviews(user, vocab_list) if follow_me else set()
+        for level in Level.objects.filter(profile=user.profile, level__in=fingerprints.keys()):
+            if level.wanikani_fingerprint != fingerprints[level.level] or level.level in missing_reviews:
+                changed_levels[level.pk] = fingerprints[level.level]
+            else:
+                del fingerprints[level.level]
+        vocab_list = [vocab_json for vocab_json in vocab_list if vocab_json['level'] in fingerprints]
+        if not vocab_list:
+            logger.info("Vocabulary for {} is unchanged, skipping.".format(user.username))
+            return 0, 0
+
     # Filter items the user has not unlocked.
     vocab_list = [vocab_json for vocab_json in vocab_list if vocab_json['user_specific'] is not None]
 
-    for vocabulary_json in vocab_list:
-        if user.profile.follow_me:
-            review, created, synonyms_added_count = process_single_item_from_wanikani(vocabulary_json, user)
-            synonyms_added_count += new_synonym_count
-            if created:
-                new_review_count += 1
-            review.save()
-        else: # User does not want to be followed, so we prevent creation of new vocab, and sync only synonyms instead.
-            vocabulary, created = get_or_create_vocab_by_json(vocabulary_json)
-            new_review, synonyms_added_count = associate_synonyms_to_vocab(user, vocabulary, vocabulary_json['user_specific'])
-            new_synonym_count += synonyms_added_count
+    # If the user does not want to be followed, we prevent creation of new reviews, and sync only synonyms instead.
+    with transaction.atomic():
+        vocab_by_character = sync_catalog_items(vocab_list, update_existing=follow_me)
+        new_review_count, new_synonym_count = sync_reviews_for_items(user, vocab_list, vocab_by_character,
+                                                                     follow=follow_me)
+        bulk_update_field(Level, 'wanikani_fingerprint', changed_levels)
     logger.info("Synced Vocabulary for {}".format(user.username))
     return new_review_count, new_synonym_count
 
@@ -488,8 +896,8 @@ def sync_recent_unlocked_vocab_with_wk(user):
         if levels:
             request_string = build_API_sync_string_for_user_for_levels(user, levels)
             try:
-                json_data = make_api_call(request_string)
-                new_review_count, new_synonym_count = process_vocabulary_response_for_user(user, json_data)
+                vocab_list = fetch_vocabulary(request_string)
+                new_review_count, new_synonym_count = process_vocabulary_items_for_user(user, vocab_list)
                 return new_review_count, new_synonym_count
             except exceptions.InvalidWaniKaniKey:
                 user.profile.api_valid = False
@@ -500,46 +908,221 @@ def sync_recent_unlocked_vocab_with_wk(user):
 
 
 def sync_unlocked_vocab_with_wk(user):
+    """
+    Syncs every level the user has unlocked. Pages of levels are fetched from WaniKani concurrently (up to
+    WANIKANI_MAX_CONCURRENT_PAGES_PER_USER at a time) and parsed as they stream in, and each page is written to the DB
+    on this thread as soon as it arrives, so DB work overlaps with the remaining fetches. Levels which haven't changed on WaniKani since the last
+    full sync are not processed at all.
+    """
     if user.profile.unlocked_levels_list():
         pages = get_level_pages(user.profile.unlocked_levels_list())
+        request_strings = [build_API_sync_string_for_user_for_levels(user, page) for page in pages]
+        logger.info("Fetching {} pages of vocabulary for user {}".format(len(request_strings), user.username))
         new_review_count = new_synonym_count = 0
-        for page in pages:
-            request_string = build_API_sync_string_for_user_for_levels(user, page)
-            logger.info("Creating sync string for user {}: {}".format(user.username, user.profile.api_key))
-            try:
-                response = make_api_call(request_string)
-                current_page_review_count, current_page_synonym_count = process_vocabulary_response_for_user(user, response)
-                new_review_count += current_page_review_count
-                new_synonym_count += current_page_synonym_count
-            except exceptions.InvalidWaniKaniKey:
-                user.profile.api_valid = False
-                user.profile.save()
-            except exceptions.WanikaniAPIException as e:
-                logger.error("Couldn't sync recent vocab for {}".format(user.username), e)
+        max_workers = min(settings.WANIKANI_MAX_CONCURRENT_PAGES_PER_USER, len(request_strings))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending_pages = [executor.submit(fetch_vocabulary, request_string) for request_string in request_strings]
+            for fetched_page in as_completed(pending_pages):
+                try:
+                    vocab_list = fetched_page.result()
+                    current_page_review_count, current_page_synonym_count = process_vocabulary_items_for_user(
+                        user, vocab_list, skip_unchanged_levels=True)
+                    new_review_count += current_page_review_count
+                    new_synonym_count += current_page_synonym_count
+                except exceptions.InvalidWaniKaniKey:
+                    user.profile.api_valid = False
+                    user.profile.save()
+                    # No point in waiting on the rest of the pages, they will fail the same way.
+                    for pending_page in pending_pages:
+                        pending_page.cancel()
+                    break
+                except exceptions.WanikaniAPIException as e:
+                    logger.error("Couldn't sync recent vocab for {}: {}".format(user.username, e))
         return new_review_count, new_synonym_count
     else:
         return 0, 0
 
 
+SYNC_BATCH_KEY = "sync_all_users:{}"
+SYNC_BATCH_RELEASED_KEY = "sync_all_users:{}:released"
+SYNC_BATCH_RELEASING_KEY = "sync_all_users:{}:releasing"
+SYNC_BATCH_CANCELLED_KEY = "sync_all_users:{}:cancelled"
+SYNC_BATCH_COMPLETED_KEY = "sync_all_users:{}:completed"
+SYNC_BATCH_USER_KEY = "sync_all_users:{}:user:{}"
+SYNC_BATCH_FAILED_USER_KEY = "sync_all_users:{}:failed:{}"
+CURRENT_SYNC_BATCH_KEY = "sync_all_users:current"
+
+
+def _sync_batch_timeout():
+    return settings.SYNC_ALL_USERS_SPREAD_SECONDS + 24 * 60 * 60
+
+
+def _mark_synced_in_batch(batch_id, user_id):
+    cache.delete(SYNC_BATCH_FAILED_USER_KEY.format(batch_id, user_id))
+    if cache.add(SYNC_BATCH_USER_KEY.format(batch_id, user_id), True, _sync_batch_timeout()):
+        try:
+            cache.incr(SYNC_BATCH_COMPLETED_KEY.format(batch_id))
+        except ValueError:
+            # The batch has expired from the cache, nothing left to report progress to.
+            pass
+
+
+def _mark_not_synced_in_batch(batch_id, user_id, reason):
+    # Users who aren't marked as synced are picked up again by resume_sync_batch, this just records why.
+    cache.set(SYNC_BATCH_FAILED_USER_KEY.format(batch_id, user_id), reason, _sync_batch_timeout())
+
+
+def _get_sync_batch(batch_id=None):
+    batch_id = batch_id or cache.get(CURRENT_SYNC_BATCH_KEY)
+    batch = cache.get(SYNC_BATCH_KEY.format(batch_id)) if batch_id else None
+    return batch_id, batch
+
+
+def _schedule_sync_batch(batch_id, batch, user_ids, window):
+    # Users are given evenly spaced slots over the window, in the order given (most recently active first), and are
+    # handed to the workers by release_sync_batch as their slot comes up.
+    batch.update({"queue": user_ids, "window_start": timezone.now(), "window": max(0, window)})
+    cache.set(SYNC_BATCH_KEY.format(batch_id), batch, _sync_batch_timeout())
+    cache.set(SYNC_BATCH_CANCELLED_KEY.format(batch_id), False, _sync_batch_timeout())
+    cache.set(SYNC_BATCH_RELEASED_KEY.format(batch_id), 0, _sync_batch_timeout())
+    cache.set(CURRENT_SYNC_BATCH_KEY, batch_id, _sync_batch_timeout())
+
+
+def sync_batch_is_cancelled(batch_id):
+    # Kept apart from the batch itself, so that every sync in it can check without loading the whole list of users.
+    return bool(cache.get(SYNC_BATCH_CANCELLED_KEY.format(batch_id)))
+
+
 @shared_task
 def sync_all_users_to_wk():
     '''
-    calls sync_with_wk for all users, causing all users to have their newly unlocked vocabulary synchronized to KW.
+    Starts a batch which fully syncs every user who has visited in the last week. Rather than enqueueing everybody at
+    once, users are given evenly spaced slots over SYNC_ALL_USERS_SPREAD_SECONDS by how recently they were active, most
+    recent first, and release_sync_batch hands them to the workers as their slots come up.
+
+    The batch can be followed with get_sync_batch_progress, stopped with cancel_sync_batch and picked back up with
+    resume_sync_batch.
 
-    :return: the number of users successfully synced to WK.
+    :return: the number of users scheduled to be synced.
     '''
     one_week_ago = past_time(24 * 7)
-    logger.info("Beginning Bi-daily Sync for all user!")
-    users = User.objects.all().exclude(profile__isnull=True)
-    logger.info("Original sync would have occurred for {} users.".format(users.count()))
-    users = User.objects.filter(profile__last_visit__gte=one_week_ago)
-    logger.info("Sync will occur for {} users.".format(users.count()))
-    affected_count = 0
-    for user in users:
-        logger.info(user.username + " --- " + str(user.profile.last_visit) + " --- " + str(one_week_ago))
-        sync_with_wk.apply_async(args=[user.id, True], queue="long_running_sync")
-        affected_count += 1
-    return affected_count
+    user_ids = list(User.objects.filter(profile__last_visit__gte=one_week_ago)
+                    .order_by('-profile__last_visit')
+                    .values_list('id', flat=True))
+
+    batch_id = uuid.uuid4().hex
+    cache.set(SYNC_BATCH_COMPLETED_KEY.format(batch_id), 0, _sync_batch_timeout())
+    _schedule_sync_batch(batch_id, {"user_ids": user_ids, "started": timezone.now()}, user_ids,
+                         settings.SYNC_ALL_USERS_SPREAD_SECONDS)
+
+    logger.info("Sync batch {} will sync {} users over the next {} seconds.".format(
+        batch_id, len(user_ids), settings.SYNC_ALL_USERS_SPREAD_SECONDS))
+    release_sync_batch(batch_id)
+    return len(user_ids)
+
+
+@shared_task
+def release_sync_batch(batch_id=None):
+    '''
+    Periodic task which enqueues the syncs of a batch whose slots fall before its next run, each delayed until its
+    slot. Countdowns therefore never exceed SYNC_BATCH_RELEASE_INTERVAL_SECONDS, so the broker never holds long ETAs.
+
+    :param batch_id: the batch to release from. Defaults to the most recently started batch.
+    :return: the number of syncs enqueued.
+    '''
+    batch_id = batch_id or cache.get(CURRENT_SYNC_BATCH_KEY)
+    if batch_id is None or sync_batch_is_cancelled(batch_id):
+        return 0
+
+    # Releases which overlap would both enqueue the same positions, so only one may run at a time.
+    lease_key = SYNC_BATCH_RELEASING_KEY.format(batch_id)
+    token = uuid.uuid4().int >> 65
+    if not cache.add(lease_key, token, settings.SYNC_BATCH_RELEASE_INTERVAL_SECONDS):
+        logger.info("Sync batch {} is already being released.".format(batch_id))
+        return 0
+    try:
+        return _release_due_syncs(batch_id)
+    finally:
+        cache_ops.delete_if_equal(lease_key, token)
+
+
+def _release_due_syncs(batch_id):
+    _, batch = _get_sync_batch(batch_id)
+    if batch is None:
+        return 0
+
+    queue = batch["queue"]
+    released = cache.get(SYNC_BATCH_RELEASED_KEY.format(batch_id), 0)
+    if released >= len(queue):
+        return 0
+
+    now = timezone.now()
+    slot_width = batch["window"] / len(queue)
+    release_until = (now - batch["window_start"]).total_seconds() + settings.SYNC_BATCH_RELEASE_INTERVAL_SECONDS
+    due = len(queue) if slot_width == 0 else min(len(queue), int(release_until // slot_width) + 1)
+    for position in range(released, due):
+        slot = batch["window_start"] + timedelta(seconds=position * slot_width)
+        sync_with_wk.apply_async(args=[queue[position], True], kwargs={"batch_id": batch_id},
+                                 countdown=max(0, int((slot - now).total_seconds())), queue="long_running_sync")
+    cache.set(SYNC_BATCH_RELEASED_KEY.format(batch_id), max(released, due), _sync_batch_timeout())
+    return max(0, due - released)
+
+
+def get_sync_batch_progress(batch_id=None):
+    '''
+    :param batch_id: the batch to report on. Defaults to the most recently started batch.
+    :return: dictionary describing the batch, or None if it is unknown or has expired.
+    '''
+    batch_id, batch = _get_sync_batch(batch_id)
+    if batch is None:
+        return None
+    failed = cache.get_many([SYNC_BATCH_FAILED_USER_KEY.format(batch_id, user_id) for user_id in batch["user_ids"]])
+    return {
+        "batch_id": batch_id,
+        "started": batch["started"],
+        "cancelled": sync_batch_is_cancelled(batch_id),
+        "total": len(batch["user_ids"]),
+        "completed": cache.get(SYNC_BATCH_COMPLETED_KEY.format(batch_id), 0),
+        "failed": len(failed),
+    }
+
+
+def cancel_sync_batch(batch_id=None):
+    '''
+    Cancels a batch. Nothing more is released, and syncs which are still waiting on their countdown will exit without
+    doing any work.
+
+    :return: the id of the cancelled batch, or None if there was no such batch.
+    '''
+    batch_id, batch = _get_sync_batch(batch_id)
+    if batch is None:
+        return None
+    cache.set(SYNC_BATCH_CANCELLED_KEY.format(batch_id), True, _sync_batch_timeout())
+    logger.info("Cancelled sync batch {}.".format(batch_id))
+    return batch_id
+
+
+def resume_sync_batch(batch_id=None):
+    '''
+    Reschedules every user of a batch who hasn't been synced yet, including those whose sync failed or was skipped,
+    spread over whatever remains of the batch's window. Meant for batches which were cancelled, had failures, or whose
+    queued tasks were lost.
+
+    :return: the number of users rescheduled.
+    '''
+    batch_id, batch = _get_sync_batch(batch_id)
+    if batch is None:
+        return 0
+
+    done = cache.get_many([SYNC_BATCH_USER_KEY.format(batch_id, user_id) for user_id in batch["user_ids"]])
+    remaining = [user_id for user_id in batch["user_ids"] if SYNC_BATCH_USER_KEY.format(batch_id, user_id) not in done]
+    cache.delete_many([SYNC_BATCH_FAILED_USER_KEY.format(batch_id, user_id) for user_id in remaining])
+    elapsed = (timezone.now() - batch["started"]).total_seconds()
+    _schedule_sync_batch(batch_id, batch, remaining, int(settings.SYNC_ALL_USERS_SPREAD_SECONDS - elapsed))
+
+    logger.info("Resuming sync batch {} for {} remaining users.".format(batch_id, len(remaining)))
+    release_sync_batch(batch_id)
+    return len(remaining)
 
 
 def pull_user_synonyms_by_level(user, level):
@@ -548,56 +1131,136 @@ def pull_user_synonyms_by_level(user, level):
 
     :param user: User to pull WK synonyms or
     :param level: The level for synonyms that should be pulled
-    :return: None
+    :return: count of synonyms added.
     '''
-    request_string = build_API_sync_string_for_user_for_levels(user, level)
-    try:
-        json_data = make_api_call(request_string)
-        vocabulary_list = json_data['requested_information']
+    return pull_user_synonyms(user, [level])
+
+
+def pull_user_synonyms(user, levels=None):
+    '''
+    Pulls the user's WK synonyms for the given levels, fetched a page of levels at a time. Reviews are matched by meaning
+    against a map of the user's reviews built once up front, and missing synonyms are bulk inserted page by page.
+    Synonyms are only ever added here, never removed.
+
+    :param user: User to pull WK synonyms for.
+    :param levels: The levels to pull synonyms for. Defaults to every level the user has unlocked.
+    :return: count of synonyms added.
+    '''
+    levels = user.profile.unlocked_levels_list() if levels is None else levels
+    if not levels:
+        return 0
+
+    review_ids_by_meaning = defaultdict(list)
+    for meaning, review_id in UserSpecific.objects.filter(user=user).values_list('vocabulary__meaning', 'id'):
+        review_ids_by_meaning[meaning].append(review_id)
+    known_synonyms = set(MeaningSynonym.objects.filter(review__user=user).values_list('review_id', 'text'))
+
+    new_synonym_count = 0
+    for page in get_level_pages(levels):
+        try:
+            vocabulary_list = fetch_vocabulary(build_API_sync_string_for_user_for_levels(user, page))
+        except exceptions.InvalidWaniKaniKey:
+            user.profile.api_valid = False
+            user.profile.save()
+            break
+        except exceptions.WanikaniAPIException as e:
+            logger.warning("Couldnt pull user synonyms for {} on levels {}: {}".format(user.username, page, e))
+            continue
+
+        new_synonyms = []
         for vocabulary in vocabulary_list:
-            meaning = vocabulary["meaning"]
-            if vocabulary['user_specific'] and vocabulary['user_specific']['user_synonyms']:
-                try:
-                    review = UserSpecific.objects.get(user=user, vocabulary__meaning=meaning)
-                    for synonym in vocabulary['user_specific']['user_synonyms']:
-                        review.meaning_synonyms.get_or_create(text=synonym)
-                    review.save()
-                except UserSpecific.DoesNotExist as e:
-                    logger.error("Couldn't pull review during a synonym sync: {}".format(e))
-                except KeyError as e:
-                    logger.error("No user_specific or synonyms?: {}".format(json_data))
-                except UserSpecific.MultipleObjectsReturned:
-                    reviews = UserSpecific.objects.filter(user=user, vocabulary__meaning=meaning)
-                    for review in reviews:
-                        logger.error(
-                            "Found something janky! Multiple reviews under 1 vocab meaning?!?: {}".format(
-                                review))
+            if not (vocabulary['user_specific'] and vocabulary['user_specific']['user_synonyms']):
+                continue
+            review_ids = review_ids_by_meaning.get(vocabulary["meaning"], [])
+            if len(review_ids) != 1:
+                if review_ids:
+                    logger.error("Found something janky! Multiple reviews under 1 vocab meaning?!?: {}".format(
+                        review_ids))
+                else:
+                    logger.error("Couldn't pull review during a synonym sync: {}".format(vocabulary["meaning"]))
+                continue
+            for synonym in vocabulary['user_specific']['user_synonyms']:
+                if (review_ids[0], synonym) not in known_synonyms:
+                    known_synonyms.add((review_ids[0], synonym))
+                    new_synonyms.append(MeaningSynonym(review_id=review_ids[0], text=synonym))
+        MeaningSynonym.objects.bulk_create(new_synonyms)
+        new_synonym_count += len(new_synonyms)
+
+    logger.info("Pulled {} new user synonyms for {}".format(new_synonym_count, user.username))
+    return new_synonym_count
 
-    except exceptions.InvalidWaniKaniKey:
-        user.profile.api_valid = False
-        user.profile.save()
-    except exceptions.WanikaniAPIException as e:
-        logger.warning("Couldnt pull user synonyms for {}".format(user.username), e)
+
+@shared_task
+def log_wanikani_rate_limiter_metrics():
+    '''
+    Periodic task which logs how much the WaniKani rate limiter has throttled us, cluster-wide.
+
+    :return: the limiter's metrics, or None if rate limiting is disabled or its metrics are unavailable.
+    '''
+    rate_limiter = get_rate_limiter()
+    if rate_limiter is None:
+        return None
+    return rate_limiter.log_metrics()
+
+
+def save_last_visits(last_visits):
+    '''
+    Writes last visit dates to the users' profiles, with one UPDATE per 500 users.
+
+    :param last_visits: dictionary of user id -> datetime of their last visit.
+    :return: the number of profiles updated.
+    '''
+    return bulk_update_field(Profile, 'last_visit', last_visits, key_field='user_id')
+
+
+@shared_task
+def flush_last_visits():
+    '''
+    Periodic task which saves the visits buffered by SetLastVisitMiddleware since the last flush. If they can't be saved,
+    they are returned to the buffer for the next run.
+
+    :return: the number of profiles updated.
+    '''
+    tracker = get_last_visit_tracker()
+    last_visits = tracker.take_all()
+    if not last_visits:
+        return 0
+    try:
+        updated_count = save_last_visits(last_visits)
+    except Exception:
+        tracker.put_back(last_visits)
+        raise
+    logger.info("Saved last visits for {} users.".format(updated_count))
+    return updated_count
+
+
+@shared_task
+def pull_user_synonyms_for_user(user_id):
+    '''
+    Celery entry point for pull_user_synonyms, used to fan the all-users pull out across workers.
+
+    :param user_id: ID of the user to pull all synonyms for.
+    :return: count of synonyms added.
+    '''
+    return pull_user_synonyms(User.objects.select_related('profile').get(pk=user_id))
 
 
 def pull_all_user_synonyms(user=None):
     '''
-    Syncs up the user's synonyms for WK for all levels that they have currently unlocked.
+    Syncs up the user's synonyms for WK for all levels that they have currently unlocked. With no user, a task is
+    enqueued for every user with a plausible API key.
 
     :param user: The user to pull all synonyms for
-    :return: None
+    :return: count of synonyms added for the user, or None when tasks were enqueued for everybody.
     '''
     if user:
-        for level in user.profile.unlocked_levels_list():
-            pull_user_synonyms_by_level(user, level)
-            logger.info("Pulled user synonyms for {}".format(user.username))
+        return pull_user_synonyms(user)
     else:
-        for profile in Profile.objects.all():
-            if len(profile.api_key) == 32:
-                user = profile.user
-                for level in profile.unlocked_levels_list():
-                    pull_user_synonyms_by_level(user, level)
-                logger.info("Pulled user synonyms for {}".format(user.username))
+        user_ids = Profile.objects.annotate(api_key_length=Length('api_key')) \
+            .filter(api_key_length=32) \
+            .values_list('user_id', flat=True)
+        for user_id in user_ids:
+            pull_user_synonyms_for_user.apply_async((user_id,), queue="long_running_sync")
 
 
 def user_returns_from_vacation(user):
@@ -607,7 +1270,8 @@ def user_returns_from_vacation(user):
     logger.info("{} has returned from vacation!".format(user.username))
     vacation_date = user.profile.vacation_date
     if vacation_date:
-        users_reviews = UserSpecific.objects.filter(user=user)
+        # Archived reviews are shifted too, so they aren't overdue the moment their level is unlocked again.
+        users_reviews = UserSpecific.all_objects.filter(user=user)
         elapsed_vacation_time = timezone.now() - vacation_date
         updated_count = users_reviews.update(last_studied=F('last_studied') + elapsed_vacation_time)
         users_reviews.update(next_review_date=F('next_review_date') + elapsed_vacation_time)
@@ -626,15 +1290,22 @@ def user_begins_vacation(user):
 
 
 def follow_user(user):
+    with user_sync_lease(user.id) as acquired:
+        # If a sync is already running the follow-up sync it enqueues will unlock the user's current level for us.
+        if acquired:
+            _follow_user(user)
+
+
+def _follow_user(user):
     try:
         user.profile.level = get_wanikani_level_by_api_key(user.profile.api_key)
         user.profile.unlocked_levels.get_or_create(level=user.profile.level)
-        user.profile.save()
+        user.profile.save(update_fields=['level'])
         unlock_eligible_vocab_from_levels(user, user.profile.level)
         sync_user_profile_with_wk(user)
     except exceptions.InvalidWaniKaniKey:
         user.profile.api_valid = False
-        user.profile.save()
+        user.profile.save(update_fields=['api_valid'])
 
 
 def disable_follow_me(user):
@@ -678,9 +1349,9 @@ def build_upcoming_srs_for_user(user):
     return real_retval
 
 
-def reset_user(user, reset_to_level):
+def reset_user(user, reset_to_level, on_progress=None):
     reset_levels(user, reset_to_level)
-    reset_reviews(user, reset_to_level)
+    reset_reviews(user, reset_to_level, on_progress)
     disable_follow_me(user)
 
     # Set to current level.
@@ -694,7 +1365,117 @@ def reset_levels(user, reset_to_level):
     user.profile.save()
 
 
-def reset_reviews(user, reset_to_level):
-    reviews_to_delete = UserSpecific.objects.filter(user=user)
+def reset_reviews(user, reset_to_level, on_progress=None):
+    reviews_to_delete = UserSpecific.all_objects.filter(user=user)
     reviews_to_delete = reviews_to_delete.exclude(vocabulary__readings__level__lt=reset_to_level)
-    reviews_to_delete.delete()
+    return delete_reviews_in_batches(reviews_to_delete, on_progress)
+
+
+JOB_OWNER_KEY = "job:{}:owner"
+JOB_PROGRESS_STATE = "PROGRESS"
+
+
+def start_job(job, user, *args, on_commit=False):
+    '''
+    Enqueues one of the *_job tasks below on behalf of a user, and remembers who it belongs to so that only they can
+    poll its status.
+
+    :param job: the job task to run. It is passed the user's id followed by args.
+    :param user: the user the job is being run for.
+    :param on_commit: if True, the job is only enqueued once the current transaction commits, so that it sees the
+    changes made in it.
+    :return: the id of the job.
+    '''
+    job_id = str(uuid.uuid4())
+    cache.set(JOB_OWNER_KEY.format(job_id), user.id, settings.JOB_STATUS_TTL_SECONDS)
+
+    def enqueue_job():
+        job.apply_async(args=[user.id] + list(args), task_id=job_id)
+
+    if on_commit:
+        transaction.on_commit(enqueue_job)
+    else:
+        enqueue_job()
+    return job_id
+
+
+def get_job_owner(job_id):
+    return cache.get(JOB_OWNER_KEY.format(job_id))
+
+
+def get_job_status(job_id):
+    '''
+    :return: dictionary with the job's celery state, plus its progress while running, its result once successful, or
+    its error if it failed.
+    '''
+    result = AsyncResult(job_id)
+    job_status = {"job_id": job_id, "status": result.state}
+    if result.state == JOB_PROGRESS_STATE:
+        job_status["progress"] = result.info
+    elif result.successful():
+        job_status["result"] = result.result
+    elif result.failed():
+        job_status["error"] = str(result.result)
+    return job_status
+
+
+def _report_job_progress(job, step, current, total):
+    # Jobs may also be called directly, in which case there is no celery task to report on.
+    if job.request.id:
+        job.update_state(state=JOB_PROGRESS_STATE, meta={"step": step, "current": current, "total": total})
+
+
+@shared_task(bind=True)
+def sync_with_wk_job(self, user_id, full_sync=False):
+    _report_job_progress(self, "syncing", 0, 1)
+    profile_sync_succeeded, new_review_count, new_synonym_count = sync_with_wk(user_id, full_sync)
+    return {"profile_sync_succeeded": profile_sync_succeeded,
+            "new_review_count": new_review_count,
+            "new_synonym_count": new_synonym_count}
+
+
+@shared_task(bind=True)
+def unlock_level_job(self, user_id, requested_level):
+    user = User.objects.get(pk=user_id)
+    _report_job_progress(self, "unlocking", 0, 1)
+    restored = restore_archived_level_for_user(requested_level, user)
+    if restored:
+        # The level was unlocked before, so its reviews are back without asking WaniKani. Anything unlocked on WaniKani
+        # since it was locked is picked up by the user's next sync.
+        user.profile.unlocked_levels.get_or_create(level=requested_level)
+        return {"unlocked_now": restored, "total_unlocked": restored, "locked": 0}
+
+    unlocked = unlock_eligible_vocab_from_levels(user, requested_level)
+    if unlocked is None:
+        raise exceptions.WanikaniAPIException("Couldn't unlock level {}".format(requested_level))
+
+    unlocked_this_request, total_unlocked, locked = unlocked
+    user.profile.unlocked_levels.get_or_create(level=requested_level)
+    return {"unlocked_now": unlocked_this_request, "total_unlocked": total_unlocked, "locked": locked}
+
+
+@shared_task(bind=True)
+def lock_level_job(self, user_id, requested_level):
+    user = User.objects.get(pk=user_id)
+    _report_job_progress(self, "locking", 0, 1)
+    locked = lock_level_for_user(requested_level, user,
+                                 on_progress=lambda current, total: _report_job_progress(self, "locking", current,
+                                                                                         total))
+    return {"locked": locked}
+
+
+@shared_task(bind=True)
+def reset_user_job(self, user_id, reset_to_level):
+    user = User.objects.get(pk=user_id)
+    _report_job_progress(self, "resetting", 0, 1)
+    reset_user(user, reset_to_level,
+               on_progress=lambda current, total: _report_job_progress(self, "resetting", current, total))
+    return {"message": "Your account has been reset"}
+
+
+@shared_task(bind=True)
+def follow_user_job(self, user_id):
+    user = User.objects.get(pk=user_id)
+    _report_job_progress(self, "following", 0, 1)
+    follow_user(user)
+    return {"level": user.profile.level}
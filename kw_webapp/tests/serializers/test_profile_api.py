@@ -1,18 +1,21 @@
 from datetime import timedelta, time
 from time import sleep
+from unittest import mock
 
 import responses
 from django.utils import timezone
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
 
+from api.serializers import ProfileSerializer
 from kw_webapp import constants
 from kw_webapp.models import Announcement, Vocabulary
+from kw_webapp.wanikani import exceptions
 from kw_webapp.tasks import get_vocab_by_kanji, sync_with_wk
 from kw_webapp.tests.utils import create_vocab, create_reading, create_review, \
     create_review_for_specific_time, mock_user_info_response, \
     mock_invalid_api_user_info_response, \
-    setupTestFixture
+    setupTestFixture, run_jobs_inline, create_user, create_profile
 
 
 
@@ -168,6 +171,41 @@ class TestProfileApi(APITestCase):
         self.user.profile.refresh_from_db()
         assert(self.user.profile.follow_me is True)
 
+    @mock.patch("api.validators.get_client")
+    def test_only_the_profile_being_updated_can_skip_api_key_validation(self, get_client):
+        get_client.return_value.get_user_information.side_effect = exceptions.InvalidWaniKaniKey()
+        self.user.profile.api_key = "a_key_only_this_profile_has"
+        self.user.profile.api_valid = True
+        self.user.profile.save()
+        other_user = create_user("other")
+        create_profile(other_user, "some_other_key", 5)
+
+        unchanged = ProfileSerializer(self.user.profile, data={'api_key': "a_key_only_this_profile_has"}, partial=True)
+        someone_elses = ProfileSerializer(other_user.profile, data={'api_key': "a_key_only_this_profile_has"},
+                                          partial=True)
+
+        self.assertTrue(unchanged.is_valid())
+        self.assertFalse(someone_elses.is_valid())
+        get_client.return_value.get_user_information.assert_called_once()
+
+    @mock.patch("kw_webapp.tasks.follow_user_job.apply_async")
+    def test_enabling_follow_me_starts_a_trackable_job_once_the_profile_is_saved(self, apply_async):
+        self.client.force_login(self.user)
+        self.user.profile.follow_me = False
+        self.user.profile.save()
+
+        with mock.patch("kw_webapp.tasks.transaction.on_commit") as on_commit:
+            response = self.client.patch(reverse("api:profile-detail", args=(self.user.profile.id,)),
+                                         data={'follow_me': True}, format='json')
+            apply_async.assert_not_called()
+
+            on_commit.call_args[0][0]()
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['follow_me'], True)
+        self.assertEqual(apply_async.call_args[1]['task_id'], response.data['job_id'])
+        self.assertIn(response.data['job_id'], response.data['job_url'])
+
     def test_attempting_to_sync_with_invalid_api_key_sets_correct_profile_value(self):
         # Given
         self.client.force_login(self.user)
@@ -175,7 +213,8 @@ class TestProfileApi(APITestCase):
         self.user.profile.save()
 
         # When
-        self.client.post(reverse("api:user-sync"))
+        with run_jobs_inline():
+            self.client.post(reverse("api:user-sync"))
 
         # Then
         self.user.refresh_from_db()
@@ -239,6 +278,23 @@ class TestProfileApi(APITestCase):
         response = self.client.patch(reverse("api:profile-detail", args=(self.user.profile.id,)), data={"api_key": valid_key})
         self.assertTrue(response.data['api_valid'])
 
+    @responses.activate
+    def test_api_key_validation_is_cached_and_skipped_for_the_current_key(self):
+        self.client.force_login(self.user)
+        mock_user_info_response("a_cached_key")
+        mock_user_info_response("another_cached_key")
+        profile_url = reverse("api:profile-detail", args=(self.user.profile.id,))
+
+        self.client.patch(profile_url, data={"api_key": "a_cached_key"})
+        self.client.patch(profile_url, data={"api_key": "another_cached_key"})
+        response = self.client.patch(profile_url, data={"api_key": "a_cached_key"})
+        self.assertTrue(response.data['api_valid'])
+        self.assertEqual(len(responses.calls), 2)
+
+        response = self.client.patch(profile_url, data={"api_key": "a_cached_key", "kanji_svg_draw_speed": 4})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(responses.calls), 2)
+
     def test_searching_based_on_reading_returns_distinct_responses(self):
         reading_to_search = "eyylmao"
         v = create_vocab("vocabulary with 2 readings.")
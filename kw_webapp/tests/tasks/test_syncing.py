@@ -1,11 +1,20 @@
+import json
+import re
+from copy import deepcopy
+from unittest import mock
+
 import responses
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APITestCase
 
-from kw_webapp.tasks import sync_with_wk, sync_recent_unlocked_vocab_with_wk
+from kw_webapp.models import UserSpecific, Vocabulary
+from kw_webapp.tasks import sync_with_wk, sync_recent_unlocked_vocab_with_wk, process_vocabulary_response_for_user, \
+    sync_unlocked_vocab_with_wk, pull_all_user_synonyms
 from kw_webapp.tests import sample_api_responses
 from kw_webapp.tests.utils import mock_user_info_response, \
     mock_vocab_list_response_with_single_vocabulary_with_changed_meaning, \
-    mock_vocab_list_response_with_single_vocabulary_with_four_synonyms, setupTestFixture
+    mock_vocab_list_response_with_single_vocabulary_with_four_synonyms, setupTestFixture, create_vocab, create_reading
 
 
 class TestSyncing(APITestCase):
@@ -40,3 +49,152 @@ class TestSyncing(APITestCase):
 
         self.review.refresh_from_db()
         self.assertEqual(len(self.review.meaning_synonyms.all()), 4)
+
+    def test_synonyms_removed_on_wanikani_are_removed_locally(self):
+        self.review.meaning_synonyms.get_or_create(text="This will disappear")
+        page = deepcopy(sample_api_responses.single_vocab_response)
+        page["requested_information"][0]["user_specific"]["user_synonyms"] = None
+
+        new_review_count, new_synonym_count = process_vocabulary_response_for_user(self.user, page)
+
+        self.assertEqual(new_synonym_count, -1)
+        self.assertFalse(self.review.meaning_synonyms.exists())
+
+    @responses.activate
+    def test_pulling_user_synonyms_bulk_adds_missing_synonyms(self):
+        self.user.profile.unlocked_levels.get_or_create(level=5)
+        synonyms = sample_api_responses.single_vocab_response_with_4_meaning_synonyms[
+            "requested_information"][0]["user_specific"]["user_synonyms"]
+        self.review.meaning_synonyms.get_or_create(text=synonyms[0])
+        self.review.meaning_synonyms.get_or_create(text="Only on KaniWani")
+        mock_vocab_list_response_with_single_vocabulary_with_four_synonyms(self.user)
+
+        new_synonym_count = pull_all_user_synonyms(self.user)
+
+        self.assertEqual(new_synonym_count, 3)
+        self.assertEqual(set(self.review.synonyms_list()), set(synonyms) | {"Only on KaniWani"})
+
+    def test_pulling_all_user_synonyms_fans_out_a_task_per_user_with_a_valid_key(self):
+        self.user.profile.api_key = "a" * 32
+        self.user.profile.save()
+
+        with mock.patch("kw_webapp.tasks.pull_user_synonyms_for_user.apply_async") as apply_async:
+            pull_all_user_synonyms()
+
+        apply_async.assert_called_once_with((self.user.id,), queue="long_running_sync")
+
+    def test_following_sync_restores_archived_reviews_instead_of_duplicating_them(self):
+        self.user.profile.follow_me = True
+        self.user.profile.save()
+        UserSpecific.objects.filter(pk=self.review.pk).update(archived=True)
+
+        new_review_count, _ = process_vocabulary_response_for_user(self.user, sample_api_responses.single_vocab_response)
+
+        self.assertEqual(new_review_count, 1)
+        self.assertListEqual(list(UserSpecific.all_objects.filter(user=self.user).values_list('id', 'archived')),
+                             [(self.review.pk, False)])
+
+    def _build_vocabulary_page(self, item_count, prefix):
+        page = deepcopy(sample_api_responses.single_vocab_response)
+        template = page["requested_information"][0]
+        page["requested_information"] = []
+        for i in range(item_count):
+            item = deepcopy(template)
+            item["character"] = "{}漢字{}".format(prefix, i)
+            item["kana"] = "かんじ{}".format(i)
+            item["meaning"] = "meaning {}".format(i)
+            item["user_specific"]["user_synonyms"] = ["synonym {}".format(i)]
+            create_reading(create_vocab(item["meaning"]), item["kana"], item["character"], item["level"])
+            page["requested_information"].append(item)
+        return page
+
+    def test_processing_a_page_uses_constant_number_of_queries(self):
+        small_page = self._build_vocabulary_page(2, "小")
+        with CaptureQueriesContext(connection) as small_page_queries:
+            process_vocabulary_response_for_user(self.user, small_page)
+
+        large_page = self._build_vocabulary_page(10, "大")
+        with CaptureQueriesContext(connection) as large_page_queries:
+            new_review_count, new_synonym_count = process_vocabulary_response_for_user(self.user, large_page)
+
+        self.assertEqual(new_review_count, 10)
+        self.assertEqual(new_synonym_count, 10)
+        self.assertEqual(UserSpecific.objects.filter(user=self.user).count(), 13)
+        self.assertEqual(len(large_page_queries), len(small_page_queries))
+        self.assertLess(len(large_page_queries), 15)
+
+    def test_unchanged_catalog_items_are_not_rewritten(self):
+        page = self._build_vocabulary_page(5, "再")
+        process_vocabulary_response_for_user(self.user, page)
+
+        with CaptureQueriesContext(connection) as queries:
+            process_vocabulary_response_for_user(self.user, page)
+
+        catalog_writes = [query['sql'] for query in queries.captured_queries
+                          if not query['sql'].startswith("SELECT") and
+                          ("kw_webapp_vocabulary" in query['sql'] or "kw_webapp_reading" in query['sql'])]
+        self.assertEqual(catalog_writes, [])
+
+        page["requested_information"][0]["level"] = 7
+        process_vocabulary_response_for_user(self.user, page)
+
+        vocabulary = Vocabulary.objects.get(readings__character=page["requested_information"][0]["character"])
+        self.assertEqual(vocabulary.readings.get().level, 7)
+
+    @responses.activate
+    def test_full_sync_fetches_and_processes_every_page(self):
+        for level in range(1, 13):
+            self.user.profile.unlocked_levels.get_or_create(level=level)
+        pages = dict((str(level), self._build_vocabulary_page(1, "L{}".format(level))) for level in range(1, 13))
+
+        def vocabulary_for_requested_levels(request):
+            first_level = request.url.rsplit("/", 1)[1].split(",")[0]
+            return 200, {}, json.dumps(pages[first_level])
+
+        responses.add_callback(responses.GET, re.compile(r"https://www\.wanikani\.com/api/user/.*/vocabulary/.*"),
+                               callback=vocabulary_for_requested_levels,
+                               content_type="application/json")
+
+        new_review_count, _ = sync_unlocked_vocab_with_wk(self.user)
+
+        self.assertEqual(len(responses.calls), 3)
+        self.assertEqual(new_review_count, 3)
+
+    @responses.activate
+    def test_full_sync_skips_levels_unchanged_since_last_full_sync(self):
+        self.user.profile.unlocked_levels.get_or_create(level=16)
+        page = self._build_vocabulary_page(3, "指")
+        responses.add(responses.GET, re.compile(r"https://www\.wanikani\.com/api/user/.*/vocabulary/.*"),
+                      json=page, status=200, content_type="application/json")
+        sync_unlocked_vocab_with_wk(self.user)
+
+        with CaptureQueriesContext(connection) as queries:
+            new_review_count, new_synonym_count = sync_unlocked_vocab_with_wk(self.user)
+
+        self.assertEqual((new_review_count, new_synonym_count), (0, 0))
+        # Only the per-level review count, which makes sure no reviews have gone missing locally.
+        self.assertEqual(len([query for query in queries.captured_queries
+                              if "kw_webapp_userspecific" in query['sql']]), 1)
+        self.assertFalse([query for query in queries.captured_queries if "kw_webapp_meaningsynonym" in query['sql']])
+
+        page["requested_information"][0]["user_specific"]["user_synonyms"].append("a brand new synonym")
+        responses.reset()
+        responses.add(responses.GET, re.compile(r"https://www\.wanikani\.com/api/user/.*/vocabulary/.*"),
+                      json=page, status=200, content_type="application/json")
+
+        _, new_synonym_count = sync_unlocked_vocab_with_wk(self.user)
+
+        self.assertEqual(new_synonym_count, 1)
+
+    @responses.activate
+    def test_full_sync_recreates_missing_reviews_of_unchanged_levels(self):
+        self.user.profile.unlocked_levels.get_or_create(level=16)
+        page = self._build_vocabulary_page(3, "指")
+        responses.add(responses.GET, re.compile(r"https://www\.wanikani\.com/api/user/.*/vocabulary/.*"),
+                      json=page, status=200, content_type="application/json")
+        sync_unlocked_vocab_with_wk(self.user)
+        UserSpecific.objects.filter(user=self.user, vocabulary__readings__level=16).first().delete()
+
+        new_review_count, _ = sync_unlocked_vocab_with_wk(self.user)
+
+        self.assertEqual(new_review_count, 1)
@@ -0,0 +1,71 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from kw_webapp.backfills import Backfill, CorrectNextReviewDates, run_backfill
+from kw_webapp.models import UserSpecific, BackfillCheckpoint
+from kw_webapp.tests.utils import create_user, create_profile, create_vocab, create_review
+
+
+class ClearCritical(Backfill):
+    name = "clear_critical"
+    model = UserSpecific
+
+    def get_updates(self):
+        return {"critical": False}
+
+
+@mock.patch("kw_webapp.backfills.time.sleep")
+class TestBackfills(TestCase):
+
+    def setUp(self):
+        self.user = create_user("Tadgh")
+        create_profile(self.user, "any_key", 5)
+        self.reviews = []
+        for i in range(5):
+            review = create_review(create_vocab("vocab {}".format(i)), self.user)
+            review.streak = i
+            review.last_studied = timezone.now() - timedelta(days=i, minutes=7)
+            review.next_review_date = None
+            review.critical = True
+            review.save()
+            self.reviews.append(review)
+
+    def test_backfill_resumes_from_its_checkpoint(self, sleep):
+        checkpoint = run_backfill(ClearCritical(), batch_size=2, max_batches=1)
+
+        self.assertEqual((checkpoint.last_pk, checkpoint.rows_updated), (self.reviews[1].id, 2))
+        self.assertIsNone(checkpoint.completed_at)
+        self.assertEqual(UserSpecific.objects.filter(critical=True).count(), 3)
+
+        checkpoint = run_backfill(ClearCritical(), batch_size=2)
+
+        self.assertEqual(checkpoint.rows_updated, 5)
+        self.assertIsNotNone(checkpoint.completed_at)
+        self.assertFalse(UserSpecific.objects.filter(critical=True).exists())
+        # Only between batches, never after the last one of a run.
+        self.assertEqual(sleep.call_count, 1)
+        self.assertEqual(BackfillCheckpoint.objects.count(), 1)
+
+    def test_correcting_next_review_dates_matches_per_review_calculation(self, sleep):
+        run_backfill(CorrectNextReviewDates(), batch_size=2)
+        corrected = dict((pk, (next_review_date, last_studied)) for pk, next_review_date, last_studied in
+                         UserSpecific.objects.values_list('pk', 'next_review_date', 'last_studied'))
+
+        for review in self.reviews:
+            # The reviews still hold their original dates, work out what they should be without saving over the rows.
+            with mock.patch.object(UserSpecific, "save"):
+                review.set_next_review_time_based_on_last_studied()
+            self.assertIsNotNone(review.next_review_date)
+            self.assertEqual(corrected[review.pk], (review.next_review_date, review.last_studied))
+
+    def test_correcting_next_review_dates_twice_changes_nothing(self, sleep):
+        run_backfill(CorrectNextReviewDates(), batch_size=2)
+        corrected = list(UserSpecific.objects.order_by('pk').values_list('next_review_date', 'last_studied'))
+
+        run_backfill(CorrectNextReviewDates(), batch_size=2, restart=True)
+
+        self.assertEqual(list(UserSpecific.objects.order_by('pk').values_list('next_review_date', 'last_studied')),
+                         corrected)
@@ -0,0 +1,40 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from kw_webapp import cache_ops
+
+
+class TestCacheOps(TestCase):
+
+    def setUp(self):
+        cache.delete("some_key")
+
+    def test_delete_if_equal_leaves_other_values_alone(self):
+        cache.set("some_key", 2)
+
+        self.assertFalse(cache_ops.delete_if_equal("some_key", 1))
+        self.assertEqual(cache.get("some_key"), 2)
+        self.assertTrue(cache_ops.delete_if_equal("some_key", 2))
+        self.assertIsNone(cache.get("some_key"))
+
+    def test_take_reads_and_clears_the_key(self):
+        cache.set("some_key", 1)
+
+        self.assertEqual(cache_ops.take("some_key"), 1)
+        self.assertIsNone(cache_ops.take("some_key"))
+
+    def test_redis_cache_runs_the_operations_as_scripts(self):
+        client = mock.MagicMock()
+        client.eval.side_effect = [1, b"0", None]
+
+        with mock.patch.object(cache, "get_client", create=True, return_value=client):
+            self.assertTrue(cache_ops.delete_if_equal("some_key", 5))
+            self.assertEqual(cache_ops.take("some_key"), 0)
+            self.assertIsNone(cache_ops.take("some_key"))
+
+        self.assertEqual(client.eval.call_args_list,
+                         [mock.call(cache_ops.COMPARE_AND_DELETE_SCRIPT, 1, cache.make_key("some_key"), 5),
+                          mock.call(cache_ops.TAKE_SCRIPT, 1, cache.make_key("some_key")),
+                          mock.call(cache_ops.TAKE_SCRIPT, 1, cache.make_key("some_key"))])
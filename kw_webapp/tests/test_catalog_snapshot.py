@@ -0,0 +1,114 @@
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from rest_framework.reverse import reverse
+
+from kw_webapp.catalog_snapshot import CatalogSnapshot, build_catalog_records, write_catalog_snapshot, \
+    get_catalog_snapshot, rebuild_catalog_snapshot, CATALOG_SNAPSHOT_VERSION_KEY
+from kw_webapp.models import PartOfSpeech, Vocabulary
+from kw_webapp.tests.utils import create_vocab, create_reading, create_user, create_profile, create_review
+
+
+@override_settings(CATALOG_SNAPSHOT_CHECK_INTERVAL_SECONDS=0)
+class TestCatalogSnapshot(TestCase):
+
+    def setUp(self):
+        cache.delete(CATALOG_SNAPSHOT_VERSION_KEY)
+        self.vocabulary = create_vocab("radioactive bat")
+        self.reading = create_reading(self.vocabulary, "ねこ", "猫", 5)
+        self.reading.parts_of_speech.add(PartOfSpeech.objects.create(part="Noun"))
+        self.other_vocabulary = create_vocab("dog")
+        create_reading(self.other_vocabulary, "いぬ", "犬", 2)
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "catalog.snapshot")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_snapshot_round_trips_catalog(self):
+        write_catalog_snapshot(self.path, build_catalog_records(), version=42)
+
+        snapshot = CatalogSnapshot(self.path)
+        record = snapshot.get(self.vocabulary.id)
+        snapshot.close()
+
+        self.assertEqual(snapshot.version, 42)
+        self.assertEqual(len(snapshot), 2)
+        self.assertEqual(record['meaning'], "radioactive bat")
+        self.assertEqual(record['readings'][0]['character'], "猫")
+        self.assertEqual(record['readings'][0]['kana'], "ねこ")
+        self.assertListEqual(record['readings'][0]['parts_of_speech'], ["Noun"])
+
+    def test_missing_vocabulary_returns_none(self):
+        write_catalog_snapshot(self.path, build_catalog_records())
+
+        snapshot = CatalogSnapshot(self.path)
+
+        self.assertIsNone(snapshot.get(self.other_vocabulary.id + 100))
+        self.assertTrue(self.other_vocabulary.id in snapshot)
+        snapshot.close()
+
+    def test_management_command_writes_snapshot_picked_up_by_workers(self):
+        with override_settings(CATALOG_SNAPSHOT_PATH=self.path):
+            self.assertIsNone(get_catalog_snapshot())
+
+            call_command("build_catalog_snapshot", stdout=StringIO())
+
+            snapshot = get_catalog_snapshot()
+            self.assertEqual(snapshot.get(self.other_vocabulary.id)['meaning'], "dog")
+
+    def test_reviews_serve_their_vocabulary_from_the_snapshot(self):
+        user = create_user("Tadgh")
+        create_profile(user, "any_key", 5)
+        create_review(self.vocabulary, user)
+        self.client.force_login(user)
+        write_catalog_snapshot(self.path, build_catalog_records())
+        Vocabulary.objects.filter(pk=self.vocabulary.pk).update(meaning="only in the database")
+
+        with override_settings(CATALOG_SNAPSHOT_PATH=self.path):
+            vocabulary = self.client.get(reverse("api:review-list")).data['results'][0]['vocabulary']
+        self.assertEqual(vocabulary['meaning'], "radioactive bat")
+        self.assertListEqual(vocabulary['readings'][0]['parts_of_speech'], ["Noun"])
+
+        vocabulary = self.client.get(reverse("api:review-list")).data['results'][0]['vocabulary']
+        self.assertEqual(vocabulary['meaning'], "only in the database")
+
+    def test_rebuild_only_rewrites_a_deployed_snapshot(self):
+        with override_settings(CATALOG_SNAPSHOT_PATH=self.path):
+            self.assertIsNone(rebuild_catalog_snapshot())
+            self.assertFalse(os.path.exists(self.path))
+
+            write_catalog_snapshot(self.path, build_catalog_records())
+            Vocabulary.objects.filter(pk=self.vocabulary.pk).update(meaning="renamed")
+            rebuild_catalog_snapshot()
+
+            self.assertEqual(get_catalog_snapshot().get(self.vocabulary.id)['meaning'], "renamed")
+
+    def test_snapshot_older_than_the_last_rebuild_is_not_served(self):
+        write_catalog_snapshot(self.path, build_catalog_records(), version=42)
+
+        with override_settings(CATALOG_SNAPSHOT_PATH=self.path):
+            self.assertEqual(get_catalog_snapshot().version, 42)
+
+            # Rebuilt by a worker which writes somewhere this node can't see.
+            cache.set(CATALOG_SNAPSHOT_VERSION_KEY, 43, None)
+            self.assertIsNone(get_catalog_snapshot())
+
+            write_catalog_snapshot(self.path, build_catalog_records(), version=43)
+            self.assertEqual(get_catalog_snapshot().version, 43)
+
+    def test_snapshot_file_is_checked_at_most_once_per_interval(self):
+        write_catalog_snapshot(self.path, build_catalog_records())
+
+        with override_settings(CATALOG_SNAPSHOT_PATH=self.path, CATALOG_SNAPSHOT_CHECK_INTERVAL_SECONDS=60), \
+                mock.patch("kw_webapp.catalog_snapshot.os.stat", wraps=os.stat) as stat:
+            for _ in range(3):
+                self.assertIsNotNone(get_catalog_snapshot())
+
+        self.assertEqual(stat.call_count, 1)
@@ -0,0 +1,36 @@
+from django.test import TestCase
+
+from kw_webapp.models import UserSpecific
+from kw_webapp.tasks import process_vocabulary_response_for_user
+from kw_webapp.tests.utils import create_user, create_profile
+from kw_webapp.wanikani import constants
+from kw_webapp.wanikani.fake_api import FakeWanikani, fake_api_key, fake_user_level
+
+
+class TestFakeWanikani(TestCase):
+
+    def setUp(self):
+        self.fake_wanikani = FakeWanikani(items_per_level=3, max_level=10)
+
+    def test_fake_vocabulary_syncs_like_the_real_thing(self):
+        user = create_user("loadtest-1")
+        create_profile(user, fake_api_key(1), fake_user_level(1, 10))
+        level = user.profile.level
+
+        status, body = self.fake_wanikani.respond("/api/user/{}/vocabulary/{},{},".format(fake_api_key(1), level,
+                                                                                         level + 1))
+        new_review_count, _ = process_vocabulary_response_for_user(user, body)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(len(body["requested_information"]), 6 if level < 10 else 3)
+        self.assertEqual(new_review_count, 3)
+        self.assertEqual(UserSpecific.objects.filter(user=user).count(), 3)
+
+    def test_unknown_keys_are_rejected_and_errors_can_be_injected(self):
+        status, body = self.fake_wanikani.respond("/api/user/not-a-fake-key/user-information")
+        self.assertEqual(status, 401)
+        self.assertEqual(body["error"]["code"], constants.INVALID_WK_API_ERROR)
+
+        failing_wanikani = FakeWanikani(error_rate=1.0, error_status=502)
+        status, _ = failing_wanikani.respond("/api/user/{}/user-information".format(fake_api_key(1)))
+        self.assertEqual(status, 502)
@@ -0,0 +1,69 @@
+from datetime import timedelta
+from unittest import mock
+
+import redis
+from django.test import TestCase, RequestFactory
+from django.http import HttpResponse
+from django.utils import timezone
+
+from kw_webapp.last_visit import LastVisitTracker, LAST_VISITS_KEY
+from kw_webapp.middleware import SetLastVisitMiddleware
+from kw_webapp.models import Profile
+from kw_webapp.tasks import flush_last_visits
+from kw_webapp.tests.utils import create_user, create_profile
+
+
+class TestLastVisitTracker(TestCase):
+
+    def setUp(self):
+        self.connection = mock.MagicMock()
+        self.tracker = LastVisitTracker(connection=self.connection, write_interval=60)
+        self.user = create_user("Tadgh")
+        create_profile(self.user, "any_key", 5)
+        self.other_user = create_user("Duncan")
+        create_profile(self.other_user, "other_key", 5)
+
+    def test_each_user_is_due_once_per_interval(self):
+        with mock.patch("kw_webapp.last_visit.time.monotonic", return_value=1000):
+            self.assertTrue(self.tracker.is_due(self.user.pk))
+            self.assertFalse(self.tracker.is_due(self.user.pk))
+            self.assertTrue(self.tracker.is_due(self.other_user.pk))
+
+        with mock.patch("kw_webapp.last_visit.time.monotonic", return_value=1060):
+            self.assertTrue(self.tracker.is_due(self.user.pk))
+
+    def test_redis_outage_is_reported_and_backs_off_from_redis(self):
+        self.connection.hset.side_effect = redis.ConnectionError("Nobody home")
+
+        self.assertFalse(self.tracker.record(self.user.pk, timezone.now()))
+        self.assertFalse(self.tracker.record(self.other_user.pk, timezone.now()))
+
+        self.assertEqual(self.connection.hset.call_count, 1)
+
+    def test_middleware_saves_the_visit_itself_when_redis_is_unavailable(self):
+        self.connection.hset.side_effect = redis.ConnectionError("Nobody home")
+        Profile.objects.filter(user=self.user).update(last_visit=None)
+        request = RequestFactory().get("/")
+        request.user = self.user
+
+        with mock.patch("kw_webapp.middleware.get_last_visit_tracker", return_value=self.tracker):
+            SetLastVisitMiddleware().process_response(request, HttpResponse())
+
+        self.assertIsNotNone(Profile.objects.get(user=self.user).last_visit)
+
+    def test_flush_saves_every_buffered_visit_in_one_query(self):
+        visited_at = timezone.now().replace(microsecond=0)
+        pipeline = self.connection.pipeline.return_value
+        pipeline.execute.return_value = [{str(self.user.pk).encode(): str(visited_at.timestamp()).encode(),
+                                          str(self.other_user.pk).encode(): str((visited_at - timedelta(hours=2))
+                                                                                .timestamp()).encode()},
+                                         1]
+
+        with mock.patch("kw_webapp.tasks.get_last_visit_tracker", return_value=self.tracker):
+            with self.assertNumQueries(1):
+                self.assertEqual(flush_last_visits(), 2)
+
+        pipeline.hgetall.assert_called_once_with(LAST_VISITS_KEY)
+        pipeline.delete.assert_called_once_with(LAST_VISITS_KEY)
+        self.assertEqual(Profile.objects.get(user=self.user).last_visit, visited_at)
+        self.assertEqual(Profile.objects.get(user=self.other_user).last_visit, visited_at - timedelta(hours=2))
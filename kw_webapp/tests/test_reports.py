@@ -0,0 +1,52 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from kw_webapp.reports import duplicate_kanji_report, duplicate_review_report, conglomerated_vocabulary_report
+from kw_webapp.tests.utils import create_user, create_profile, create_vocab, create_reading, create_review
+
+
+class TestReports(TestCase):
+
+    def setUp(self):
+        self.user = create_user("Tadgh")
+        create_profile(self.user, "any_key", 5)
+        self.cat = create_vocab("cat")
+        create_reading(self.cat, "ねこ", "猫", 5)
+        self.other_cat = create_vocab("kitty")
+        create_reading(self.other_cat, "びょう", "猫", 5)
+        self.dog = create_vocab("dog")
+        create_reading(self.dog, "いぬ", "犬", 2)
+        create_reading(self.dog, "けん", "狗", 2)
+        self.cat_review = create_review(self.cat, self.user)
+        self.other_cat_review = create_review(self.other_cat, self.user)
+        create_review(self.dog, self.user)
+
+    def test_duplicate_kanji_are_reported_once_per_vocabulary(self):
+        header, rows = duplicate_kanji_report()
+
+        self.assertEqual(header, ("character", "vocabulary_id", "meaning"))
+        self.assertListEqual(list(rows), [("猫", self.cat.id, "cat"), ("猫", self.other_cat.id, "kitty")])
+
+    def test_duplicate_reviews_are_reported_per_user_and_in_detail(self):
+        _, summary_rows = duplicate_review_report()
+        _, detail_rows = duplicate_review_report(self.user)
+
+        self.assertListEqual(list(summary_rows), [("Tadgh", "猫", 2)])
+        self.assertListEqual([row[:2] for row in detail_rows], [("猫", self.cat_review.id),
+                                                                ("猫", self.other_cat_review.id)])
+
+    def test_conglomerated_vocabulary_lists_each_reading(self):
+        _, rows = conglomerated_vocabulary_report()
+
+        self.assertListEqual(list(rows), [(self.dog.id, "dog", "犬", "いぬ"), (self.dog.id, "dog", "狗", "けん")])
+
+    def test_command_streams_csv(self):
+        output = StringIO()
+
+        call_command("consistency_report", "duplicate-reviews", user="Tadgh", stdout=output)
+
+        lines = output.getvalue().splitlines()
+        self.assertEqual(lines[0], "character,review_id,vocabulary_id,meaning,streak")
+        self.assertEqual(len(lines), 3)
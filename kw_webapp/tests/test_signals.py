@@ -0,0 +1,37 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+
+from kw_webapp.signals import LOGIN_SYNC_DEBOUNCE_KEY
+from kw_webapp.tests.utils import create_user, create_profile
+
+
+@mock.patch("kw_webapp.signals.sync_with_wk.delay")
+class TestLoginSync(TestCase):
+
+    def setUp(self):
+        self.user = create_user("Tadgh")
+        create_profile(self.user, "any_key", 5)
+        cache.delete(LOGIN_SYNC_DEBOUNCE_KEY.format(self.user.id))
+
+    def _set_last_sync(self, minutes_ago):
+        self.user.profile.last_wanikani_sync_date = timezone.now() - timedelta(minutes=minutes_ago)
+        self.user.profile.save()
+
+    def test_login_shortly_after_a_sync_does_not_sync(self, delay):
+        self._set_last_sync(1)
+
+        self.client.force_login(self.user)
+
+        delay.assert_not_called()
+
+    def test_repeated_logins_queue_a_single_recent_level_sync(self, delay):
+        self._set_last_sync(60)
+
+        self.client.force_login(self.user)
+        self.client.force_login(self.user)
+
+        delay.assert_called_once_with(self.user.id, full_sync=False)
@@ -1,23 +1,36 @@
+import json
+import os
 import re
+import tempfile
 from copy import deepcopy
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
 import responses
 import time
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from kw_webapp import constants
-from kw_webapp.models import Vocabulary, UserSpecific, MeaningSynonym, AnswerSynonym
+from kw_webapp.wanikani import exceptions
+from kw_webapp.models import Vocabulary, UserSpecific, MeaningSynonym, AnswerSynonym, Reading, PartOfSpeech
 from kw_webapp.tasks import create_new_vocabulary, past_time, all_srs, associate_vocab_to_user, \
     build_API_sync_string_for_user, sync_unlocked_vocab_with_wk, \
     lock_level_for_user, unlock_all_possible_levels_for_user, build_API_sync_string_for_user_for_levels, \
     user_returns_from_vacation, get_users_future_reviews, sync_all_users_to_wk, \
     reset_user, get_users_current_reviews, reset_levels, get_users_lessons, get_vocab_by_kanji, \
-    build_user_information_api_string, get_level_pages, sync_with_wk
+    build_user_information_api_string, get_level_pages, sync_with_wk, get_sync_batch_progress, cancel_sync_batch, \
+    resume_sync_batch, user_sync_lease, release_sync_batch, SYNC_LEASE_KEY
 from kw_webapp.tests import sample_api_responses
 from kw_webapp.tests.sample_api_responses import single_vocab_requested_information
 from kw_webapp.tests.utils import create_review, create_vocab, create_user, create_profile, create_reading, \
     create_review_for_specific_time, mock_vocab_list_response_with_single_vocabulary, mock_user_info_response
-from kw_webapp.utils import generate_user_stats, one_time_merge_level
+from kw_webapp.utils import generate_user_stats, one_time_merge_level, repopulate_catalog, \
+    import_jisho_data, delete_duplicate_rows, merge_vocabulary_reviews
 
 
 class TestTasks(TestCase):
@@ -53,6 +66,15 @@ class TestTasks(TestCase):
         self.assertTrue(review.needs_review is True)
         self.assertTrue(created)
 
+    def test_associate_vocab_to_user_restores_an_archived_review(self):
+        UserSpecific.objects.filter(pk=self.review.pk).update(archived=True)
+
+        review, created = associate_vocab_to_user(self.vocabulary, self.user)
+
+        self.assertFalse(created)
+        self.assertEqual(review.pk, self.review.pk)
+        self.assertFalse(UserSpecific.all_objects.get(pk=self.review.pk).archived)
+
     def test_building_api_string_adds_correct_levels(self):
         self.user.profile.unlocked_levels.get_or_create(level=5)
         self.user.profile.unlocked_levels.get_or_create(level=3)
@@ -234,6 +256,126 @@ class TestTasks(TestCase):
         affected_count = sync_all_users_to_wk()
         self.assertEqual(affected_count, 1)
 
+    @mock.patch("kw_webapp.tasks.sync_with_wk.apply_async")
+    def test_sync_all_users_releases_most_recently_active_users_first_as_their_slots_come_up(self, apply_async):
+        user2 = create_user("sup")
+        create_profile(user2, "any_key", 5)
+        user2.profile.last_visit = past_time(1)
+        self.user.profile.last_visit = past_time(24)
+        user2.profile.save()
+        self.user.profile.save()
+
+        with self.settings(SYNC_ALL_USERS_SPREAD_SECONDS=600, SYNC_BATCH_RELEASE_INTERVAL_SECONDS=60):
+            sync_all_users_to_wk()
+            self.assertEqual(release_sync_batch(), 0)
+            with mock.patch("kw_webapp.tasks.timezone.now", return_value=timezone.now() + timedelta(seconds=250)):
+                self.assertEqual(release_sync_batch(), 1)
+
+        scheduled = [(call[1]["args"][0], call[1]["countdown"]) for call in apply_async.call_args_list]
+        self.assertEqual([user_id for user_id, _ in scheduled], [user2.id, self.user.id])
+        self.assertEqual(scheduled[0][1], 0)
+        self.assertTrue(0 < scheduled[1][1] <= 60)
+
+    @mock.patch("kw_webapp.tasks.sync_with_wk.apply_async")
+    def test_overlapping_releases_of_a_batch_do_not_enqueue_users_twice(self, apply_async):
+        self.user.profile.last_visit = timezone.now()
+        self.user.profile.save()
+
+        with mock.patch("kw_webapp.tasks.release_sync_batch"):
+            sync_all_users_to_wk()
+        with mock.patch("kw_webapp.tasks.cache_ops.delete_if_equal"):
+            # The lease of the first release is still held when the second one starts.
+            self.assertEqual(release_sync_batch(), 1)
+            self.assertEqual(release_sync_batch(), 0)
+
+        self.assertEqual(apply_async.call_count, 1)
+
+    @mock.patch("kw_webapp.tasks.sync_with_wk.apply_async")
+    def test_syncs_check_for_cancellation_without_loading_the_batch(self, apply_async):
+        self.user.profile.last_visit = timezone.now()
+        self.user.profile.save()
+        sync_all_users_to_wk()
+        batch_id = apply_async.call_args[1]["kwargs"]["batch_id"]
+        cancel_sync_batch(batch_id)
+
+        with mock.patch("kw_webapp.tasks._get_sync_batch") as get_sync_batch:
+            self.assertEqual(sync_with_wk(self.user.id, True, batch_id=batch_id), (False, 0, 0))
+        get_sync_batch.assert_not_called()
+
+    @mock.patch("kw_webapp.tasks.sync_with_wk.apply_async")
+    def test_sync_batches_can_be_cancelled_and_resumed(self, apply_async):
+        user2 = create_user("sup")
+        create_profile(user2, "any_key", 5)
+        self.user.profile.last_visit = user2.profile.last_visit = timezone.now()
+        self.user.profile.save()
+        user2.profile.save()
+        sync_all_users_to_wk()
+        batch_id = apply_async.call_args[1]["kwargs"]["batch_id"]
+
+        cancel_sync_batch(batch_id)
+        with mock.patch("kw_webapp.tasks._sync_with_wk") as actual_sync:
+            sync_with_wk(self.user.id, True, batch_id=batch_id)
+            actual_sync.assert_not_called()
+
+        resume_sync_batch(batch_id)
+        with mock.patch("kw_webapp.tasks._sync_with_wk") as actual_sync:
+            actual_sync.return_value = True, 0, 0
+            sync_with_wk(self.user.id, True, batch_id=batch_id)
+
+        progress = get_sync_batch_progress(batch_id)
+        self.assertEqual((progress["completed"], progress["total"], progress["cancelled"]), (1, 2, False))
+
+        apply_async.reset_mock()
+        self.assertEqual(resume_sync_batch(batch_id), 1)
+        self.assertEqual(apply_async.call_args[1]["args"][0], user2.id)
+
+        with mock.patch("kw_webapp.tasks._sync_with_wk", side_effect=exceptions.WanikaniConnectionError("Down")):
+            self.assertRaises(exceptions.WanikaniConnectionError, sync_with_wk, user2.id, True, batch_id=batch_id)
+
+        progress = get_sync_batch_progress(batch_id)
+        self.assertEqual((progress["completed"], progress["failed"]), (1, 1))
+        self.assertEqual(resume_sync_batch(batch_id), 1)
+
+    @mock.patch("kw_webapp.tasks.sync_with_wk.delay")
+    def test_overlapping_syncs_for_a_user_collapse_into_one_follow_up(self, delay):
+        with mock.patch("kw_webapp.tasks._sync_with_wk") as actual_sync:
+            with user_sync_lease(self.user.id) as acquired:
+                self.assertTrue(acquired)
+                self.assertEqual(sync_with_wk(self.user.id, False), (False, 0, 0))
+                self.assertEqual(sync_with_wk(self.user.id, True), (False, 0, 0))
+                self.assertEqual(sync_with_wk(self.user.id, False), (False, 0, 0))
+                delay.assert_not_called()
+
+            actual_sync.assert_not_called()
+        delay.assert_called_once_with(self.user.id, full_sync=True)
+
+        with mock.patch("kw_webapp.tasks._sync_with_wk") as actual_sync:
+            actual_sync.return_value = True, 0, 0
+            self.assertEqual(sync_with_wk(self.user.id, False), (True, 0, 0))
+        delay.assert_called_once_with(self.user.id, full_sync=True)
+
+    @mock.patch("kw_webapp.tasks.sync_with_wk.delay")
+    def test_a_recent_sync_request_does_not_downgrade_a_pending_full_sync(self, delay):
+        with user_sync_lease(self.user.id) as acquired:
+            self.assertTrue(acquired)
+            with user_sync_lease(self.user.id, full_sync=True) as other_acquired:
+                self.assertFalse(other_acquired)
+            with user_sync_lease(self.user.id, full_sync=False) as other_acquired:
+                self.assertFalse(other_acquired)
+
+        delay.assert_called_once_with(self.user.id, full_sync=True)
+
+    @mock.patch("kw_webapp.tasks.sync_with_wk.delay")
+    def test_an_expired_lease_does_not_release_its_successor(self, delay):
+        lease_key = SYNC_LEASE_KEY.format(self.user.id)
+        with user_sync_lease(self.user.id) as acquired:
+            self.assertTrue(acquired)
+            # Our lease ran out mid-sync and another worker took over.
+            cache.set(lease_key, 1234)
+
+        self.assertEqual(cache.get(lease_key), 1234)
+        cache.delete(lease_key)
+
     @responses.activate
     def test_when_reading_level_changes_on_wanikani_we_catch_that_change_and_comply(self):
         resp_body = sample_api_responses.single_vocab_response
@@ -410,4 +552,105 @@ class TestTasks(TestCase):
 
         sync_with_wk(self.user.id)
 
-        self.assertListEqual(self.review.synonyms_list(), ["kitten", "large rat"])
\ No newline at end of file
+        self.assertListEqual(self.review.synonyms_list(), ["kitten", "large rat"])
+    @responses.activate
+    def test_repopulating_catalog_only_writes_differences_and_dry_run_writes_nothing(self):
+        resp_body = deepcopy(sample_api_responses.single_vocab_response)
+        new_vocabulary = deepcopy(resp_body["requested_information"][0])
+        new_vocabulary.update(character="犬", kana="いぬ", meaning="dog")
+        resp_body["requested_information"].append(new_vocabulary)
+        responses.add(responses.GET, self._vocab_api_regex, json=resp_body, status=200,
+                      content_type='application/json')
+
+        summaries, failures = repopulate_catalog(levels=[16], dry_run=True)
+
+        self.assertEqual(failures, {})
+        self.assertEqual(summaries[16]["new_vocabulary"], 1)
+        self.assertEqual(summaries[16]["new_readings"], 1)
+        self.assertEqual(summaries[16]["changed_levels"], 1)
+        self.assertFalse(Vocabulary.objects.filter(meaning="dog").exists())
+        self.reading.refresh_from_db()
+        self.assertEqual(self.reading.level, 2)
+
+        output = StringIO()
+        call_command("repopulate_catalog", levels=[16], stdout=output)
+
+        self.assertIn("Level 16: 1 new vocabulary, 0 changed meanings, 1 new readings, 1 changed levels", output.getvalue())
+        self.assertTrue(Vocabulary.objects.filter(meaning="dog", readings__kana="いぬ").exists())
+        self.reading.refresh_from_db()
+        self.assertEqual(self.reading.level, 16)
+
+        summaries, _ = repopulate_catalog(levels=[16])
+        self.assertEqual(summaries[16]["unchanged"], 2)
+
+    def test_importing_jisho_data_updates_readings_and_parts_of_speech_in_bulk(self):
+        dog = create_vocab("dog")
+        create_reading(dog, "いぬ", "犬", 3)
+        self.reading.parts_of_speech.add(PartOfSpeech.objects.create(part="stale"))
+        entries = [{"character": "猫", "reading": "ねこ", "sentenceEn": "A cat.", "sentenceJa": "猫です", "common": True,
+                    "furi": "0:ねこ", "pitch": [1], "partOfSpeech": ["n", "adj"]},
+                   {"character": "犬", "reading": "いぬ", "sentenceEn": "A dog.", "sentenceJa": "犬です", "common": False,
+                    "furi": "0:いぬ", "pitch": [], "partOfSpeech": ["n"]},
+                   {"character": "鳥", "reading": "とり", "sentenceEn": "A bird.", "partOfSpeech": ["n"]}]
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", suffix=".json", delete=False) as json_file:
+            json.dump(entries, json_file, ensure_ascii=False)
+        self.addCleanup(os.unlink, json_file.name)
+
+        summary, missing_characters = import_jisho_data(json_file.name, batch_size=2)
+
+        self.assertEqual(summary["updated"], 2)
+        self.assertEqual(missing_characters, ["鳥"])
+        cat = Reading.objects.get(character="猫")
+        self.assertEqual((cat.sentence_en, cat.sentence_ja, cat.common, cat.furigana, cat.pitch),
+                         ("A cat.", "猫です", True, "0:ねこ", "1"))
+        self.assertEqual(sorted(cat.parts_of_speech.values_list("part", flat=True)), ["adj", "n"])
+        dog_reading = Reading.objects.get(character="犬")
+        self.assertEqual((dog_reading.sentence_en, dog_reading.common, dog_reading.pitch), ("A dog.", False, None))
+        self.assertListEqual(list(dog_reading.parts_of_speech.values_list("part", flat=True)), ["n"])
+        self.assertEqual(PartOfSpeech.objects.filter(part="n").count(), 1)
+
+    def test_deleting_duplicates_keeps_the_oldest_row_and_dry_run_only_counts(self):
+        kept = AnswerSynonym.objects.create(review=self.review, kana="ねこ", character=None)
+        for _ in range(3):
+            AnswerSynonym.objects.create(review=self.review, kana="ねこ", character=None)
+        AnswerSynonym.objects.create(review=self.review, kana="いぬ", character=None)
+
+        self.assertEqual(delete_duplicate_rows(AnswerSynonym, dry_run=True), 3)
+        self.assertEqual(AnswerSynonym.objects.count(), 5)
+
+        self.assertEqual(delete_duplicate_rows(AnswerSynonym, batch_size=2), 3)
+        self.assertListEqual(list(self.review.reading_synonyms.filter(kana="ねこ").values_list("id", flat=True)),
+                             [kept.id])
+        self.assertEqual(AnswerSynonym.objects.count(), 2)
+
+        output = StringIO()
+        call_command("delete_duplicates", dry_run=True, stdout=output)
+        self.assertIn("0 duplicate answer synonyms found", output.getvalue())
+
+    def _merge_duplicate_vocabulary_for_users(self, user_count, prefix):
+        old_vocabulary = [create_vocab("old dog"), create_vocab("older dog")]
+        vocabulary = create_vocab("dog")
+        for i in range(user_count):
+            user = create_user("{}{}".format(prefix, i))
+            for streak, old_vocab in enumerate(old_vocabulary):
+                review = create_review(old_vocab, user)
+                review.streak = streak
+                review.notes = "note {}".format(streak)
+                review.save()
+                MeaningSynonym.objects.create(review=review, text="woofer")
+                MeaningSynonym.objects.create(review=review, text="pupper {}".format(streak))
+
+        with CaptureQueriesContext(connection) as queries:
+            merged_count = merge_vocabulary_reviews(vocabulary, [vocab.id for vocab in old_vocabulary])
+        self.assertEqual(merged_count, user_count)
+        return vocabulary, len(queries)
+
+    def test_merging_vocabulary_reviews_takes_constant_queries_and_keeps_best_review(self):
+        _, few_users_query_count = self._merge_duplicate_vocabulary_for_users(1, "few")
+        vocabulary, many_users_query_count = self._merge_duplicate_vocabulary_for_users(4, "many")
+
+        self.assertEqual(few_users_query_count, many_users_query_count)
+        merged_review = UserSpecific.objects.get(vocabulary=vocabulary, user__username="many3")
+        self.assertEqual(merged_review.streak, 1)
+        self.assertEqual(merged_review.notes, "note 0, note 1")
+        self.assertEqual(sorted(merged_review.synonyms_list()), ["pupper 0", "pupper 1", "woofer"])
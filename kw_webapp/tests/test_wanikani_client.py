@@ -0,0 +1,141 @@
+import json
+from unittest import mock
+
+import requests
+import responses
+from django.test import TestCase
+
+from kw_webapp.tests import sample_api_responses
+from kw_webapp.wanikani import WanikaniClient, exceptions
+from kw_webapp.wanikani.constants import USER_INFO_URL, VOCABULARY_URL
+from kw_webapp.wanikani.streaming import iter_object_items, iter_array_items
+
+
+@mock.patch("kw_webapp.wanikani.client.time.sleep")
+class TestWanikaniClient(TestCase):
+
+    def setUp(self):
+        self.rate_limiter = mock.MagicMock()
+        self.client = WanikaniClient(max_retries=2, retry_backoff=0.1, rate_limiter=self.rate_limiter)
+        self.url = USER_INFO_URL.format("any_key")
+
+    def _respond_in_sequence(self, *statuses):
+        remaining = list(statuses)
+
+        def callback(request):
+            status = remaining.pop(0) if len(remaining) > 1 else remaining[0]
+            return status, {}, json.dumps(sample_api_responses.user_information_response)
+
+        responses.add_callback(responses.GET, self.url, callback=callback, content_type="application/json")
+
+    @responses.activate
+    def test_transient_failures_are_retried(self, sleep):
+        self._respond_in_sequence(503, 502, 200)
+
+        json_data = self.client.get(self.url)
+
+        self.assertEqual(json_data["user_information"]["level"], 5)
+        self.assertEqual(len(responses.calls), 3)
+        self.assertEqual(sleep.call_count, 2)
+
+    @responses.activate
+    def test_retries_are_bounded(self, sleep):
+        self._respond_in_sequence(503)
+
+        self.assertRaises(exceptions.WanikaniConnectionError, self.client.get, self.url)
+        self.assertEqual(len(responses.calls), 3)
+
+    @responses.activate
+    def test_connection_errors_are_retried_then_raised_as_api_exceptions(self, sleep):
+        responses.add(responses.GET, self.url, body=requests.ConnectionError("Nobody home"))
+
+        self.assertRaises(exceptions.WanikaniAPIException, self.client.get, self.url)
+        self.assertEqual(len(responses.calls), 3)
+
+    @responses.activate
+    def test_unauthorized_raises_invalid_key_without_retrying(self, sleep):
+        self._respond_in_sequence(401)
+
+        self.assertRaises(exceptions.InvalidWaniKaniKey, self.client.get, self.url)
+        self.assertEqual(len(responses.calls), 1)
+
+    @responses.activate
+    def test_error_payload_raises_matching_exception(self, sleep):
+        responses.add(responses.GET, self.url,
+                      json={"error": {"code": "user_not_found", "message": "User does not exist."}},
+                      status=200,
+                      content_type="application/json")
+
+        self.assertRaises(exceptions.InvalidWaniKaniKey, self.client.get, self.url)
+
+    def test_requests_are_bounded_by_timeouts(self, sleep):
+        client = WanikaniClient(connect_timeout=1, read_timeout=2, rate_limiter=self.rate_limiter)
+        with mock.patch.object(client.session, "get") as get:
+            get.return_value.status_code = 200
+            get.return_value.json.return_value = sample_api_responses.user_information_response
+
+            client.get_user_information("any_key")
+
+        get.assert_called_once_with(self.url, timeout=(1, 2), stream=False)
+
+    @responses.activate
+    def test_every_attempt_takes_a_rate_limit_token_for_its_key(self, sleep):
+        self._respond_in_sequence(503, 200)
+
+        self.client.get(self.url)
+
+        self.assertEqual(self.rate_limiter.acquire.call_args_list, [mock.call("any_key", max_wait=None), mock.call("any_key", max_wait=None)])
+
+    @responses.activate
+    def test_streamed_items_match_the_parsed_response(self, sleep):
+        url = VOCABULARY_URL.format("any_key", "16")
+        responses.add(responses.GET, url, json=sample_api_responses.single_vocab_response, status=200,
+                      content_type="application/json")
+
+        items = list(self.client.iter_items(url))
+
+        self.assertEqual(items, sample_api_responses.single_vocab_response["requested_information"])
+
+    @responses.activate
+    def test_streamed_error_payload_raises_matching_exception(self, sleep):
+        url = VOCABULARY_URL.format("any_key", "16")
+        responses.add(responses.GET, url, json={"error": {"code": "user_not_found", "message": "User does not exist."}},
+                      status=200, content_type="application/json")
+
+        self.assertRaises(exceptions.InvalidWaniKaniKey, list, self.client.iter_items(url))
+
+
+class TestStreamingParser(TestCase):
+
+    def test_items_are_parsed_across_arbitrary_chunk_boundaries(self):
+        document = {"user_information": {"level": 5},
+                    "requested_information": [{"character": "猫", "level": 12345, "user_specific": None},
+                                              {"character": "犬", "level": 6, "user_specific": {"burned": True}}],
+                    "trailing": [1.5, "a, ] }"]}
+        body = json.dumps(document, ensure_ascii=False, indent=1).encode("utf-8")
+        members = {}
+
+        items = list(iter_object_items((body[i:i + 1] for i in range(len(body))), "requested_information",
+                                       on_member=members.__setitem__))
+
+        self.assertEqual(items, document["requested_information"])
+        self.assertEqual(members, {"user_information": {"level": 5}, "trailing": [1.5, "a, ] }"]})
+
+    def test_truncated_documents_are_rejected(self):
+        body = json.dumps(sample_api_responses.single_vocab_response).encode("utf-8")
+
+        self.assertRaises(ValueError, list, iter_object_items([body[:-20]], "requested_information"))
+
+    def test_bare_arrays_are_streamed_item_by_item(self):
+        document = [{"character": "猫", "pitch": [0, 1]}, {"character": "犬", "pitch": []}]
+        body = json.dumps(document, ensure_ascii=False).encode("utf-8")
+
+        self.assertEqual(list(iter_array_items(body[i:i + 3] for i in range(0, len(body), 3))), document)
+        self.assertRaises(ValueError, list, iter_array_items([body + b"[]"]))
+
+    def test_numbers_are_parsed_when_split_at_any_offset(self):
+        document = [123.45, -0.5e-10, 1E+20, 42, {"a": 123.45, "b": 6e3}, 7]
+        body = json.dumps(document).encode("utf-8")
+
+        for offset in range(1, len(body)):
+            self.assertEqual(list(iter_array_items([body[:offset], body[offset:]])), document)
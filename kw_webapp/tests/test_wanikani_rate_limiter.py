@@ -0,0 +1,64 @@
+import hashlib
+from unittest import mock
+
+import redis
+from django.test import TestCase
+
+from kw_webapp.wanikani import exceptions
+from kw_webapp.wanikani.rate_limiter import WanikaniRateLimiter, GLOBAL_BUCKET_KEY, API_KEY_BUCKET_KEY
+
+
+@mock.patch("kw_webapp.wanikani.rate_limiter.time.sleep")
+class TestWanikaniRateLimiter(TestCase):
+
+    def setUp(self):
+        self.connection = mock.MagicMock()
+        self.take_token = self.connection.register_script.return_value
+        self.limiter = WanikaniRateLimiter(connection=self.connection, global_rate=10, global_burst=20,
+                                           per_key_rate=1, per_key_burst=5, max_wait=5)
+
+    def test_acquire_takes_from_global_and_per_key_buckets(self, sleep):
+        self.take_token.return_value = b"0"
+
+        self.limiter.acquire("some_key")
+
+        keys = self.take_token.call_args[1]["keys"]
+        self.assertEqual(keys, [GLOBAL_BUCKET_KEY,
+                                API_KEY_BUCKET_KEY.format(hashlib.sha256(b"some_key").hexdigest())])
+        self.assertNotIn("some_key", keys[1])
+        sleep.assert_not_called()
+
+    def test_acquire_sleeps_until_a_token_is_available(self, sleep):
+        self.take_token.side_effect = [b"0.5", b"0.25", b"0"]
+
+        self.limiter.acquire("some_key")
+
+        self.assertEqual(sleep.call_args_list, [mock.call(0.5), mock.call(0.25)])
+
+    def test_acquire_gives_up_when_the_wait_is_too_long(self, sleep):
+        self.take_token.return_value = b"10"
+
+        self.assertRaises(exceptions.WanikaniRateLimitExceeded, self.limiter.acquire, "some_key")
+        sleep.assert_not_called()
+
+    def test_redis_outage_fails_open_and_backs_off_from_redis(self, sleep):
+        self.take_token.side_effect = redis.ConnectionError("Nobody home")
+
+        self.assertEqual(self.limiter.acquire("some_key"), 0)
+        self.assertEqual(self.limiter.acquire("some_key"), 0)
+
+        self.assertEqual(self.take_token.call_count, 1)
+
+    def test_a_shorter_max_wait_can_be_given_per_call(self, sleep):
+        self.take_token.return_value = b"2"
+
+        self.assertRaises(exceptions.WanikaniRateLimitExceeded, self.limiter.acquire, "some_key", max_wait=1)
+        sleep.assert_not_called()
+
+    def test_log_metrics_reports_cluster_wide_totals(self, sleep):
+        self.connection.hgetall.return_value = {b"acquisitions": b"10", b"throttled": b"3",
+                                                b"wait_seconds_total": b"1.5"}
+
+        metrics = self.limiter.log_metrics()
+
+        self.assertEqual(metrics, {"acquisitions": 10, "throttled": 3, "gave_up": 0, "wait_seconds_total": 1.5})
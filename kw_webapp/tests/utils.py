@@ -1,8 +1,11 @@
+from contextlib import contextmanager
 from datetime import timedelta
 
 import responses
 from django.contrib.auth.models import User
 
+from KW.celery import app as celery_app
+
 from kw_webapp.constants import API_KEY
 from kw_webapp.models import Vocabulary, Reading, UserSpecific, Profile
 from kw_webapp.tasks import build_user_information_api_string, build_API_sync_string_for_user_for_levels
@@ -120,3 +123,18 @@ def setupTestFixture(self):
     self.reading = create_reading(self.vocabulary, "ねこ", "猫", 5)
     self.review = create_review(self.vocabulary, self.user)
 
+
+
+@contextmanager
+def run_jobs_inline():
+    """
+    Celery tasks enqueued within this block, such as the jobs started by the sync/unlock/reset endpoints, run right away
+    in the test's process instead of waiting on a worker.
+    """
+    celery_app.conf.task_always_eager = True
+    celery_app.conf.task_eager_propagates = True
+    try:
+        yield
+    finally:
+        celery_app.conf.task_always_eager = False
+        celery_app.conf.task_eager_propagates = False
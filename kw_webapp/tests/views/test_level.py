@@ -1,10 +1,12 @@
 from unittest import mock
 
+from django.test import override_settings
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
 
-from kw_webapp.models import Level
-from kw_webapp.tests.utils import setupTestFixture
+from kw_webapp.models import Level, UserSpecific, MeaningSynonym
+from kw_webapp.tasks import unlock_level_job, lock_level_job, lock_level_for_user
+from kw_webapp.tests.utils import setupTestFixture, run_jobs_inline, create_vocab, create_reading, create_review
 from kw_webapp.utils import one_time_orphaned_level_clear
 
 
@@ -19,15 +21,52 @@ class TestLevel(APITestCase):
         self.user.profile.level = 5
         self.user.save()
 
-        self.client.post(reverse("api:level-lock", args=(self.user.profile.level,)))
+        with run_jobs_inline():
+            self.client.post(reverse("api:level-lock", args=(self.user.profile.level,)))
         response = self.client.get(reverse("api:user-me"))
         self.assertFalse(response.data["profile"]["follow_me"])
 
     def test_locking_a_level_locks_successfully(self):
         self.client.force_login(user=self.user)
-        response = self.client.post(reverse("api:level-lock", args=(self.user.profile.level,)))
-
-        self.assertEqual(response.data["locked"], 1)
+        with mock.patch("api.views.start_job", return_value="some-job-id") as start_job:
+            response = self.client.post(reverse("api:level-lock", args=(self.user.profile.level,)))
+
+        self.assertEqual(response.status_code, 202)
+        start_job.assert_called_once_with(lock_level_job, self.user, 5)
+        self.assertEqual(lock_level_job(self.user.id, 5)["locked"], 1)
+        self.assertFalse(UserSpecific.objects.filter(user=self.user).exists())
+
+    @override_settings(REVIEW_DELETE_BATCH_SIZE=2)
+    def test_locking_a_level_archives_reviews_in_batches_and_reports_progress(self):
+        for i in range(4):
+            vocabulary = create_vocab("vocab {}".format(i))
+            create_reading(vocabulary, "よみ{}".format(i), "字{}".format(i), 5)
+            MeaningSynonym.objects.create(review=create_review(vocabulary, self.user), text="synonym")
+        progress = []
+
+        locked = lock_level_for_user(5, self.user, on_progress=lambda *args: progress.append(args))
+
+        self.assertEqual(locked, 5)
+        self.assertFalse(UserSpecific.objects.filter(user=self.user).exists())
+        self.assertEqual(UserSpecific.all_objects.filter(user=self.user, archived=True).count(), 5)
+        self.assertEqual(MeaningSynonym.objects.count(), 4)
+        self.assertListEqual(progress, [(2, 5), (4, 5), (5, 5)])
+
+    @mock.patch("kw_webapp.tasks.unlock_eligible_vocab_from_levels")
+    def test_unlocking_a_locked_level_restores_archived_reviews_without_calling_wanikani(self, unlock_from_wanikani):
+        self.review.streak = 4
+        self.review.save()
+        MeaningSynonym.objects.create(review=self.review, text="flying rodent")
+        lock_level_job(self.user.id, 5)
+
+        result = unlock_level_job(self.user.id, 5)
+
+        unlock_from_wanikani.assert_not_called()
+        self.assertDictEqual(result, {"unlocked_now": 1, "total_unlocked": 1, "locked": 0})
+        review = UserSpecific.objects.get(pk=self.review.pk)
+        self.assertEqual(review.streak, 4)
+        self.assertListEqual(review.synonyms_list(), ["flying rodent"])
+        self.assertIn(5, self.user.profile.unlocked_levels_list())
 
     def test_user_unlocking_too_high_level_fails(self):
         self.client.force_login(user=self.user)
@@ -38,21 +77,26 @@ class TestLevel(APITestCase):
         response = self.client.post(reverse("api:level-unlock", args=(level_too_high,)))
         self.assertEqual(response.status_code, 403)
 
-    @mock.patch("api.views.unlock_eligible_vocab_from_levels", side_effect=lambda x, y: [1, 0, 0])
+    @mock.patch("kw_webapp.tasks.unlock_eligible_vocab_from_levels", side_effect=lambda x, y: [1, 0, 0])
     def test_unlocking_a_level_unlocks_all_vocab(self, garbage):
         self.client.force_login(user=self.user)
         self.user.profile.api_valid = True
         self.user.profile.save()
         s1 = reverse("api:level-unlock", args=(5,))
-        response = self.client.post(s1)
-        self.assertEqual(response.data['unlocked_now'], 1)
+        with mock.patch("api.views.start_job", return_value="some-job-id") as start_job:
+            response = self.client.post(s1)
+
+        self.assertEqual(response.status_code, 202)
+        start_job.assert_called_once_with(unlock_level_job, self.user, 5)
+        self.assertEqual(unlock_level_job(self.user.id, 5)['unlocked_now'], 1)
 
     def test_locking_a_level_successfully_clears_the_level_object(self):
         self.client.force_login(user=self.user)
         level = Level.objects.get(profile=self.user.profile, level=5)
         self.assertTrue(level is not None)
 
-        self.client.post(reverse("api:level-lock", args=(self.user.profile.level,)))
+        with run_jobs_inline():
+            self.client.post(reverse("api:level-lock", args=(self.user.profile.level,)))
 
         levels = Level.objects.filter(profile=self.user.profile, level=5)
         self.assertEqual(levels.count(), 0)
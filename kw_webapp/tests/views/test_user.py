@@ -1,14 +1,15 @@
 from datetime import timedelta
+from unittest import mock
 
 import responses
 from django.utils import timezone
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
 
-from kw_webapp.tasks import build_API_sync_string_for_user_for_levels
+from kw_webapp.tasks import build_API_sync_string_for_user_for_levels, sync_with_wk_job, start_job, reset_user_job
 from kw_webapp.tests import sample_api_responses
 from kw_webapp.tests.utils import create_review_for_specific_time, mock_user_info_response_with_higher_level, \
-    setupTestFixture, create_vocab, create_reading, create_review, mock_user_info_response
+    setupTestFixture, create_vocab, create_reading, create_review, mock_user_info_response, run_jobs_inline
 
 
 class TestUser(APITestCase):
@@ -31,7 +32,12 @@ class TestUser(APITestCase):
                       content_type='application/json')
 
 
-        response = self.client.post(reverse("api:user-sync"), data={"full_sync": "true"})
+        with mock.patch("api.views.start_job", return_value="some-job-id") as start_job:
+            response = self.client.post(reverse("api:user-sync"), data={"full_sync": "true"})
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data["job_id"], "some-job-id")
+        start_job.assert_called_once_with(sync_with_wk_job, self.user, True)
 
         correct_response = {
             "new_review_count": 0,
@@ -39,7 +45,23 @@ class TestUser(APITestCase):
             "new_synonym_count": 0
         }
 
-        self.assertJSONEqual(str(response.content, encoding='utf8'), correct_response)
+        self.assertEqual(sync_with_wk_job(self.user.id, True), correct_response)
+
+    @mock.patch("kw_webapp.tasks.AsyncResult")
+    def test_job_status_is_only_visible_to_the_user_who_started_it(self, async_result):
+        async_result.return_value.state = "SUCCESS"
+        async_result.return_value.successful.return_value = True
+        async_result.return_value.result = {"locked": 0}
+        job_id = start_job(reset_user_job, self.user, 5)
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse("api:job-detail", args=(job_id,)))
+
+        self.assertEqual(response.data, {"job_id": job_id, "status": "SUCCESS", "result": {"locked": 0}})
+
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse("api:job-detail", args=(job_id,)))
+        self.assertEqual(response.status_code, 404)
 
     @responses.activate
     def test_adding_a_level_to_reset_command_only_resets_levels_above_or_equal_togiven(self):
@@ -53,7 +75,8 @@ class TestUser(APITestCase):
         response = self.client.get((reverse("api:review-current")))
         self.assertEqual(response.data['count'], 2)
         self.assertListEqual(self.user.profile.unlocked_levels_list(), [5,2])
-        self.client.post(reverse("api:user-reset"), data={'level': 3})
+        with run_jobs_inline():
+            self.client.post(reverse("api:user-reset"), data={'level': 3})
 
         response = self.client.get((reverse("api:review-current")))
         self.assertEqual(response.data['count'], 0)
@@ -67,8 +90,9 @@ class TestUser(APITestCase):
         assert(self.user.profile.level == 5)
 
         # When
-        response = self.client.post(reverse("api:user-reset"), data={'level': 1})
-        assert("Your account has been reset" in response.data['message'])
+        with run_jobs_inline():
+            response = self.client.post(reverse("api:user-reset"), data={'level': 1})
+        assert(response.status_code == 202)
 
         # Then
         self.user.profile.refresh_from_db()
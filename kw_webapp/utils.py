@@ -1,23 +1,33 @@
 import random
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice, groupby
 
 import requests
 from django.contrib.auth.models import User
+from django.db import connection, transaction
 from django.db.models import Count
 from django.utils import timezone
 from rest_framework.authtoken.models import Token
 
 from kw_webapp import constants
+from kw_webapp.backfills import run_backfill, CorrectNextReviewDates
 from kw_webapp.models import UserSpecific, Profile, Reading, Tag, Vocabulary, MeaningSynonym, AnswerSynonym, \
     PartOfSpeech, Level, logger
+from kw_webapp.reports import duplicate_kanji_report, duplicate_review_report, conglomerated_vocabulary_report
 from kw_webapp.tasks import create_new_vocabulary, \
-    has_multiple_kanji, import_vocabulary_from_json
-from kw_webapp.wanikani import make_api_call
+    import_vocabulary_from_json, sync_catalog_items, bulk_update_field, schedule_catalog_snapshot_rebuild
+from kw_webapp.wanikani import make_api_call, fetch_vocabulary
+from kw_webapp.wanikani.client import STREAM_CHUNK_SIZE
+from kw_webapp.wanikani.exceptions import WanikaniAPIException
+from kw_webapp.wanikani.streaming import iter_array_items
+from kw_webapp.wanikani.constants import VOCABULARY_URL
 from kw_webapp.tasks import unlock_eligible_vocab_from_levels
 from kw_webapp.tests.utils import create_review, create_review_for_specific_time
 
 
 def wipe_all_reviews_for_user(user):
-    reviews = UserSpecific.objects.filter(user=user)
+    reviews = UserSpecific.all_objects.filter(user=user)
     reviews.delete()
     if len(reviews) > 0:
         raise ValueError
@@ -26,13 +36,13 @@ def wipe_all_reviews_for_user(user):
 
 
 def reset_reviews_for_user(user):
-    reviews = UserSpecific.objects.filter(user=user)
+    reviews = UserSpecific.all_objects.filter(user=user)
     reviews.update(needs_review=False)
     reviews.update(last_studied=timezone.now())
 
 
 def flag_all_reviews_for_user(user, needed):
-    reviews = UserSpecific.objects.filter(user=user)
+    reviews = UserSpecific.all_objects.filter(user=user)
     reviews.update(needs_review=needed)
 
 
@@ -54,16 +64,13 @@ def create_profile_for_user(user):
 
 
 def correct_next_review_dates():
-    us = UserSpecific.objects.all()
-    i = 0
-    for u in us:
-        u.set_next_review_time_based_on_last_studied()
-        print(i, u)
+    checkpoint = run_backfill(CorrectNextReviewDates())
+    print(checkpoint)
 
 
 
 def one_time_merge_level(level, user=None):
-    api_call = "https://www.wanikani.com/api/user/{}/vocabulary/{}".format(constants.API_KEY, level)
+    api_call = VOCABULARY_URL.format(constants.API_KEY, level)
     response = make_api_call(api_call)
     vocab_list = response['requested_information']
     print("Vocab found:{}".format(len(vocab_list)))
@@ -94,57 +101,90 @@ def one_time_merger(user=None):
     for level in range(1, 61):
         one_time_merge_level(level, user=None)
 
+# Fields carried over from the winning review when duplicate vocabulary is merged.
+MERGED_REVIEW_FIELDS = ('streak', 'incorrect', 'correct', 'next_review_date', 'last_studied', 'burned', 'needs_review',
+                        'wanikani_srs', 'wanikani_srs_numeric', 'wanikani_burned', 'critical', 'unlock_date',
+                        'archived')
+
+
 def create_new_review_and_merge_existing(vocabulary, found_vocabulary):
     print("New vocabulary id is:[{}]".format(vocabulary.id))
-    print("Old vocabulary items had meanings:[{}] ".format(
-        " -> ".join(found_vocabulary.exclude(id=vocabulary.id).values_list('meaning', flat=True))))
-    print("Old vocabulary items had ids:[{}] ".format(
-        " -> ".join([str(a) for a in found_vocabulary.exclude(id=vocabulary.id).values_list('id', flat=True)])))
-    ids = found_vocabulary.values_list('id').exclude(id=vocabulary.id)
-    for user in User.objects.all():
-        old_reviews = UserSpecific.objects.filter(user=user, vocabulary__in=ids)
-        if old_reviews.count() > 0:
-            print("User [{}] had [{}] reviews which used one of the now merged vocab.".format(user.username,
-                                                                                              old_reviews.count()))
-            print("Giving them a review for our new vocabulary object...")
-            new_review = UserSpecific.objects.create(vocabulary=vocabulary, user=user)
-            # Go over all the reviews which were duplicates, and pick the best one as the new accurate one.
-            for old_review in old_reviews:
-                if old_review.streak > new_review.streak:
-                    print("Old review [{}] has new highest streak: [{}]".format(old_review.id, old_review.streak))
-                    copy_review_data(new_review, old_review)
-                else:
-                    print("Old review [{}] has lower streak than current maximum.: [{}] < [{}]".format(old_review.id,
-                                                                                                       old_review.streak,
-                                                                                                       new_review.streak))
-                if new_review.notes is None:
-                    new_review.notes = old_review.notes
-                else:
-                    new_review.notes = new_review.notes + ", " + old_review.notes
-
-                # slap all the synonyms found onto the new review.
-                MeaningSynonym.objects.filter(review=old_review).update(review=new_review)
-                AnswerSynonym.objects.filter(review=old_review).update(review=new_review)
-
-            new_review.save()
+    old_vocabulary_ids = list(found_vocabulary.exclude(id=vocabulary.id).values_list('id', flat=True))
+    print("Old vocabulary items had ids:[{}] ".format(" -> ".join(str(vocab_id) for vocab_id in old_vocabulary_ids)))
+    merged_count = merge_vocabulary_reviews(vocabulary, old_vocabulary_ids)
+    print("Merged reviews of [{}] users onto the new vocabulary.".format(merged_count))
 
-def generate_user_stats(user):
-    reviews = UserSpecific.objects.filter(user=user)
-    kanji_review_map = {}
-    for review in reviews:
-        for reading in review.vocabulary.readings.all():
-            if reading.character in kanji_review_map.keys():
-                kanji_review_map[reading.character].append(review)
-            else:
-                kanji_review_map[reading.character] = []
-                kanji_review_map[reading.character].append(review)
 
+def merge_vocabulary_reviews(vocabulary, old_vocabulary_ids):
+    '''
+    Gives every user who reviews any of the old vocabulary a single review of the new one, in a constant number of
+    queries however many users are affected. Each user's review with the highest streak wins (the oldest, on a tie) and
+    is copied onto the new review, notes from all of their old reviews are joined, and every synonym is re-pointed at the
+    new review with one UPDATE per synonym model. Synonyms which would collide once merged keep their oldest copy.
+
+    The old reviews are left in place, they go when the old vocabulary is deleted.
+
+    :param vocabulary: The vocabulary being merged into.
+    :param old_vocabulary_ids: ids of the duplicate vocabulary being merged away.
+    :return: the number of users whose reviews were merged.
+    '''
+    if not old_vocabulary_ids:
+        return 0
+    quote = connection.ops.quote_name
+    review_table = quote(UserSpecific._meta.db_table)
+    old_vocabulary_placeholders = ", ".join(["%s"] * len(old_vocabulary_ids))
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT id FROM (SELECT id, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY streak DESC, id) AS position "
+                "FROM {reviews} WHERE vocabulary_id IN ({old_vocabulary})) ranked WHERE position = 1".format(
+                    reviews=review_table, old_vocabulary=old_vocabulary_placeholders), old_vocabulary_ids)
+            winning_review_ids = [row[0] for row in cursor.fetchall()]
+
+        notes_by_user = defaultdict(list)
+        old_notes = UserSpecific.all_objects.filter(vocabulary_id__in=old_vocabulary_ids, notes__isnull=False)
+        for user_id, notes in old_notes.order_by('id').values_list('user_id', 'notes'):
+            notes_by_user[user_id].append(notes)
+
+        already_merged = set(UserSpecific.all_objects.filter(vocabulary=vocabulary).values_list('user_id', flat=True))
+        merged_reviews = []
+        for winner in UserSpecific.all_objects.filter(pk__in=winning_review_ids).exclude(user_id__in=already_merged):
+            merged_review = UserSpecific(vocabulary=vocabulary, user_id=winner.user_id,
+                                         notes=", ".join(notes_by_user[winner.user_id]) or None)
+            for field in MERGED_REVIEW_FIELDS:
+                setattr(merged_review, field, getattr(winner, field))
+            merged_reviews.append(merged_review)
+        UserSpecific.objects.bulk_create(merged_reviews)
+
+        for synonym_model, columns in ((MeaningSynonym, ('text',)), (AnswerSynonym, ('character', 'kana'))):
+            synonym_table = quote(synonym_model._meta.db_table)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "DELETE FROM {synonyms} WHERE id IN (SELECT id FROM ("
+                    "SELECT synonym.id, ROW_NUMBER() OVER (PARTITION BY review.user_id, {partition} ORDER BY synonym.id) "
+                    "AS position FROM {synonyms} synonym JOIN {reviews} review ON review.id = synonym.review_id "
+                    "WHERE review.vocabulary_id IN ({old_vocabulary}, %s)) ranked WHERE position > 1)".format(
+                        synonyms=synonym_table, reviews=review_table, old_vocabulary=old_vocabulary_placeholders,
+                        partition=", ".join("synonym.{}".format(quote(column)) for column in columns)),
+                    old_vocabulary_ids + [vocabulary.id])
+                cursor.execute(
+                    "UPDATE {synonyms} SET review_id = ("
+                    "SELECT merged.id FROM {reviews} merged JOIN {reviews} old ON old.user_id = merged.user_id "
+                    "WHERE old.id = {synonyms}.review_id AND merged.vocabulary_id = %s) "
+                    "WHERE review_id IN (SELECT id FROM {reviews} WHERE vocabulary_id IN ({old_vocabulary}))".format(
+                        synonyms=synonym_table, reviews=review_table, old_vocabulary=old_vocabulary_placeholders),
+                    [vocabulary.id] + old_vocabulary_ids)
+    return len(merged_reviews)
+
+
+def generate_user_stats(user):
+    _, rows = duplicate_review_report(user)
     print("Printing all duplicates for user.")
-    for kanji, reviews in kanji_review_map.items():
-        if len(reviews) > 1:
-            print("***" + kanji + "***")
-            for review in reviews:
-                print(review)
+    for kanji, review_rows in groupby(rows, key=lambda row: row[0]):
+        print("***" + kanji + "***")
+        for _, review_id, vocabulary_id, meaning, streak in review_rows:
+            print("Review [{}]: {} (vocabulary [{}], streak {})".format(review_id, meaning, vocabulary_id, streak))
     print("Finished printing duplicates")
 
 
@@ -154,31 +194,67 @@ def handle_merger(vocabulary_json, found_vocabulary):
     vocabulary = create_new_vocabulary(vocabulary_json)
     create_new_review_and_merge_existing(vocabulary, found_vocabulary)
     Vocabulary.objects.filter(pk__in=ids_to_delete_list).exclude(id=vocabulary.id).delete()
+    schedule_catalog_snapshot_rebuild()
+
+# model -> the columns which identify a duplicate. Within each group, the row with the lowest id is the one we keep.
+DUPLICATE_GROUPS = OrderedDict((
+    (MeaningSynonym, ('review_id', 'text')),
+    (AnswerSynonym, ('review_id', 'character', 'kana')),
+    (UserSpecific, ('user_id', 'vocabulary_id')),
+))
+
+
+def _duplicate_ids_sql(model, columns):
+    quote = connection.ops.quote_name
+    return "SELECT {pk} FROM (" \
+           "SELECT {pk}, ROW_NUMBER() OVER (PARTITION BY {partition} ORDER BY {pk}) AS position FROM {table}" \
+           ") ranked WHERE position > 1".format(pk=quote(model._meta.pk.column),
+                                                partition=", ".join(quote(column) for column in columns),
+                                                table=quote(model._meta.db_table))
+
+
+def delete_duplicate_rows(model, batch_size=1000, dry_run=False):
+    '''
+    Deletes every duplicate row of the model, as defined in DUPLICATE_GROUPS, keeping the lowest id of each group.
+    Duplicates are ranked with a ROW_NUMBER() window in the database and deleted at most batch_size at a time, each
+    batch in its own transaction, so locks are never held for long.
+
+    :param model: MeaningSynonym, AnswerSynonym or UserSpecific.
+    :param batch_size: how many rows to delete per transaction.
+    :param dry_run: if True, only count the rows which would be deleted.
+    :return: the number of rows deleted, or which would be deleted.
+    '''
+    duplicate_ids_sql = _duplicate_ids_sql(model, DUPLICATE_GROUPS[model])
+    if dry_run:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM ({}) duplicates".format(duplicate_ids_sql))
+            return cursor.fetchone()[0]
+
+    deleted_count = 0
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("{} ORDER BY 1 LIMIT %s".format(duplicate_ids_sql), [batch_size])
+            duplicate_ids = [row[0] for row in cursor.fetchall()]
+            if not duplicate_ids:
+                return deleted_count
+            # Synonyms of duplicate reviews are cascaded in bulk by the same delete.
+            _, deleted_per_model = model._base_manager.filter(pk__in=duplicate_ids).delete()
+            deleted_count += deleted_per_model[model._meta.label]
+        logger.info("Deleted {} duplicate {} so far".format(deleted_count, model._meta.verbose_name_plural))
+
+
+def delete_all_duplicates(batch_size=1000, dry_run=False):
+    '''
+    Runs delete_duplicate_rows over every model in DUPLICATE_GROUPS.
+
+    :return: dictionary mapping model -> number of rows deleted, or which would be deleted.
+    '''
+    return OrderedDict((model, delete_duplicate_rows(model, batch_size=batch_size, dry_run=dry_run))
+                       for model in DUPLICATE_GROUPS)
+
 
 def blow_away_duplicate_reviews_for_all_users():
-    users = User.objects.filter(profile__isnull=False)
-    for user in users:
-        blow_away_duplicate_reviews_for_user(user)
-
-def blow_away_duplicate_reviews_for_user(user):
-    dupe_revs = UserSpecific.objects.filter(user=user)\
-        .values("vocabulary")\
-        .annotate(num_reviews=Count("vocabulary")).filter(
-        num_reviews__gt=1)
-
-    if dupe_revs.count() > 0:
-        print("Duplicate reviews found for user: ".format(dupe_revs.count()))
-    vocabulary_ids = []
-    for dupe_rev in dupe_revs:
-        vocabulary_ids.append(dupe_rev['vocabulary'])
-
-    print("Here are the vocabulary IDs we are gonna check: {}".format(vocabulary_ids))
-    for voc_id in vocabulary_ids:
-        review_id_to_save = UserSpecific.objects.filter(vocabulary__id=voc_id, user=user).values_list("id", flat=True)[0]
-        UserSpecific.objects.filter(vocabulary__id=voc_id, user=user).exclude(pk=int(review_id_to_save)).delete()
-        new_reviews = UserSpecific.objects.filter(vocabulary__id=voc_id, user=user)
-        print("New review count: {}".format(new_reviews.count()))
-        assert(new_reviews.count() == 1)
+    print("Deleted {} duplicate reviews".format(delete_duplicate_rows(UserSpecific)))
 
 
 def one_time_import_jisho(json_file_path):
@@ -200,37 +276,100 @@ def one_time_import_jisho(json_file_path):
                         print(reading.vocabulary.meaning, reading.character, reading.kana, reading.level)
                         merge_with_model(reading, vocabulary_json)
 
-def one_time_import_jisho_new_format(json_file_path):
-    import json
-    no_local_vocab = []
-    with open(json_file_path) as file:
-        with open("outfile.txt", 'w') as outfile:
-            parsed_json = json.load(file)
+JISHO_READING_FIELDS = (("common", "common"), ("furi", "furigana"), ("sentenceEn", "sentence_en"),
+                        ("sentenceJa", "sentence_ja"))
 
-            for vocabulary_json in parsed_json:
-                try:
-                    related_reading = Reading.objects.get(character=vocabulary_json["character"])
-                    outfile.write(merge_with_model(related_reading, vocabulary_json))
-                except Reading.DoesNotExist:
-                    no_local_vocab.append(vocabulary_json)
-                    pass
-                except Reading.MultipleObjectsReturned:
-                    readings = Reading.objects.filter(character=vocabulary_json["character"])
-                    print("FOUND MULTIPLE READINGS")
-                    for reading in readings:
-                        if reading.kana == vocabulary_json["reading"]:
-                            print(reading.vocabulary.meaning, reading.character, reading.kana, reading.level)
-                            merge_with_model(reading, vocabulary_json)
 
-    unfilled_vocabulary = Vocabulary.objects.exclude(readings__sentence_en__isnull=False)
-    if unfilled_vocabulary.count() == 0:
-        print("No missing information!")
-    else:
-        print("Missing some info!")
-        for vocab in unfilled_vocabulary:
-            print(vocab)
+def import_jisho_data(json_file_path, batch_size=500):
+    '''
+    Merges Jisho's supplemental data (sentences, furigana, pitch, parts of speech) into our readings. The file is
+    streamed rather than loaded whole, and each batch of entries is matched against readings preloaded in one query and
+    written back in bulk, so a batch costs the same handful of queries whatever its size.
+
+    :param json_file_path: path to a JSON array of entries in the new Jisho export format.
+    :param batch_size: how many entries to match and write at a time.
+    :return: Counter of updated, missing and ambiguous entries, and the list of characters with no local reading.
+    '''
+    part_of_speech_ids = dict(PartOfSpeech.objects.values_list('part', 'id'))
+    summary = Counter()
+    missing_characters = []
+    with open(json_file_path, 'rb') as json_file:
+        entries = iter_array_items(iter(lambda: json_file.read(STREAM_CHUNK_SIZE), b""))
+        while True:
+            batch = list(islice(entries, batch_size))
+            if not batch:
+                break
+            with transaction.atomic():
+                _import_jisho_batch(batch, part_of_speech_ids, summary, missing_characters)
+    if summary["updated"]:
+        schedule_catalog_snapshot_rebuild()
+    return summary, missing_characters
+
+
+def _import_jisho_batch(batch, part_of_speech_ids, summary, missing_characters):
+    readings_by_character = defaultdict(list)
+    for reading in Reading.objects.filter(character__in=set(entry["character"] for entry in batch)):
+        readings_by_character[reading.character].append(reading)
+
+    changes = defaultdict(dict)
+    parts_by_reading = {}
+    for entry in batch:
+        candidates = readings_by_character[entry["character"]]
+        # A lone reading takes the data even if Jisho's primary reading differs, as the old one-time import did.
+        matched = candidates if len(candidates) == 1 else [reading for reading in candidates
+                                                           if reading.kana == entry.get("reading")]
+        if not matched:
+            if candidates:
+                summary["ambiguous"] += 1
+            else:
+                summary["missing"] += 1
+                missing_characters.append(entry["character"])
+            continue
+
+        values = dict((field, entry[json_key]) for json_key, field in JISHO_READING_FIELDS if json_key in entry)
+        if entry.get("pitch"):
+            values["pitch"] = ",".join(str(pitch) for pitch in entry["pitch"])
+        for reading in matched:
+            for field, value in values.items():
+                if getattr(reading, field) != value:
+                    setattr(reading, field, value)
+                    changes[field][reading.pk] = value
+            if "partOfSpeech" in entry:
+                parts_by_reading[reading.pk] = entry["partOfSpeech"]
+            summary["updated"] += 1
+
+    for field, values_by_pk in changes.items():
+        bulk_update_field(Reading, field, values_by_pk)
+    _set_parts_of_speech(parts_by_reading, part_of_speech_ids)
+
+
+def _set_parts_of_speech(parts_by_reading, part_of_speech_ids):
+    new_parts = set(part for parts in parts_by_reading.values() for part in parts) - set(part_of_speech_ids)
+    if new_parts:
+        PartOfSpeech.objects.bulk_create([PartOfSpeech(part=part) for part in new_parts])
+        part_of_speech_ids.update(PartOfSpeech.objects.filter(part__in=new_parts).values_list('part', 'id'))
+
+    through = Reading.parts_of_speech.through
+    existing = defaultdict(set)
+    for reading_id, part_id in through.objects.filter(reading_id__in=parts_by_reading) \
+            .values_list('reading_id', 'partofspeech_id'):
+        existing[reading_id].add(part_id)
+
+    changed_readings = dict((reading_id, set(part_of_speech_ids[part] for part in parts))
+                            for reading_id, parts in parts_by_reading.items())
+    changed_readings = dict((reading_id, part_ids) for reading_id, part_ids in changed_readings.items()
+                            if part_ids != existing[reading_id])
+    if changed_readings:
+        through.objects.filter(reading_id__in=changed_readings).delete()
+        through.objects.bulk_create([through(reading_id=reading_id, partofspeech_id=part_id)
+                                     for reading_id, part_ids in changed_readings.items() for part_id in part_ids])
+
+
+def one_time_import_jisho_new_format(json_file_path):
+    summary, missing_characters = import_jisho_data(json_file_path)
+    print("Updated {} readings, {} ambiguous entries skipped.".format(summary["updated"], summary["ambiguous"]))
     print("Found no local vocabulary for: ")
-    print(no_local_vocab)
+    print(missing_characters)
 
 
 def merge_with_model(related_reading, vocabulary_json):
@@ -299,36 +438,25 @@ def create_various_future_reviews_for_user(user):
             print(review)
 
 def survey_conglomerated_vocabulary():
+    _, rows = conglomerated_vocabulary_report()
     count = 0
-    for vocab in Vocabulary.objects.all():
-        if has_multiple_kanji(vocab):
-            print("Found item with multiple Kanji:[{}]".format(vocab.meaning))
-            print("\n".join(reading.kana + ": " + reading.character for reading in vocab.readings.all()))
-            count += 1
+    for (_, meaning), readings in groupby(rows, key=lambda row: row[:2]):
+        print("Found item with multiple Kanji:[{}]".format(meaning))
+        print("\n".join(kana + ": " + character for _, _, character, kana in readings))
+        count += 1
 
     print("total count:{}".format(count))
 
 
 def find_all_duplicates():
-    all_vocab = Vocabulary.objects.all()
-    kanji_review_map = {}
-    for vocab in all_vocab:
-        for reading in vocab.readings.all():
-            if reading.character in kanji_review_map.keys():
-                kanji_review_map[reading.character].append(vocab)
-            else:
-                kanji_review_map[reading.character] = []
-                kanji_review_map[reading.character].append(vocab)
-
+    _, rows = duplicate_kanji_report()
     print("Printing all duplicates for all vocab.")
     duplicate_count = 0
-    for kanji, vocabs in kanji_review_map.items():
-        if len(vocabs) > 1:
-            duplicate_count += 1
-            print("***" + kanji + "***")
-            for vocab in vocabs:
-
-                print(vocab)
+    for kanji, vocabulary_rows in groupby(rows, key=lambda row: row[0]):
+        duplicate_count += 1
+        print("***" + kanji + "***")
+        for _, vocabulary_id, meaning in vocabulary_rows:
+            print("{} [{}]".format(meaning, vocabulary_id))
     print("Finished printing duplicates: found {}".format(duplicate_count))
 
 
@@ -352,6 +480,41 @@ def one_time_orphaned_level_clear():
         levels = Level.objects.filter(profile=None)
         levels.delete()
 
+def repopulate_catalog(levels=None, api_key=constants.API_KEY, concurrency=4, dry_run=False, trust_hashes=True):
+    '''
+    Re-syncs the catalog with WaniKani. Levels are fetched concurrently, each one is diffed against the catalog in memory,
+    and only its differences are written back, in bulk and in one transaction per level.
+
+    :param levels: levels to repopulate, defaults to all of them.
+    :param api_key: key to fetch vocabulary with. It should belong to a user who can see every level.
+    :param concurrency: how many levels to fetch at once.
+    :param dry_run: if True, work out and report the differences without writing anything.
+    :param trust_hashes: if False, diff every item, even those whose WaniKani content hash hasn't changed.
+    :return: dictionary mapping level -> Counter of changes (see sync_catalog_items), and dictionary mapping level ->
+    error for the levels which couldn't be fetched.
+    '''
+    levels = list(range(constants.LEVEL_MIN, constants.LEVEL_MAX + 1)) if levels is None else levels
+    summaries = {}
+    failures = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(levels)))) as executor:
+        pending_levels = dict((executor.submit(fetch_vocabulary, VOCABULARY_URL.format(api_key, level)), level)
+                              for level in levels)
+        for fetched_level in as_completed(pending_levels):
+            level = pending_levels[fetched_level]
+            try:
+                vocabulary_list = fetched_level.result()
+            except WanikaniAPIException as e:
+                logger.error("Couldn't fetch level {} for repopulation: {}".format(level, e))
+                failures[level] = e
+                continue
+
+            summaries[level] = Counter()
+            with transaction.atomic():
+                sync_catalog_items(vocabulary_list, trust_hashes=trust_hashes, dry_run=dry_run,
+                                   summary=summaries[level])
+    return summaries, failures
+
+
 def repopulate():
     '''
     A task that uses my personal API key in order to re-sync the database. Koichi often decides to switch things around
@@ -360,47 +523,16 @@ def repopulate():
 
     :return:
     '''
-    url = "https://www.wanikani.com/api/user/" + constants.API_KEY + "/vocabulary/{}"
     logger.info("Starting DB Repopulation from WaniKani")
-    for level in range(constants.LEVEL_MIN, constants.LEVEL_MAX + 1):
-        json_data = make_api_call(url.format(level))
-        vocabulary_list = json_data['requested_information']
-        for vocabulary in vocabulary_list:
-            import_vocabulary_from_json(vocabulary)
+    summaries, failures = repopulate_catalog()
+    logger.info("Repopulation done: {}, failed levels: {}".format(dict(sum(summaries.values(), Counter())),
+                                                                 sorted(failures)))
 
 
 def clear_duplicate_meaning_synonyms_from_reviews():
-    # Fetch all reviews wherein there are duplicate meaning synonyms.
-    reviews = UserSpecific.objects.values('id', 'meaning_synonyms__text').annotate(Count('meaning_synonyms__text')).filter(meaning_synonyms__text__count__gt=1)
-    review_list = list(reviews)
-    review_list = set([review['id'] for review in review_list])
-
-    for review_id in review_list:
-        seen_synonyms = set()
-        synonyms = MeaningSynonym.objects.filter(review=review_id)
-        for synonym in synonyms:
-            if synonym.text in seen_synonyms:
-                print("[{}]Deleted element{}".format(review_id, synonym.text))
-                synonym.delete()
-            else:
-                print("[{}]First time seeing element {}".format(review_id, synonym.text))
-                seen_synonyms.add(synonym.text)
+    print("Deleted {} duplicate meaning synonyms".format(delete_duplicate_rows(MeaningSynonym)))
 
 
 def clear_duplicate_answer_synonyms_from_reviews():
-    # Fetch all reviews wherein there are duplicate meaning synonyms.
-    reviews = UserSpecific.objects.values('id', 'reading_synonyms__kana', 'reading_synonyms__character').annotate(Count('reading_synonyms__kana')).filter(reading_synonyms__kana__count__gt=1)
-    review_list = list(reviews)
-    review_list = set([review['id'] for review in review_list])
-
-    for review_id in review_list:
-        seen_synonyms = set()
-        synonyms = AnswerSynonym.objects.filter(review=review_id)
-        for synonym in synonyms:
-            if synonym.kana + "_" + synonym.character in seen_synonyms:
-                print("[{}]Deleted element: {}".format(review_id, synonym.kana + "_" + synonym.character))
-                synonym.delete()
-            else:
-                print("[{}]First time seeing element: {}".format(review_id, synonym.kana + "_" + synonym.character))
-                seen_synonyms.add(synonym.kana + "_" + synonym.character)
+    print("Deleted {} duplicate answer synonyms".format(delete_duplicate_rows(AnswerSynonym)))
 
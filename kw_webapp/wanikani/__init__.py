@@ -1 +1,2 @@
-from .wanikani_api_handler import make_api_call
+from .wanikani_api_handler import make_api_call, fetch_vocabulary, compact_vocabulary
+from .client import WanikaniClient, get_client
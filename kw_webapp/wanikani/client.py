@@ -0,0 +1,147 @@
+import random
+import time
+
+import logging
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from . import constants
+from . import exceptions
+from .rate_limiter import get_rate_limiter
+from .streaming import iter_object_items
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class WanikaniClient(object):
+    """
+    Talks to the WaniKani API over a pooled keep-alive session. Every request is bounded by connect and read timeouts,
+    transient failures are retried a bounded number of times with jittered exponential backoff, and each response body
+    is parsed exactly once. Every attempt first takes a token from the cluster-wide rate limiter, if one is configured.
+    """
+
+    def __init__(self, connect_timeout=None, read_timeout=None, max_retries=None, retry_backoff=None, pool_size=None,
+                 rate_limiter=None):
+        self.timeout = (settings.WANIKANI_CONNECT_TIMEOUT if connect_timeout is None else connect_timeout,
+                        settings.WANIKANI_READ_TIMEOUT if read_timeout is None else read_timeout)
+        self.max_retries = settings.WANIKANI_MAX_RETRIES if max_retries is None else max_retries
+        self.retry_backoff = settings.WANIKANI_RETRY_BACKOFF_SECONDS if retry_backoff is None else retry_backoff
+        pool_size = settings.WANIKANI_CONNECTION_POOL_SIZE if pool_size is None else pool_size
+        self.rate_limiter = get_rate_limiter() if rate_limiter is None else rate_limiter
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _backoff(self, attempt):
+        # "Full jitter": sleep a random amount up to the exponential ceiling, so that many workers retrying at once
+        # spread out instead of stampeding WaniKani together.
+        time.sleep(random.uniform(0, self.retry_backoff * (2 ** attempt)))
+
+    def _send(self, api_url, stream=False, max_rate_limit_wait=None):
+        key_match = constants.API_KEY_FROM_URL.search(api_url)
+        api_key = key_match.group(1) if key_match else None
+        attempt = 0
+        while True:
+            if self.rate_limiter:
+                self.rate_limiter.acquire(api_key, max_wait=max_rate_limit_wait)
+            try:
+                response = self.session.get(api_url, timeout=self.timeout, stream=stream)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            else:
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    return response
+                error = "HTTP {}".format(response.status_code)
+                response.close()
+
+            if attempt >= self.max_retries:
+                raise exceptions.WanikaniConnectionError(
+                    "Giving up on WaniKani after {} attempts: {}".format(attempt + 1, error))
+
+            logger.warning("WaniKani request failed ({}), retrying [{}/{}]".format(error, attempt + 1,
+                                                                                  self.max_retries))
+            self._backoff(attempt)
+            attempt += 1
+
+    def _parse(self, response):
+        if response.status_code == 401:
+            raise exceptions.InvalidWaniKaniKey("Got a 401 from Wanikani!")
+
+        try:
+            json_data = response.json()
+        except ValueError:
+            raise exceptions.WanikaniAPIException(
+                "Could not parse WaniKani response (HTTP {})".format(response.status_code))
+
+        if "error" in json_data:
+            raise exceptions.get_error(json_data["error"])
+
+        if response.status_code != 200:
+            raise exceptions.WanikaniAPIException("Unexpected response from WaniKani: HTTP {}".format(
+                response.status_code))
+
+        return json_data
+
+    def get(self, api_url, max_rate_limit_wait=None):
+        """
+        Fetches and parses a WaniKani API response.
+
+        :param api_url: fully formed WaniKani API url.
+        :param max_rate_limit_wait: how long to wait for the rate limiter at most, see WanikaniRateLimiter.acquire.
+        :return: the parsed JSON body.
+        :raises WanikaniAPIException: or one of its subclasses, if WaniKani could not be reached or returned an error.
+        """
+        return self._parse(self._send(api_url, max_rate_limit_wait=max_rate_limit_wait))
+
+    def iter_items(self, api_url, array_key="requested_information"):
+        """
+        Like get, but the body is parsed as it streams in and the elements of its array_key member are yielded one at a
+        time, so that large responses are never held in memory whole. A dropped connection part way through is not
+        retried, as some items will already have been handed out.
+
+        :param api_url: fully formed WaniKani API url.
+        :param array_key: the top level member to stream.
+        :raises WanikaniAPIException: or one of its subclasses, if WaniKani could not be reached or returned an error.
+        """
+        response = self._send(api_url, stream=True)
+        try:
+            if response.status_code != 200:
+                # Error bodies are small, so there's no need to stream them.
+                self._parse(response)
+
+            def raise_on_error(key, value):
+                if key == "error":
+                    raise exceptions.get_error(value)
+
+            chunks = response.iter_content(chunk_size=STREAM_CHUNK_SIZE)
+            try:
+                for item in iter_object_items(chunks, array_key, on_member=raise_on_error):
+                    yield item
+            except ValueError as e:
+                raise exceptions.WanikaniAPIException("Could not parse WaniKani response: {}".format(e))
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                raise exceptions.WanikaniConnectionError("Lost connection to WaniKani mid-response: {}".format(e))
+        finally:
+            response.close()
+
+    def get_user_information(self, api_key, max_rate_limit_wait=None):
+        return self.get(constants.USER_INFO_URL.format(api_key), max_rate_limit_wait=max_rate_limit_wait)
+
+
+_client = None
+
+
+def get_client():
+    """
+    Returns this process' shared client. It is built lazily so that each forked worker gets its own connection pool.
+    """
+    global _client
+    if _client is None:
+        _client = WanikaniClient()
+    return _client
@@ -1,7 +1,13 @@
+import re
+
+from django.conf import settings
+
 INVALID_WK_API_ERROR = "user_not_found"
 INVALID_ARGUMENTS_ERROR = "invalid_arguments"
 
-WANIKANI_ROOT_URL = 'https://www.wanikani.com/api/user/{}'
+WANIKANI_ROOT_URL = settings.WANIKANI_API_ROOT + '/user/{}'
 
 USER_INFO_URL = WANIKANI_ROOT_URL + "/user-information"
 VOCABULARY_URL = WANIKANI_ROOT_URL + "/vocabulary/{}"
+
+API_KEY_FROM_URL = re.compile(r"/api/user/([^/]+)")
@@ -13,7 +13,28 @@ class InvalidArguments(WanikaniAPIException):
     pass
 
 
+class WanikaniConnectionError(WanikaniAPIException):
+    pass
+
+
+class WanikaniRateLimitExceeded(WanikaniAPIException):
+    pass
+
+
 ExceptionSelector = {
     constants.INVALID_WK_API_ERROR: InvalidWaniKaniKey,
     constants.INVALID_ARGUMENTS_ERROR: InvalidArguments
 }
+
+
+def get_error(error_details):
+    """
+    Builds the exception matching an `error` block from a WaniKani response.
+    """
+    error_code = error_details['code']
+    error_message = error_details['message']
+
+    if error_code in ExceptionSelector:
+        return ExceptionSelector[error_code](error_message)
+    else:
+        return WanikaniAPIException(error_message)
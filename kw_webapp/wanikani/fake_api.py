@@ -0,0 +1,142 @@
+"""
+Synthetic WaniKani v1 API responses, for load testing syncs without touching the real WaniKani.
+
+Fake users are identified by their API key, FAKE_API_KEY_PREFIX followed by a user number. Everything served for a user
+is derived from that number, so the fake server and the load test harness agree on what a user has unlocked without
+sharing any state.
+"""
+import random
+import zlib
+
+from kw_webapp import constants as kw_constants
+from . import constants
+
+FAKE_API_KEY_PREFIX = "fake-key-"
+
+_SRS_STAGES = [("apprentice", 1), ("apprentice", 2), ("apprentice", 3), ("apprentice", 4), ("guru", 5), ("guru", 6),
+               ("master", 7), ("enlightened", 8), ("burned", 9)]
+
+
+def fake_api_key(user_number):
+    return "{}{}".format(FAKE_API_KEY_PREFIX, user_number)
+
+
+def fake_user_number(api_key):
+    """
+    :return: the user number encoded in a fake API key, or None if it isn't one.
+    """
+    if not api_key.startswith(FAKE_API_KEY_PREFIX):
+        return None
+    try:
+        return int(api_key[len(FAKE_API_KEY_PREFIX):])
+    except ValueError:
+        return None
+
+
+def fake_user_level(user_number, max_level=kw_constants.LEVEL_MAX):
+    return zlib.crc32(str(user_number).encode("utf-8")) % max_level + 1
+
+
+def fake_user_information(user_number, max_level=kw_constants.LEVEL_MAX):
+    return {
+        "username": "fake{}".format(user_number),
+        "gravatar": "",
+        "level": fake_user_level(user_number, max_level),
+        "title": "Turtles",
+        "about": "",
+        "website": "",
+        "twitter": "",
+        "topics_count": 0,
+        "posts_count": 0,
+        "creation_date": 1373371374,
+        "vacation_date": None,
+    }
+
+
+def fake_vocabulary(user_number, level, index, max_level=kw_constants.LEVEL_MAX):
+    vocabulary = {
+        "character": "語{}-{}".format(level, index),
+        "kana": "ご{}-{}".format(level, index),
+        "meaning": "word {} of level {}".format(index, level),
+        "level": level,
+        "user_specific": None,
+    }
+    if level > fake_user_level(user_number, max_level):
+        return vocabulary
+
+    # Stable per user and item, so repeated syncs see the same data.
+    seed = zlib.crc32("{}:{}:{}".format(user_number, level, index).encode("utf-8"))
+    srs, srs_numeric = _SRS_STAGES[seed % len(_SRS_STAGES)]
+    vocabulary["user_specific"] = {
+        "srs": srs,
+        "srs_numeric": srs_numeric,
+        "unlocked_date": 1382674360,
+        "available_date": 1398364200,
+        "burned": srs == "burned",
+        "burned_date": 1398364287 if srs == "burned" else 0,
+        "meaning_correct": 8, "meaning_incorrect": 0, "meaning_max_streak": 8, "meaning_current_streak": 8,
+        "reading_correct": 8, "reading_incorrect": 0, "reading_max_streak": 8, "reading_current_streak": 8,
+        "meaning_note": None,
+        "reading_note": None,
+        "user_synonyms": ["synonym {}".format(index)] if seed % 10 == 0 else None,
+    }
+    return vocabulary
+
+
+def fake_vocabulary_response(user_number, levels, items_per_level, max_level=kw_constants.LEVEL_MAX):
+    return {
+        "user_information": fake_user_information(user_number, max_level),
+        "requested_information": [fake_vocabulary(user_number, level, index, max_level)
+                                  for level in levels for index in range(items_per_level)],
+    }
+
+
+def user_not_found_response():
+    return {"error": {"code": constants.INVALID_WK_API_ERROR, "message": "User does not exist."}}
+
+
+class FakeWanikani(object):
+    """
+    Answers WaniKani v1 API paths with synthetic data, optionally failing some requests.
+
+    :param items_per_level: vocabulary served for each level.
+    :param max_level: highest level a fake user can be at.
+    :param error_rate: fraction of requests answered with error_status instead.
+    :param error_status: HTTP status used for injected errors.
+    """
+
+    def __init__(self, items_per_level=50, max_level=kw_constants.LEVEL_MAX, error_rate=0.0, error_status=503,
+                 random_source=None):
+        self.items_per_level = items_per_level
+        self.max_level = max_level
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random_source or random.Random()
+
+    def respond(self, path):
+        """
+        :return: (HTTP status, JSON body) for the given request path.
+        """
+        if self.error_rate and self.random.random() < self.error_rate:
+            return self.error_status, {"error": {"code": "injected_error", "message": "Injected failure."}}
+
+        parts = path.strip("/").split("/")
+        if len(parts) < 4 or parts[:2] != ["api", "user"]:
+            return 404, {"error": {"code": "not_found", "message": "Unknown path."}}
+
+        user_number = fake_user_number(parts[2])
+        if user_number is None:
+            return 401, user_not_found_response()
+
+        if parts[3] == "user-information":
+            return 200, {"user_information": fake_user_information(user_number, self.max_level)}
+
+        if parts[3] == "vocabulary" and len(parts) == 5:
+            try:
+                levels = [int(level) for level in parts[4].split(",") if level]
+            except ValueError:
+                return 400, {"error": {"code": constants.INVALID_ARGUMENTS_ERROR, "message": "Bad levels."}}
+            levels = [level for level in levels if 1 <= level <= self.max_level]
+            return 200, fake_vocabulary_response(user_number, levels, self.items_per_level, self.max_level)
+
+        return 404, {"error": {"code": "not_found", "message": "Unknown path."}}
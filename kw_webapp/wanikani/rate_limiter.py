@@ -0,0 +1,172 @@
+import hashlib
+import time
+
+import logging
+import redis
+from django.conf import settings
+
+from kw_webapp.redis_connection import get_redis_connection
+from . import exceptions
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_BUCKET_KEY = "kw:wanikani:rate_limit:global"
+# Formatted with a sha256 of the API key, so that keys don't show up in redis in plain text.
+API_KEY_BUCKET_KEY = "kw:wanikani:rate_limit:key:{}"
+METRICS_KEY = "kw:wanikani:rate_limit:metrics"
+
+# After redis fails, how long to stay unthrottled before trying it again, so an outage costs one timeout per worker
+# every so often rather than one per request.
+RETRY_REDIS_AFTER_SECONDS = 30
+
+# Refills and takes one token from every bucket in KEYS, atomically. ARGV is the current time followed by a
+# (rate, capacity) pair per bucket. Returns "0" if a token was taken from every bucket, otherwise the number of seconds
+# until all of them will have one, without taking anything. Returned as a string as redis truncates lua numbers.
+TOKEN_BUCKET_SCRIPT = """
+local now = tonumber(ARGV[1])
+local wait = 0
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local capacity = tonumber(ARGV[i * 2 + 1])
+    local bucket = redis.call('HMGET', key, 'tokens', 'updated')
+    local available = tonumber(bucket[1]) or capacity
+    local updated = tonumber(bucket[2]) or now
+    available = math.min(capacity, available + math.max(0, now - updated) * rate)
+    if available < 1 then
+        wait = math.max(wait, (1 - available) / rate)
+    end
+    tokens[i] = available
+end
+if wait == 0 then
+    for i, key in ipairs(KEYS) do
+        local rate = tonumber(ARGV[i * 2])
+        local capacity = tonumber(ARGV[i * 2 + 1])
+        redis.call('HMSET', key, 'tokens', tokens[i] - 1, 'updated', now)
+        redis.call('EXPIRE', key, math.ceil(capacity / rate) + 1)
+    end
+end
+return tostring(wait)
+"""
+
+
+class WanikaniRateLimiter(object):
+    """
+    Cluster-wide token bucket limiter for WaniKani requests, shared by every web and celery worker through redis. Each
+    request needs a token from the global bucket and from the bucket of the API key it is made with.
+
+    If redis can't be reached we fail open: being briefly unthrottled is better than stalling every sync.
+    """
+
+    def __init__(self, connection=None, global_rate=None, global_burst=None, per_key_rate=None, per_key_burst=None,
+                 max_wait=None):
+        self.connection = connection or get_redis_connection()
+        self.global_limit = (settings.WANIKANI_GLOBAL_REQUESTS_PER_SECOND if global_rate is None else global_rate,
+                             settings.WANIKANI_GLOBAL_BURST if global_burst is None else global_burst)
+        self.per_key_limit = (settings.WANIKANI_PER_KEY_REQUESTS_PER_SECOND if per_key_rate is None else per_key_rate,
+                              settings.WANIKANI_PER_KEY_BURST if per_key_burst is None else per_key_burst)
+        self.max_wait = settings.WANIKANI_RATE_LIMIT_MAX_WAIT_SECONDS if max_wait is None else max_wait
+        self._take_token = self.connection.register_script(TOKEN_BUCKET_SCRIPT)
+        self._redis_unavailable_until = 0
+
+    def _time_until_token(self, api_key):
+        keys = [GLOBAL_BUCKET_KEY]
+        args = [time.time()] + list(self.global_limit)
+        if api_key:
+            keys.append(API_KEY_BUCKET_KEY.format(hashlib.sha256(api_key.encode("utf-8")).hexdigest()))
+            args.extend(self.per_key_limit)
+        return float(self._take_token(keys=keys, args=args))
+
+    def acquire(self, api_key=None, max_wait=None):
+        """
+        Blocks until a WaniKani request may be made with the given key.
+
+        :param api_key: The API key the request will be made with, if any.
+        :param max_wait: how long to wait at most. Defaults to the limiter's max_wait (see
+        WANIKANI_RATE_LIMIT_MAX_WAIT_SECONDS); callers serving a web request should pass something much shorter.
+        :return: the number of seconds spent waiting.
+        :raises WanikaniRateLimitExceeded: if a token isn't available within max_wait.
+        """
+        max_wait = self.max_wait if max_wait is None else max_wait
+        started = time.monotonic()
+        if started < self._redis_unavailable_until:
+            return 0
+
+        while True:
+            try:
+                wait = self._time_until_token(api_key)
+            except redis.RedisError as e:
+                logger.warning("WaniKani rate limiter unavailable, proceeding unthrottled: {}".format(e))
+                self._redis_unavailable_until = time.monotonic() + RETRY_REDIS_AFTER_SECONDS
+                return 0
+
+            if wait <= 0:
+                break
+
+            if time.monotonic() - started + wait > max_wait:
+                self._record_wait(time.monotonic() - started, gave_up=True)
+                raise exceptions.WanikaniRateLimitExceeded(
+                    "Waited too long for a WaniKani rate limit token ({:.1f}s)".format(time.monotonic() - started))
+            time.sleep(wait)
+
+        waited = time.monotonic() - started
+        self._record_wait(waited)
+        return waited
+
+    def _record_wait(self, waited, gave_up=False):
+        if waited > 0:
+            logger.debug("Waited {:.3f}s for a WaniKani rate limit token".format(waited))
+        try:
+            pipeline = self.connection.pipeline(transaction=False)
+            pipeline.hincrby(METRICS_KEY, "acquisitions", 0 if gave_up else 1)
+            pipeline.hincrbyfloat(METRICS_KEY, "wait_seconds_total", waited)
+            if waited > 0:
+                pipeline.hincrby(METRICS_KEY, "throttled", 1)
+            if gave_up:
+                pipeline.hincrby(METRICS_KEY, "gave_up", 1)
+            pipeline.execute()
+        except redis.RedisError as e:
+            logger.warning("Couldn't record WaniKani rate limiter metrics: {}".format(e))
+
+    def metrics(self):
+        """
+        :return: cluster-wide totals: acquisitions, throttled acquisitions, acquisitions which gave up, and total
+        seconds spent waiting on the limiter.
+        """
+        raw_metrics = self.connection.hgetall(METRICS_KEY)
+        return {
+            "acquisitions": int(raw_metrics.get(b"acquisitions", 0)),
+            "throttled": int(raw_metrics.get(b"throttled", 0)),
+            "gave_up": int(raw_metrics.get(b"gave_up", 0)),
+            "wait_seconds_total": float(raw_metrics.get(b"wait_seconds_total", 0)),
+        }
+
+    def log_metrics(self):
+        """
+        Logs the cluster-wide totals returned by metrics.
+
+        :return: the metrics, or None if redis is unavailable.
+        """
+        try:
+            metrics = self.metrics()
+        except redis.RedisError as e:
+            logger.warning("Couldn't read WaniKani rate limiter metrics: {}".format(e))
+            return None
+        logger.info("WaniKani rate limiter: {} acquisitions, {} throttled, {} gave up, {:.1f}s spent waiting".format(
+            metrics["acquisitions"], metrics["throttled"], metrics["gave_up"], metrics["wait_seconds_total"]))
+        return metrics
+
+
+_rate_limiter = None
+
+
+def get_rate_limiter():
+    """
+    Returns this process' shared limiter, or None if rate limiting is disabled.
+    """
+    global _rate_limiter
+    if not settings.WANIKANI_RATE_LIMIT_ENABLED:
+        return None
+    if _rate_limiter is None:
+        _rate_limiter = WanikaniRateLimiter()
+    return _rate_limiter
@@ -0,0 +1,133 @@
+"""
+Incremental parsing of WaniKani responses.
+
+A full sync page can hold thousands of vocabulary, and parsing it with response.json() keeps the raw body, the decoded
+text and every parsed item in memory at once. iter_object_items instead walks the top level object of a JSON document
+as it streams in, and hands back the items of one array member at a time, so only a chunk of text and the current item
+are ever held. iter_array_items does the same for documents which are a bare array, such as local data dumps.
+"""
+import codecs
+import json
+
+_WHITESPACE = " \t\n\r"
+# Characters which can carry on a number that has been decoded so far.
+_NUMBER_CHARACTERS = ".eE+-0123456789"
+
+
+class _StreamReader(object):
+
+    def __init__(self, chunks, encoding="utf-8"):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+        self._decoder_finished = False
+        self.buffer = ""
+        self.position = 0
+
+    def _read_more(self):
+        if self._decoder_finished:
+            return False
+        # Drop what has already been consumed so the buffer stays around one chunk in size.
+        self.buffer = self.buffer[self.position:]
+        self.position = 0
+        for chunk in self._chunks:
+            text = self._decoder.decode(chunk)
+            if text:
+                self.buffer += text
+                return True
+        self.buffer += self._decoder.decode(b"", final=True)
+        self._decoder_finished = True
+        return True
+
+    def peek(self):
+        """
+        Skips whitespace and returns the next character without consuming it, or None at the end of the document.
+        """
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in _WHITESPACE:
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self._read_more():
+                return None
+
+    def expect(self, characters):
+        character = self.peek()
+        if character is None or character not in characters:
+            raise ValueError("Expected one of {!r} at offset {}, got {!r}".format(characters, self.position, character))
+        self.position += 1
+        return character
+
+    def value(self, decoder):
+        """
+        Decodes the next JSON value, reading more of the stream for as long as the value is incomplete.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buffer, self.position)
+            except ValueError:
+                if not self._read_more():
+                    raise
+                continue
+            # A number split across chunks decodes as its first part, e.g. "123." as 123, so only trust it once
+            # something which can't belong to it follows.
+            if (isinstance(value, (int, float)) and not isinstance(value, bool) and not self._decoder_finished
+                    and (end == len(self.buffer) or self.buffer[end] in _NUMBER_CHARACTERS) and self._read_more()):
+                continue
+            self.position = end
+            return value
+
+
+def _iter_array(reader, decoder):
+    reader.expect("[")
+    if reader.peek() == "]":
+        reader.expect("]")
+        return
+    while True:
+        yield reader.value(decoder)
+        if reader.expect(",]") == "]":
+            return
+
+
+def iter_array_items(chunks):
+    """
+    Incrementally parses a JSON document whose top level is an array, yielding its elements one at a time.
+
+    :param chunks: iterable of bytes, e.g. the blocks of a file opened in binary mode.
+    """
+    reader = _StreamReader(chunks)
+    for item in _iter_array(reader, json.JSONDecoder()):
+        yield item
+    if reader.peek() is not None:
+        raise ValueError("Unexpected data after the end of the array at offset {}".format(reader.position))
+
+
+def iter_object_items(chunks, array_key, on_member=None):
+    """
+    Incrementally parses a JSON object from an iterable of byte chunks, yielding the elements of its array_key member
+    one at a time.
+
+    :param chunks: iterable of bytes, e.g. response.iter_content().
+    :param array_key: name of the top level member whose elements should be streamed.
+    :param on_member: called with (key, value) for every other top level member, as soon as it has been parsed. It may
+    raise to stop parsing, e.g. on a WaniKani error.
+    """
+    decoder = json.JSONDecoder()
+    reader = _StreamReader(chunks)
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+
+    while True:
+        key = reader.value(decoder)
+        reader.expect(":")
+        if key == array_key and reader.peek() == "[":
+            for item in _iter_array(reader, decoder):
+                yield item
+        else:
+            member = reader.value(decoder)
+            if on_member is not None:
+                on_member(key, member)
+
+        if reader.expect(",}") == "}":
+            return
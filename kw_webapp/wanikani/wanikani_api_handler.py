@@ -1,41 +1,35 @@
-import requests
 import logging
-from . import constants
-from . import exceptions
-
-logger = logging.getLogger(__name__)
-
-
-def _has_no_errors(response):
-    return response and "error" not in response.json() and response.status_code == 200
 
+from .client import get_client
 
-def _has_invalid_key_error(response):
-    response = response.json()
-    error_details = response['error']
-    return error_details['code'] == constants.INVALID_WK_API_ERROR
-
-
-def _get_error(response):
-    response = response.json()
-    error_details = response['error']
-    error_code = error_details['code']
-    error_message = error_details['message']
+logger = logging.getLogger(__name__)
 
-    if error_code in exceptions.ExceptionSelector:
-        error = exceptions.ExceptionSelector[error_code]
-        return error(error_message)
-    else:
-        return exceptions.WanikaniAPIException(error_details['message'])
+VOCABULARY_FIELDS = ("character", "kana", "meaning", "level")
+USER_SPECIFIC_FIELDS = ("srs", "srs_numeric", "burned", "user_synonyms")
 
 
 def make_api_call(api_url):
-    response = requests.get(api_url)
-    if response.status_code == 200:
-        if _has_no_errors(response):
-            return response.json()
-        else:
-            raise _get_error(response)
-
-    if response.status_code == 401:
-        raise exceptions.InvalidWaniKaniKey("Got a 401 from Wanikani!")
+    return get_client().get(api_url)
+
+
+def compact_vocabulary(vocabulary_json):
+    """
+    Keeps only the parts of a WaniKani vocabulary item which syncing uses. Streaks, notes, dates and the like are
+    dropped, which shrinks each item several times over.
+    """
+    compact = dict((field, vocabulary_json[field]) for field in VOCABULARY_FIELDS)
+    user_specific = vocabulary_json.get("user_specific")
+    if user_specific is not None:
+        user_specific = dict((field, user_specific.get(field)) for field in USER_SPECIFIC_FIELDS)
+    compact["user_specific"] = user_specific
+    return compact
+
+
+def fetch_vocabulary(api_url):
+    """
+    Streams a WaniKani vocabulary response, compacting each item as soon as it has been parsed, so that neither the raw
+    body nor the full items are ever held for the whole page.
+
+    :return: list of compacted vocabulary items, locked ones included.
+    """
+    return [compact_vocabulary(vocabulary_json) for vocabulary_json in get_client().iter_items(api_url)]